@@ -39,70 +39,51 @@ import os
 import sys
 import argparse
 import numpy as np
-from ts_library import integrate, derivative
+from file_utilities import read_data_chunks, write_velocity_chunks, \
+    READ_CHUNK_SIZE
 
-def get_dt(input_file):
+# Format of each data line in the output files
+DATA_FORMAT = "%1.9E %1.9E %1.9E %1.9E\n"
+
+def read_awp_chunks(input_fp, chunk_size=READ_CHUNK_SIZE):
     """
-    Read AWP file and return DT
+    Reads the open input file in awp format one block of lines at a
+    time, yields delta_t and arrays containing the time, vel_ns, vel_ew,
+    vel_ud components for each block
     """
-    val1 = None
-    val2 = None
-    file_dt = None
-
-    # Figure out dt first, we need it later
-    ifile = open(input_file)
-    for line in ifile:
-        # Skip comments
-        if line.startswith("#") or line.startswith("%"):
-            continue
-        pieces = line.split()
-        pieces = [float(piece) for piece in pieces]
-        if val1 is None:
-            val1 = pieces[0]
-            continue
-        if val2 is None:
-            val2 = pieces[0]
-            break
-    ifile.close()
+    delta_t = None
+    pending = []
+
+    for rows in read_data_chunks(input_fp, chunk_size):
+        if delta_t is None:
+            # Figure out dt first from the first two lines
+            pending.append(rows)
+            rows = np.concatenate(pending)
+            if rows.shape[0] < 2:
+                continue
+            delta_t = rows[1][0] - rows[0][0]
+            # Timeseries starts with a zero sample at t = 0
+            first_row = np.zeros((1, rows.shape[1]))
+            first_row[0][0] = -delta_t
+            rows = np.vstack([first_row, rows])
+
+        # Note that in AWP files, channels are EW/NS/UD instead of NS/EW/UD
+        yield (delta_t, rows[:, 0] + delta_t,
+               rows[:, 2], rows[:, 1], rows[:, 3])
 
     # Quit if cannot figure out dt
-    if val1 is None or val2 is None:
+    if delta_t is None:
         print("Cannot determine dt from AWP file! Exiting...")
         sys.exit(1)
 
-    # Calculate dt
-    file_dt = val2 - val1
-
-    return file_dt
-# end get_dt
-
 def read_awp(input_file):
     """
     Reads the input file in awp format and returns arrays containing
     vel_ns, vel_ew, vel_ud components
     """
-    time = np.array([0.0])
-    vel_ns = np.array([0.0])
-    vel_ew = np.array([0.0])
-    vel_ud = np.array([0.0])
-
-    # Get AWP file dt
-    delta_t = get_dt(input_file)
-
     try:
         input_fp = open(input_file, 'r')
-        for line in input_fp:
-            line = line.strip()
-            if line.startswith("#") or line.startswith("%"):
-                continue
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            # Add values to out arrays
-            # Note that in AWP files, channels are EW/NS/UD instead of NS/EW/UD
-            time = np.append(time, pieces[0] + delta_t)
-            vel_ew = np.append(vel_ew, pieces[1])
-            vel_ns = np.append(vel_ns, pieces[2])
-            vel_ud = np.append(vel_ud, pieces[3])
+        chunks = list(read_awp_chunks(input_fp))
     except IOError as e:
         print(e)
         sys.exit(1)
@@ -110,6 +91,11 @@ def read_awp(input_file):
     # All done
     input_fp.close()
 
+    delta_t = chunks[0][0]
+    time, vel_ns, vel_ew, vel_ud = [np.concatenate([chunk[i] for
+                                                    chunk in chunks])
+                                    for i in range(1, 5)]
+
     return delta_t, time, vel_ns, vel_ew, vel_ud
 
 def write_bbp_header(out_fp, file_type, file_unit, args):
@@ -174,41 +160,28 @@ def awp2bbp_main():
     output_file_acc = "%s.acc.bbp" % (os.path.join(args.output_dir,
                                                    args.output_stem))
 
-    # Read AWP file
-    delta_t, times, vel_h1, vel_h2, vel_ver = read_awp(input_file)
-
-    # Calculate displacement
-    dis_h1 = integrate(vel_h1, delta_t)
-    dis_h2 = integrate(vel_h2, delta_t)
-    dis_ver = integrate(vel_ver, delta_t)
-
-    # Calculate acceleration
-    acc_h1 = derivative(vel_h1, delta_t)
-    acc_h2 = derivative(vel_h2, delta_t)
-    acc_ver = derivative(vel_ver, delta_t)
-
-    # Write header
+    # Convert AWP file one block at a time
+    try:
+        input_fp = open(input_file, 'r')
+    except IOError as e:
+        print(e)
+        sys.exit(1)
     o_dis_file = open(output_file_dis, 'w')
     o_vel_file = open(output_file_vel, 'w')
     o_acc_file = open(output_file_acc, 'w')
+
+    # Write header
     write_bbp_header(o_dis_file, "displacement", 'm', args)
     write_bbp_header(o_vel_file, "velocity", 'm/s', args)
     write_bbp_header(o_acc_file, "acceleration", 'm/s^2', args)
 
-    # Write files
-    for (time, disp_h1, disp_h2, disp_ver,
-         velo_h1, velo_h2, velo_ver,
-         accel_h1, accel_h2, accel_ver) in zip(times, dis_h1, dis_h2, dis_ver,
-                                               vel_h1, vel_h2, vel_ver,
-                                               acc_h1, acc_h2, acc_ver):
-        o_dis_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, disp_h1, disp_h2, disp_ver))
-        o_vel_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, velo_h1, velo_h2, velo_ver))
-        o_acc_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, accel_h1, accel_h2, accel_ver))
+    # Write files, calculating displacement and acceleration as we go
+    write_velocity_chunks(read_awp_chunks(input_fp),
+                          o_dis_file, o_vel_file, o_acc_file,
+                          line_format=DATA_FORMAT)
 
     # All done
+    input_fp.close()
     o_dis_file.close()
     o_vel_file.close()
     o_acc_file.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Utility to convert sets of BBP files into a single archive file
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import argparse
+import numpy as np
+
+# Import seismtools needed functions
+from ts_library import array_to_station
+from file_utilities import get_bbp_filenames, read_bbp_data, \
+    parse_orientation_bbp
+from ts_archive import ArchiveWriter
+
+def parse_arguments():
+    """
+    This function takes care of parsing the command-line arguments and
+    asking the user for any missing parameters that we need
+    """
+    parser = argparse.ArgumentParser(description="Converts sets of "
+                                     "dis/vel/acc BBP files into a single "
+                                     "archive file.")
+    parser.add_argument("-o", "--output", dest="outfile", required=True,
+                        help="output archive file")
+    parser.add_argument("-d", "--dir", dest="indir",
+                        help="input directory, all BBP files are converted")
+    parser.add_argument('input_files', nargs='*',
+                        help="BBP files, one of each dis/vel/acc set")
+    args = parser.parse_args()
+
+    if not args.input_files and args.indir is None:
+        print("[ERROR]: Please specify input files or directory!")
+        sys.exit(-1)
+
+    return args
+
+def get_station_list(args):
+    """
+    Returns the list of station stems to convert, a stem is the
+    BBP filename without the .{dis,vel,acc}.bbp extensions
+    """
+    input_files = list(args.input_files)
+    if args.indir is not None:
+        for item in sorted(os.listdir(args.indir)):
+            if item.lower().endswith(".vel.bbp"):
+                input_files.append(os.path.join(args.indir, item))
+
+    stems = []
+    for input_file in input_files:
+        dirname = os.path.dirname(input_file)
+        basename = os.path.basename(input_file)
+        stem = os.path.join(dirname, '.'.join(basename.split('.')[0:-2]))
+        if stem not in stems:
+            stems.append(stem)
+
+    return stems
+
+def read_bbp_station(stem):
+    """
+    Reads the dis/vel/acc BBP files for a station, returns the
+    station and its metadata, including the header of each file
+    """
+    bbp_files = get_bbp_filenames("%s.vel.bbp" % (stem))
+    headers = {}
+    arrays = []
+    for quantity, bbp_file in zip(['dis', 'vel', 'acc'], bbp_files):
+        print("[READING]: %s" % (bbp_file))
+        file_metadata, data = read_bbp_data(bbp_file)
+        headers[quantity] = file_metadata.pop('header')
+        if quantity == 'vel':
+            metadata = file_metadata
+        arrays.append(data)
+
+    # Stack data as (quantity, component, samples)
+    samples = min([data.shape[1] for data in arrays])
+    data = np.array([data[1:4, 0:samples] for data in arrays])
+    orientation = parse_orientation_bbp(metadata['orientation'],
+                                        bbp_files[1])
+    metadata['headers'] = headers
+
+    return array_to_station(data, arrays[1][0][1], orientation), metadata
+
+def bbp2tsa_main():
+    """
+    Main function for the bbp2tsa conversion utility
+    """
+    args = parse_arguments()
+    stems = get_station_list(args)
+
+    archive = ArchiveWriter(args.outfile)
+    for stem in stems:
+        station, metadata = read_bbp_station(stem)
+        archive.add_station(os.path.basename(stem), station, metadata)
+    archive.close()
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    bbp2tsa_main()
+# end of main program
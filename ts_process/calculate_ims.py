@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Computes the intensity measures (see im_library) of a number of
+stations and writes them to a table, one line per station component
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import argparse
+
+# Import seismtools needed functions
+from file_utilities import read_files
+from im_library import calculate_station_ims, write_im_table
+
+def parse_arguments():
+    """
+    This function takes care of parsing the command-line arguments and
+    asking the user for any missing parameters that we need
+    """
+    parser = argparse.ArgumentParser(description="Computes intensity "
+                                     "measures for a number of "
+                                     "timeseries files.")
+    parser.add_argument("-o", "--output", dest="outfile", required=True,
+                        help="output intensity measure table")
+    parser.add_argument("--cache", dest="cache", action="store_true",
+                        help="keep binary copies of the bbp input files "
+                        "to speed up subsequent runs")
+    parser.add_argument('input_files', nargs='*',
+                        help="bbp files or archive.tsa:station entries")
+    args = parser.parse_args()
+
+    if not args.input_files:
+        print("[ERROR]: Please provide at least one input file!")
+        sys.exit(-1)
+
+    return args
+
+def get_station_name(filename):
+    """
+    Returns the station name for an input file: the station of an
+    archive entry, or the bbp filename up to the first dot
+    """
+    if ':' in os.path.basename(filename):
+        return filename.split(':')[-1]
+    return os.path.basename(filename).split('.')[0]
+
+def calculate_ims_main():
+    """
+    Main function for calculate_ims
+    """
+    # Parse command-line options
+    args = parse_arguments()
+
+    # Read data, in cm
+    _, stations = read_files(None, args.input_files, use_cache=args.cache)
+    names = [get_station_name(filename) for filename in args.input_files]
+
+    table = calculate_station_ims(stations, names=names)
+    print("[WRITING]: %s" % (args.outfile))
+    write_im_table(args.outfile, table)
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    calculate_ims_main()
+# end of main program
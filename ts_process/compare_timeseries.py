@@ -36,12 +36,15 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import sys
 import argparse
 import matplotlib as mpl
 if mpl.get_backend() != 'agg':
     mpl.use('Agg') # Disables use of Tk/X11
 from file_utilities import read_file
-from ts_library import calculate_distance, filter_timeseries
+from station_index import StationIndex
+from ts_library import calculate_distance, filter_stations
+from ts_cache import enable_cache
 from ts_plot_library import comparison_plot
 
 def parse_arguments():
@@ -65,6 +68,8 @@ def parse_arguments():
                         help="station name")
     parser.add_argument("--station-list", dest="station_list",
                         help="station list with latitude and longitude")
+    parser.add_argument("--station-index", dest="station_index",
+                        help="station index created by station_index.py")
     parser.add_argument("--xmin", dest="xmin", type=float,
                         help="xmin for plotting timeseries")
     parser.add_argument("--xmax", dest="xmax", type=float,
@@ -88,6 +93,12 @@ def parse_arguments():
                         default=False, action='store_true',
                         help="Generate acceleration plots instead of velocity")
 
+    parser.add_argument("--cache", dest="cache", action="store_true",
+                        help="keep binary copies of the bbp input files "
+                        "to speed up subsequent runs")
+    parser.add_argument("--results-cache", dest="results_cache",
+                        help="directory where results of expensive "
+                        "computations are cached across runs")
     parser.add_argument('input_files', nargs='*')
     args = parser.parse_args()
 
@@ -152,11 +163,8 @@ def process_for_plotting(stations, args):
 
     print("[PROCESSING]: Filter: butter %s %1.1f %1.1f" % (btype,
                                                            lowf, highf))
-    for station in stations:
-        for i in range(0, 3):
-            station[i] = filter_timeseries(station[i],
-                                           family='butter', btype=btype,
-                                           fmin=lowf, fmax=highf, N=4)
+    stations = filter_stations(stations, family='butter', btype=btype,
+                               fmin=lowf, fmax=highf, N=4)
 
     return stations
 
@@ -186,32 +194,23 @@ def compare_timeseries_main():
     if args.station is not None:
         plot_title = "%s, Freq: %s" % (args.station, freqs)
 
+    # Load station index, if provided
+    st_index = None
+    if args.station_index is not None:
+        st_index = StationIndex(args.station_index)
+        # Check plot window before reading any data
+        st_index.check_xmax(filenames, args.xmax)
+
     # Set title if station name provided and epicenter are provided
     if args.station is not None and args.epicenter is not None:
         # Calculate distance if locations are provided
+        if args.st_loc is None and st_index is not None:
+            args.st_loc = st_index.get_location(args.station)
         if args.st_loc is None and args.station_list is not None:
             # Find station coordinates from station list
-            st_file = open(args.station_list, 'r')
-            for line in st_file:
-                line = line.strip()
-                if not line:
-                    # skip blank lines
-                    continue
-                if line.startswith("#") or line.startswith("%"):
-                    # Skip comments
-                    continue
-                pieces = line.split()
-                if len(pieces) < 3:
-                    # Skip line with insufficient tokens
-                    continue
-                if pieces[2].lower() != args.station.lower():
-                    # Not a match
-                    continue
-                # Match!
-                args.st_loc = [float(pieces[1]), float(pieces[0])]
-                break
-            # All done processing station file
-            st_file.close()
+            st_list = StationIndex()
+            st_list.add_station_list(args.station_list)
+            args.st_loc = st_list.get_location(args.station)
 
         if args.st_loc is not None:
             # Calculate distance here
@@ -220,8 +219,13 @@ def compare_timeseries_main():
             plot_title = "%s, Dist: ~%dkm, Freq: %s" % (args.station,
                                                         distance, freqs)
 
-    # Read data
-    stations = [read_file(filename) for filename in filenames]
+    # Cache spectra and filtered timeseries across runs, if requested
+    if args.results_cache is not None:
+        enable_cache(args.results_cache)
+
+    # Read data, displacement is not plotted so it is only read if needed
+    stations = [read_file(filename, use_cache=args.cache, lazy=True)
+                for filename in filenames]
     filenames = [os.path.basename(filename) for filename in filenames]
 
     # Perform any processing requested by the user
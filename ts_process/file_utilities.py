@@ -38,10 +38,32 @@ from __future__ import division, print_function, absolute_import
 # Import Python modules
 import os
 import sys
+import json
+import struct
+import itertools
 import numpy as np
+from functools import partial
 
 # Import seismtools needed classes
-from ts_library import TimeseriesComponent
+from ts_library import TimeseriesComponent, station_to_array, \
+    array_to_station, ChunkedIntegrator, ChunkedDerivative, \
+    STATION_QUANTITIES
+from ts_archive import is_archive_file, read_file_archive, \
+    read_archive_metadata
+
+# Format of each data line in bbp files
+BBP_DATA_FORMAT = "%5.7f   %5.9e   %5.9e    %5.9e\n"
+# Number of data lines formatted and written at once
+WRITE_CHUNK_SIZE = 10000
+# Number of data lines read and converted at once when streaming
+READ_CHUNK_SIZE = 100000
+
+# Binary sidecar cache for bbp files
+BBP_CACHE_EXTENSION = "bbpc"
+BBP_CACHE_MAGIC = b"TSBBPC01"
+BBP_CACHE_VERSION = 1
+# Data block starts at a multiple of this many bytes
+BBP_CACHE_ALIGN = 64
 
 def reverse_up_down(station):
     """
@@ -49,9 +71,8 @@ def reverse_up_down(station):
     """
     # station has 3 components [ns, ew, ud]
     # only need to flip the 3rd one
-    station[2].acc *= -1
-    station[2].vel *= -1
-    station[2].dis *= -1
+    for quantity in station[2].stored_quantities():
+        station[2].transform(quantity, np.negative)
 
     return station
 # end of reverse_up_down
@@ -59,28 +80,30 @@ def reverse_up_down(station):
 def scale_from_m_to_cm(station):
     # scales timeseries from meters to centimeters
     for i in range(0, len(station)):
-        station[i].acc *= 100
-        station[i].vel *= 100
-        station[i].dis *= 100
+        for quantity in station[i].stored_quantities():
+            station[i].transform(quantity, np.multiply, 100)
 
     return station
 # end of scale_from_m_to_cm
 
-def read_files(obs_file, input_files):
+def read_files(obs_file, input_files, use_cache=False, lazy=False):
     """
-    Reads all input files
+    Reads all input files, use_cache enables the binary bbp cache
+    and lazy defers reading quantities until they are used
     """
     # read obs data
     obs_data = None
     if obs_file is not None:
-        obs_data = read_file(obs_file)
+        metadata = {}
+        obs_data = read_file(obs_file, metadata=metadata,
+                             use_cache=use_cache, lazy=lazy)
         # Make sure we got it
         if not obs_data:
             print("[ERROR]: Reading obs file: %s!" % (obs_file))
             sys.exit(-1)
         # Fix units if needed
-        if obs_file.lower().endswith(".bbp"):
-            units = read_unit_bbp(obs_file)
+        if obs_file.lower().endswith(".bbp") or is_archive_file(obs_file):
+            units = parse_unit_bbp(metadata['units'])
             # If in meters, scale to cm
             if units == "m":
                 obs_data = scale_from_m_to_cm(obs_data)
@@ -91,14 +114,16 @@ def read_files(obs_file, input_files):
     # reads signals
     stations = []
     for input_file in input_files:
-        station = read_file(input_file)
+        metadata = {}
+        station = read_file(input_file, metadata=metadata,
+                            use_cache=use_cache, lazy=lazy)
         # Make sure we got it
         if not station:
             print("[ERROR]: Reading input file: %s!" % (input_file))
             sys.exit(-1)
         # Fix units if needed
-        if input_file.lower().endswith(".bbp"):
-            units = read_unit_bbp(input_file)
+        if input_file.lower().endswith(".bbp") or is_archive_file(input_file):
+            units = parse_unit_bbp(metadata['units'])
             # If in meters, scale to cm
             if units == "m":
                 station = scale_from_m_to_cm(station)
@@ -155,61 +180,306 @@ def read_filelist(filelist):
 # end of read_filelist
 
 # ================================ READING ================================
-def read_file(filename):
+def read_file(filename, metadata=None, use_cache=False, lazy=False):
     """
-    This function reads a timeseries file in bbp format
+    This function reads a timeseries file in bbp format, or a station
+    from an archive file (given as archive.tsa:station). If a metadata
+    dictionary is provided it is filled with the file's header. With
+    lazy set, bbp quantities other than the one given are only read
+    when used
     """
     if filename.lower().endswith(".bbp"):
         # Filename in bbp format
         print("[READING]: %s" % (filename))
-        return read_file_bbp(filename)
+        return read_file_bbp(filename, metadata=metadata,
+                             use_cache=use_cache, lazy=lazy)
+    if is_archive_file(filename):
+        # Station inside an archive file
+        print("[READING]: %s" % (filename))
+        return read_file_archive(filename, metadata=metadata)
     # Unknown file format
     print("[ERROR]: Unknown file format: %s!" % (obs_file))
     sys.exit(-1)
 # end of read_file
 
-def read_file_bbp2(filename):
+def parse_bbp_header(header):
     """
-    This function reads a bbp file and returns the timeseries in the
-    format time, h1, h2, up tuple
+    Parses the header lines of a bbp file and returns a dictionary
+    with the metadata found: station, time, stamp, lon, lat, units
+    and orientation. Missing values are set to None. The header
+    lines themselves are kept under header.
+    """
+    metadata = {'header': list(header),
+                'station': None,
+                'time': None,
+                'stamp': None,
+                'lon': None,
+                'lat': None,
+                'units': None,
+                'orientation': None}
+
+    for line in header:
+        line = line.strip()
+        if line.find("Station=") > 0 and metadata['station'] is None:
+            metadata['station'] = line[(line.find("=") + 1):].strip()
+        elif line.find("time=") > 0 and metadata['time'] is None:
+            metadata['time'] = line[(line.find("=") + 1):].strip()
+            try:
+                stamp = line.split()[2].split(',')[-1].split(':')
+                metadata['stamp'] = [float(i) for i in stamp]
+            except (IndexError, ValueError):
+                metadata['stamp'] = None
+        elif line.find("lon=") > 0 and metadata['lon'] is None:
+            try:
+                metadata['lon'] = float(line.split()[2])
+            except (IndexError, ValueError):
+                pass
+        elif line.find("lat=") > 0 and metadata['lat'] is None:
+            try:
+                metadata['lat'] = float(line.split()[2])
+            except (IndexError, ValueError):
+                pass
+        elif line.find("units=") > 0 and metadata['units'] is None:
+            metadata['units'] = line.split()[2]
+        elif line.find("orientation=") > 0 and metadata['orientation'] is None:
+            metadata['orientation'] = line[(line.find("=") + 1):].strip()
+
+    return metadata
+# end of parse_bbp_header
+
+def parse_orientation_bbp(orientation, filename):
     """
-    time = np.array([])
-    h1_comp = np.array([])
-    h2_comp = np.array([])
-    ud_comp = np.array([])
+    Converts the orientation string found in a bbp header into
+    a [h1, h2, vertical] list
+    """
+    # Make sure we got something
+    if orientation is None:
+        print("[ERROR]: Cannot find orientation in bbp file: %s!" % (filename))
+        sys.exit(-1)
+
+    orientation = orientation.split(",")
+    orientation = [val.strip() for val in orientation]
+    orientation[0] = float(orientation[0])
+    orientation[1] = float(orientation[1])
+    orientation[2] = orientation[2].lower()
+    if orientation[2] != "up" and orientation[2] != "down":
+        print("[ERROR]: Vertical orientation must be up or down!")
+        sys.exit(-1)
+
+    return orientation
+# end of parse_orientation_bbp
+
+def parse_unit_bbp(units):
+    """
+    Converts the units found in a bbp header to either "m" or "cm"
+    """
+    # Make sure we got something
+    if units is None:
+        print("[ERROR]: Cannot find units in bbp file!")
+        sys.exit(-1)
+
+    # Figure out if we have meters or centimeters
+    if units == "cm" or units == "cm/s" or units == "cm/s^2":
+        return "cm"
+    elif units == "m" or units == "m/s" or units == "m/s^2":
+        return "m"
+
+    # Invalid units in this file
+    print("[ERROR]: Cannot parse units in bbp file!")
+    sys.exit(-1)
+# end of parse_unit_bbp
+
+def read_header_bbp(filename):
+    """
+    Reads only the header lines at the top of a bbp file,
+    returns the header metadata dictionary
+    """
+    header = []
 
     try:
         input_file = open(filename, 'r')
-        for line in input_file:
+        while True:
+            line = input_file.readline()
+            if not line:
+                break
             line = line.strip()
-            if line.startswith('#') or line.startswith('%'):
-                # Skip comments
+            if not line:
+                continue
+            if not line.startswith('#') and not line.startswith('%'):
+                # Reached the data block
+                break
+            header.append(line)
+        input_file.close()
+    except IOError:
+        print("[ERROR]: No such file.")
+        sys.exit(-1)
+
+    return parse_bbp_header(header)
+# end of read_header_bbp
+
+def get_line_columns(text):
+    """
+    Returns an array with the number of whitespace-separated values
+    on each line of text, computed without splitting the lines
+    """
+    chars = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8)
+    # Whitespace and other control characters
+    spaces = chars <= ord(' ')
+    # A value starts at a non-space character after a space
+    starts = ~spaces
+    starts[1:] &= spaces[:-1]
+    starts = np.flatnonzero(starts)
+    ends = np.append(np.flatnonzero(chars == ord('\n')), chars.size)
+    return np.diff(np.searchsorted(starts, ends), prepend=0)
+
+def read_text_columns(filename):
+    """
+    Reads a text file with a block of numeric columns in a single pass,
+    returning the comment lines found in the file (in order) and a
+    (columns, samples) array with the data
+    """
+    header = []
+    first_line = None
+
+    try:
+        input_file = open(filename, 'r')
+        # Header lines are at the top of the file
+        while True:
+            line = input_file.readline()
+            if not line:
+                break
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('#') or stripped.startswith('%'):
+                header.append(stripped)
                 continue
-            # Trim in-line comments
-            if line.find('#') > 0:
+            first_line = line
+            break
+        # Now get the entire numeric block at once
+        body = input_file.read()
+        input_file.close()
+    except IOError:
+        print("[ERROR]: error reading file: %s" % (filename))
+        sys.exit(1)
+
+    if first_line is None:
+        # No data in this file
+        return header, np.empty((0, 0))
+    body = first_line + body
+
+    # Skip comment lines and trim in-line comments, only if the file
+    # has any
+    if body.find('#') >= 0 or body.find('%') >= 0:
+        lines = []
+        for line in body.splitlines():
+            stripped = line.strip()
+            if stripped.startswith('#') or stripped.startswith('%'):
+                header.append(stripped)
+                continue
+            if line.find('#') >= 0:
                 line = line[:line.find('#')]
-            if line.find('%') > 0:
+            if line.find('%') >= 0:
                 line = line[:line.find('%')]
-            # Make them float
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            time = np.append(time, pieces[0])
-            h1_comp = np.append(h1_comp, pieces[1])
-            h2_comp = np.append(h2_comp, pieces[2])
-            ud_comp = np.append(ud_comp, pieces[3])
-    except IOError:
-        print("[ERROR]: error reading bbp file: %s" % (filename))
+            lines.append(line)
+        body = "\n".join(lines)
+        first_line = lines[0]
+
+    # All data rows must have the same number of columns
+    counts = get_line_columns(body)
+    counts = counts[counts > 0]
+    columns = len(first_line.split())
+    bad = np.nonzero(counts != columns)[0]
+    if bad.size:
+        print("[ERROR]: data row %d has %d columns instead of %d "
+              "in file: %s" % (bad[0] + 1, counts[bad[0]], columns, filename))
         sys.exit(1)
 
+    # Parse all values together
+    try:
+        values = np.array(body.split(), dtype=np.float64)
+    except ValueError:
+        print("[ERROR]: invalid data in file: %s" % (filename))
+        sys.exit(1)
+    samples = values.size // columns
+
+    data = np.empty((columns, samples), dtype=np.float64)
+    data[:] = values.reshape(samples, columns).T
+
     # All done!
-    return time, h1_comp, h2_comp, ud_comp
+    return header, data
+# end of read_text_columns
+
+def read_data_chunks(lines, chunk_size=READ_CHUNK_SIZE):
+    """
+    Reads numeric data from an iterable of text lines (e.g. an open
+    file) in blocks of chunk_size lines. Comment lines starting with
+    '#' or '%' are skipped. Yields (rows, columns) arrays.
+    """
+    lines = iter(lines)
+    columns = None
+
+    while True:
+        block = list(itertools.islice(lines, chunk_size))
+        if not block:
+            break
+        body = "".join(block)
+        if body.find('#') >= 0 or body.find('%') >= 0:
+            # Skip comments and trim in-line comments
+            block = [line.split('#')[0].split('%')[0] for line in block
+                     if not line.strip().startswith('#') and
+                     not line.strip().startswith('%')]
+            body = "".join(block)
+        values = np.array(body.split(), dtype=np.float64)
+        if not values.size:
+            continue
+        if columns is None:
+            for line in block:
+                if line.split():
+                    columns = len(line.split())
+                    break
+        if values.size % columns != 0:
+            print("[ERROR]: inconsistent number of columns in input data!")
+            sys.exit(1)
+        yield values.reshape(-1, columns)
+# end of read_data_chunks
+
+def read_bbp_data(filename):
+    """
+    Reads a bbp file in a single pass, returning the header metadata
+    and a (4, samples) array with the time, h1, h2, and up columns
+    """
+    header, data = read_text_columns(filename)
+    metadata = parse_bbp_header(header)
+
+    if data.size == 0:
+        # No data in this file
+        return metadata, np.empty((4, 0))
+    if data.shape[0] < 4:
+        print("[ERROR]: inconsistent number of columns in bbp file: %s" %
+              (filename))
+        sys.exit(1)
+
+    # All done!
+    return metadata, data[0:4]
+# end of read_bbp_data
+
+def read_file_bbp2(filename):
+    """
+    This function reads a bbp file and returns the timeseries in the
+    format time, h1, h2, up tuple
+    """
+    _, data = read_bbp_data(filename)
+
+    # All done!
+    return data[0], data[1], data[2], data[3]
 # end of read_file_bbp2
 
-def read_file_bbp(filename):
+def get_bbp_filenames(filename):
     """
-    This function reads timeseries data from a set of BBP files
+    Returns the displacement, velocity and acceleration bbp filenames
+    matching the bbp file provided
     """
-    # Get filenames for displacement, velocity and acceleration bbp files
     work_dir = os.path.dirname(filename)
     base_file = os.path.basename(filename)
 
@@ -233,26 +503,245 @@ def read_file_bbp(filename):
     vel_file = os.path.join(work_dir, '.'.join(vel_tokens))
     acc_file = os.path.join(work_dir, '.'.join(acc_tokens))
 
+    return dis_file, vel_file, acc_file
+# end of get_bbp_filenames
+
+def get_bbp_cache_filename(filename):
+    """
+    Returns the binary cache filename for the set of bbp files
+    matching filename
+    """
+    work_dir = os.path.dirname(filename)
+    base_tokens = os.path.basename(filename).split('.')[0:-2]
+
+    return os.path.join(work_dir, "%s.%s" % ('.'.join(base_tokens),
+                                             BBP_CACHE_EXTENSION))
+# end of get_bbp_cache_filename
+
+def get_bbp_cache_key(bbp_files):
+    """
+    Returns the key identifying the contents of the bbp files,
+    made of the path, size and modification time of each file
+    """
+    key = []
+    for bbp_file in bbp_files:
+        file_stat = os.stat(bbp_file)
+        key.append([os.path.abspath(bbp_file),
+                    file_stat.st_size,
+                    file_stat.st_mtime])
+
+    return key
+# end of get_bbp_cache_key
+
+def read_bbp_cache(cache_file, bbp_files, metadata=None):
+    """
+    Loads a station from the binary cache file, the timeseries are
+    memory-mapped copy-on-write so changes never reach the cache file.
+    Returns None if the cache file is missing or stale.
+    """
+    try:
+        input_file = open(cache_file, 'rb')
+        magic = input_file.read(len(BBP_CACHE_MAGIC))
+        if magic != BBP_CACHE_MAGIC:
+            input_file.close()
+            return None
+        header_size = struct.unpack("<Q", input_file.read(8))[0]
+        header = json.loads(input_file.read(header_size).decode('utf-8'))
+        input_file.close()
+        key = get_bbp_cache_key(bbp_files)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+    # Make sure the bbp files have not changed
+    if header['version'] != BBP_CACHE_VERSION or header['key'] != key:
+        return None
+
+    data = np.memmap(cache_file, dtype='<f8', mode='c',
+                     offset=header['offset'],
+                     shape=(3, 3, header['samples']))
+
+    if metadata is not None:
+        metadata.update(header['metadata'])
+    return array_to_station(data, header['dt'], header['orientation'])
+# end of read_bbp_cache
+
+def write_bbp_cache(cache_file, bbp_files, station, metadata):
+    """
+    Writes the binary cache file for a station: a small json header
+    followed by a (quantity, component, samples) float64 array
+    """
+    header = {'version': BBP_CACHE_VERSION,
+              'key': get_bbp_cache_key(bbp_files),
+              'samples': station[0].samples,
+              'dt': station[0].dt,
+              'orientation': [component.orientation for
+                              component in station],
+              'metadata': metadata}
+
+    # Data block starts after magic, header size, and padded header,
+    # leave enough room in the header for the offset itself
+    preamble = len(BBP_CACHE_MAGIC) + 8
+    offset = preamble + len(json.dumps(header)) + BBP_CACHE_ALIGN
+    offset = ((offset // BBP_CACHE_ALIGN) + 1) * BBP_CACHE_ALIGN
+    header['offset'] = offset
+    header = json.dumps(header).ljust(offset - preamble).encode('utf-8')
+
+    # Write to a temporary file, then move it in place
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    try:
+        out_fp = open(tmp_file, 'wb')
+        out_fp.write(BBP_CACHE_MAGIC)
+        out_fp.write(struct.pack("<Q", len(header)))
+        out_fp.write(header)
+        out_fp.write(station_to_array(station).astype('<f8').tobytes())
+        out_fp.close()
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        print("[WARNING]: Cannot write cache file: %s" % (cache_file))
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+# end of write_bbp_cache
+
+class BBPFileLoader(object):
+    """
+    This class reads a bbp file the first time one of its
+    columns is requested, and checks it matches the samples and dt
+    of the file the station was created from
+
+    Variables:
+
+        filename - bbp filename
+        samples - expected number of samples
+        dt - expected delta t
+        data - (4, samples) array, None until the file is read
+    """
+    def __init__(self, filename, samples, dt):
+        """
+        Keeps the filename, the file is not read yet
+        """
+        self.filename = filename
+        self.samples = samples
+        self.dt = dt
+        self.data = None
+
+    def column(self, index):
+        """
+        Returns column index (1: h1, 2: h2, 3: up) of the bbp file
+        """
+        if self.data is None:
+            print("[READING]: %s" % (self.filename))
+            _, data = read_bbp_data(self.filename)
+            if data.shape[1] != self.samples:
+                print("[ERROR]: Found %d samples instead of %d in file: %s" %
+                      (data.shape[1], self.samples, self.filename))
+                sys.exit(-1)
+            if self.samples > 1 and not np.isclose(data[0][1], self.dt):
+                print("[ERROR]: Found dt %f instead of %f in file: %s" %
+                      (data[0][1], self.dt, self.filename))
+                sys.exit(-1)
+            self.data = data
+        return self.data[index]
+# end of BBPFileLoader
+
+def read_file_bbp_lazy(filename, metadata=None):
+    """
+    Reads the bbp file given right away and sets up the other two
+    quantities of the station to be read the first time they are
+    used. If a metadata dictionary is provided, it is updated with
+    the header of the file given.
+    """
+    bbp_files = get_bbp_filenames(filename)
+    if filename in bbp_files:
+        index = bbp_files.index(filename)
+    else:
+        # Default to the velocity file
+        index = STATION_QUANTITIES.index('vel')
+    quantity = STATION_QUANTITIES[index]
+
+    # Make sure all files are there before going any further
+    for bbp_file in bbp_files:
+        if not os.path.isfile(bbp_file):
+            print("[ERROR]: No such file: %s" % (bbp_file))
+            sys.exit(-1)
+
+    file_metadata, data = read_bbp_data(bbp_files[index])
+    orientation = parse_orientation_bbp(file_metadata['orientation'],
+                                        bbp_files[index])
+    if metadata is not None:
+        metadata.update(file_metadata)
+
+    samples = data.shape[1]
+    delta_t = data[0][1]
+
+    loaders = [BBPFileLoader(bbp_file, samples, delta_t)
+               for bbp_file in bbp_files]
+    station = []
+    for column in range(1, 4):
+        arrays = {'acc': None, 'vel': None, 'dis': None}
+        arrays[quantity] = data[column]
+        component_loaders = {}
+        for other, loader in zip(STATION_QUANTITIES, loaders):
+            if other != quantity:
+                component_loaders[other] = partial(loader.column, column)
+        station.append(TimeseriesComponent(samples, delta_t,
+                                           orientation[column - 1],
+                                           arrays['acc'], arrays['vel'],
+                                           arrays['dis'],
+                                           loaders=component_loaders))
+
+    return station
+# end of read_file_bbp_lazy
+
+def read_file_bbp(filename, metadata=None, use_cache=False, lazy=False):
+    """
+    This function reads timeseries data from a set of BBP files,
+    each file is opened only once. If a metadata dictionary is
+    provided, it is updated with the header of the velocity file.
+    If use_cache is set, timeseries are loaded from a binary sidecar
+    file, which is created the first time the BBP files are read.
+    If lazy is set (and the cache is not used), only the file given
+    is read now, see read_file_bbp_lazy.
+    """
+    # Get filenames for displacement, velocity and acceleration bbp files
+    dis_file, vel_file, acc_file = get_bbp_filenames(filename)
+
+    if use_cache:
+        cache_file = get_bbp_cache_filename(filename)
+        station = read_bbp_cache(cache_file,
+                                 [dis_file, vel_file, acc_file],
+                                 metadata=metadata)
+        if station is not None:
+            return station
+    elif lazy:
+        return read_file_bbp_lazy(filename, metadata=metadata)
+
     # Read 3 bbp files
-    [time, dis_h1, dis_h2, dis_ver] = read_file_bbp2(dis_file)
-    [_, vel_h1, vel_h2, vel_ver] = read_file_bbp2(vel_file)
-    [_, acc_h1, acc_h2, acc_ver] = read_file_bbp2(acc_file)
+    _, dis_data = read_bbp_data(dis_file)
+    vel_metadata, vel_data = read_bbp_data(vel_file)
+    _, acc_data = read_bbp_data(acc_file)
 
-    # Read orientation from one of the files
-    orientation = read_orientation_bbp(vel_file)
+    # Get orientation from the velocity file header
+    orientation = parse_orientation_bbp(vel_metadata['orientation'], vel_file)
+    if metadata is not None:
+        metadata.update(vel_metadata)
 
-    samples = dis_h1.size
-    delta_t = time[1]
+    samples = dis_data.shape[1]
+    delta_t = dis_data[0][1]
 
     # samples, dt, data, acceleration, velocity, displacement
     signal_h1 = TimeseriesComponent(samples, delta_t, orientation[0],
-                                    acc_h1, vel_h1, dis_h1)
+                                    acc_data[1], vel_data[1], dis_data[1])
     signal_h2 = TimeseriesComponent(samples, delta_t, orientation[1],
-                                    acc_h2, vel_h2, dis_h2)
+                                    acc_data[2], vel_data[2], dis_data[2])
     signal_ver = TimeseriesComponent(samples, delta_t, orientation[2],
-                                     acc_ver, vel_ver, dis_ver)
+                                     acc_data[3], vel_data[3], dis_data[3])
 
     station = [signal_h1, signal_h2, signal_ver]
+
+    if use_cache:
+        write_bbp_cache(cache_file, [dis_file, vel_file, acc_file],
+                        station, vel_metadata)
+
     return station
 # end of read_file_bbp
 
@@ -295,68 +784,16 @@ def read_unit_bbp(filename):
     Get the units from the file's header
     Returns either "m" or "cm"
     """
-    units = None
-
-    try:
-        input_file = open(filename, 'r')
-        for line in input_file:
-            if line.find("units=") > 0:
-                units = line.split()[2]
-                break
-        input_file.close()
-    except IOError:
-        print("[ERROR]: No such file.")
-        sys.exit(-1)
-
-    # Make sure we got something
-    if units is None:
-        print("[ERROR]: Cannot find units in bbp file!")
-        sys.exit(-1)
-
-    # Figure out if we have meters or centimeters
-    if units == "cm" or units == "cm/s" or units == "cm/s^2":
-        return "cm"
-    elif units == "m" or units == "m/s" or units == "m/s^2":
-        return "m"
-
-    # Invalid units in this file
-    print("[ERROR]: Cannot parse units in bbp file!")
-    sys.exit(-1)
+    metadata = read_header_bbp(filename)
+    return parse_unit_bbp(metadata['units'])
 # end of read_unit_bbp
 
 def read_orientation_bbp(filename):
     """
     Get the orientation from the file's header
     """
-    orientation = None
-
-    try:
-        input_file = open(filename, 'r')
-        for line in input_file:
-            if line.find("orientation=") > 0:
-                line = line.strip()
-                orientation = line[(line.find("=") + 1):]
-                orientation = orientation.strip().split(",")
-                orientation = [val.strip() for val in orientation]
-                orientation[0] = float(orientation[0])
-                orientation[1] = float(orientation[1])
-                orientation[2] = orientation[2].lower()
-                if orientation[2] != "up" and orientation[2] != "down":
-                    print("[ERROR]: Vertical orientation must be up or down!")
-                    sys.exit(-1)
-                break
-        input_file.close()
-    except IOError:
-        print("[ERROR]: No such file.")
-        sys.exit(-1)
-
-    # Make sure we got something
-    if orientation is None:
-        print("[ERROR]: Cannot find orientation in bbp file: %s!" % (filename))
-        sys.exit(-1)
-
-    # All done!
-    return orientation
+    metadata = read_header_bbp(filename)
+    return parse_orientation_bbp(metadata['orientation'], filename)
 # end of read_orientation_bbp
 
 def read_stamp(filename):
@@ -366,6 +803,9 @@ def read_stamp(filename):
     if filename.endswith(".bbp"):
         # File in bbp format
         return read_stamp_bbp(filename)
+    if is_archive_file(filename):
+        # Station inside an archive file
+        return read_archive_metadata(filename).get('stamp') or []
     # Otherwise use hercules format
     return read_stamp_her(filename)
 # end of read_stamp
@@ -414,31 +854,70 @@ def read_stamp_her(filename):
 # end of read_stamp_her
 
 # ================================ WRITING ==================================
+def get_time_axis(samples, delta_t):
+    """
+    Returns the time array for a timeseries starting at t = 0.0
+    """
+    return np.arange(samples) * delta_t
+# end of get_time_axis
+
+def write_data_columns(out_fp, columns, line_format=BBP_DATA_FORMAT,
+                       chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Writes the data columns to out_fp using line_format for
+    each row. Rows are formatted and written in blocks of
+    chunk_size lines.
+    """
+    data = np.column_stack(columns)
+
+    for start in range(0, data.shape[0], chunk_size):
+        block = data[start:start + chunk_size]
+        out_fp.write((line_format * block.shape[0]) %
+                     tuple(block.ravel().tolist()))
+# end of write_data_columns
+
+def write_velocity_chunks(chunks, o_dis_file, o_vel_file, o_acc_file,
+                          line_format=BBP_DATA_FORMAT):
+    """
+    Writes displacement, velocity and acceleration files from chunks of
+    velocity data, integrating and differentiating each chunk as it
+    goes so memory use does not depend on the timeseries length.
+
+    Inputs:
+        chunks - iterator yielding delta_t, time, vel_h1, vel_h2, vel_ver
+        o_dis_file, o_vel_file, o_acc_file - open output files
+        line_format - format used for each data line
+    """
+    integrators = None
+    derivatives = None
+
+    for delta_t, times, vel_h1, vel_h2, vel_ver in chunks:
+        if integrators is None:
+            integrators = [ChunkedIntegrator(delta_t) for _ in range(0, 3)]
+            derivatives = [ChunkedDerivative(delta_t) for _ in range(0, 3)]
+        vels = [vel_h1, vel_h2, vel_ver]
+        diss = [integrator.process(vel) for integrator, vel in
+                zip(integrators, vels)]
+        accs = [derivative.process(vel) for derivative, vel in
+                zip(derivatives, vels)]
+
+        write_data_columns(o_dis_file, [times] + diss,
+                           line_format=line_format)
+        write_data_columns(o_vel_file, [times] + vels,
+                           line_format=line_format)
+        write_data_columns(o_acc_file, [times] + accs,
+                           line_format=line_format)
+# end of write_velocity_chunks
+
 def write_hercules(filename, station):
     # filename = 'processed-' + filename.split('/')[-1]
     try:
         out_f = open(filename, 'w')
     except IOError as e:
         print(e)
-    dis_ns = station[0].dis.tolist()
-    vel_ns = station[0].vel.tolist()
-    acc_ns = station[0].acc.tolist()
-    dis_ew = station[1].dis.tolist()
-    vel_ew = station[1].vel.tolist()
-    acc_ew = station[1].acc.tolist()
-    dis_up = station[2].dis.tolist()
-    vel_up = station[2].vel.tolist()
-    acc_up = station[2].acc.tolist()
 
     # get a list of time incremented by dt
-    time = [0.000]
-    samples = station[0].samples
-    dt = station[0].dt
-    tmp = samples
-
-    while tmp > 1:
-        time.append(time[len(time)-1] + dt)
-        tmp -= 1
+    time = get_time_axis(station[0].samples, station[0].dt)
 
     out_f.write('# missing header \n')
 
@@ -448,12 +927,12 @@ def write_hercules(filename, station):
                                   "vel_ns", "vel_ew", "vel_up",
                                   "acc_ns", "acc_ew", "acc_up")) # header
 
-    descriptor = '{:>12.3f}' + '  {:>12.7f}'*9 + '\n'
-    for c0, c1, c2, c3, c4, c5, c6, c7, c8, c9 in zip(time,
-                                                      dis_ns, dis_ew, dis_up,
-                                                      vel_ns, vel_ew, vel_up,
-                                                      acc_ns, acc_ew, acc_up):
-        out_f.write(descriptor.format(c0, c1, c2, c3, c4, c5, c6, c7, c8, c9))
+    descriptor = '%12.3f' + '  %12.7f'*9 + '\n'
+    write_data_columns(out_f, [time,
+                               station[0].dis, station[1].dis, station[2].dis,
+                               station[0].vel, station[1].vel, station[2].vel,
+                               station[0].acc, station[1].acc, station[2].acc],
+                       line_format=descriptor)
     out_f.close()
 # end of write_hercules
 
@@ -466,28 +945,16 @@ def write_bbp(input_file, output_file, station):
     output_dir = os.path.dirname(output_file)
     output_basename = os.path.basename(output_file)
 
-    # Prepare data for output
-    acc_h1 = station[0].acc.tolist()
-    vel_h1 = station[0].vel.tolist()
-    dis_h1 = station[0].dis.tolist()
-    acc_h2 = station[1].acc.tolist()
-    vel_h2 = station[1].vel.tolist()
-    dis_h2 = station[1].dis.tolist()
-    acc_ver = station[2].acc.tolist()
-    vel_ver = station[2].vel.tolist()
-    dis_ver = station[2].dis.tolist()
-
     # Start with time = 0.0
-    time = [0.000]
-    samples = station[0].samples
-    while samples > 1:
-        time.append(time[len(time)-1] + station[0].dt)
-        samples -= 1
+    time = get_time_axis(station[0].samples, station[0].dt)
 
     # Prepare to output
-    out_data = [['dis', dis_h1, dis_h2, dis_ver, 'displacement', 'cm'],
-                ['vel', vel_h1, vel_h2, vel_ver, 'velocity', 'cm/s'],
-                ['acc', acc_h1, acc_h2, acc_ver, 'acceleration', 'cm/s^2']]
+    out_data = [['dis', station[0].dis, station[1].dis, station[2].dis,
+                 'displacement', 'cm'],
+                ['vel', station[0].vel, station[1].vel, station[2].vel,
+                 'velocity', 'cm/s'],
+                ['acc', station[0].acc, station[1].acc, station[2].acc,
+                 'acceleration', 'cm/s^2']]
 
     for data in out_data:
         if not output_basename.endswith('.bbp'):
@@ -576,10 +1043,7 @@ def write_bbp(input_file, output_file, station):
             out_fp.write("%s\n" % (item))
 
         # Write timeseries
-        for val_time, val_ns, val_ew, val_ud in zip(time, data[1],
-                                                    data[2], data[3]):
-            out_fp.write("%5.7f   %5.9e   %5.9e    %5.9e\n" %
-                         (val_time, val_ns, val_ew, val_ud))
+        write_data_columns(out_fp, [time, data[1], data[2], data[3]])
 
         # All done, close file
         out_fp.close()
@@ -38,6 +38,10 @@ from __future__ import division, print_function
 import os
 import sys
 import argparse
+from file_utilities import read_text_columns, write_data_columns
+
+# Format of each data line in the output files
+DATA_FORMAT = "%1.9E %1.9E %1.9E %1.9E\n"
 
 def parse_her_header(filename):
     """
@@ -141,44 +145,44 @@ def her2bbp_main():
              "cm": ["cm", "cm/s", "cm/s^2"]}
     unit = parse_her_header(input_file)
 
+    # Read the her file
+    header, data = read_text_columns(input_file)
+
     # Covert from her to BBP format
-    ifile = open(input_file)
     o_dis_file = open(output_file_dis, 'w')
     o_vel_file = open(output_file_vel, 'w')
     o_acc_file = open(output_file_acc, 'w')
     write_bbp_header(o_dis_file, "displacement", units[unit][0], args)
     write_bbp_header(o_vel_file, "velocity", units[unit][1], args)
     write_bbp_header(o_acc_file, "acceleration", units[unit][2], args)
-    for line in ifile:
-        line = line.strip()
-        # Skip comments
-        if line.startswith("#") or line.startswith("%"):
-            pieces = line.split()[1:]
-            # Write header
-            if len(pieces) >= 10:
-                o_dis_file.write("# her header: # %s %s %s %s\n" %
-                                 (pieces[0], pieces[1], pieces[2], pieces[3]))
-                o_vel_file.write("# her header: # %s %s %s %s\n" %
-                                 (pieces[0], pieces[4], pieces[5], pieces[6]))
-                o_acc_file.write("# her header: # %s %s %s %s\n" %
-                                 (pieces[0], pieces[7], pieces[8], pieces[9]))
-            else:
-                o_dis_file.write("# her header: %s\n" % (line))
-            continue
-        pieces = line.split()
-        pieces = [float(piece) for piece in pieces]
-        # Write timeseries to files. Please not that Hercules files have
-        # the vertical component positive pointing down so we have to flip it
-        # here to match the BBP format in which vertical component points up
-        o_dis_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (pieces[0], pieces[1], pieces[2], -1 * pieces[3]))
-        o_vel_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (pieces[0], pieces[4], pieces[5], -1 * pieces[6]))
-        o_acc_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (pieces[0], pieces[7], pieces[8], -1 * pieces[9]))
+    for line in header:
+        pieces = line.split()[1:]
+        # Write header
+        if len(pieces) >= 10:
+            o_dis_file.write("# her header: # %s %s %s %s\n" %
+                             (pieces[0], pieces[1], pieces[2], pieces[3]))
+            o_vel_file.write("# her header: # %s %s %s %s\n" %
+                             (pieces[0], pieces[4], pieces[5], pieces[6]))
+            o_acc_file.write("# her header: # %s %s %s %s\n" %
+                             (pieces[0], pieces[7], pieces[8], pieces[9]))
+        else:
+            o_dis_file.write("# her header: %s\n" % (line))
+
+    # Write timeseries to files. Please not that Hercules files have
+    # the vertical component positive pointing down so we have to flip it
+    # here to match the BBP format in which vertical component points up
+    if data.size:
+        write_data_columns(o_dis_file, [data[0], data[1], data[2],
+                                        -1 * data[3]],
+                           line_format=DATA_FORMAT)
+        write_data_columns(o_vel_file, [data[0], data[4], data[5],
+                                        -1 * data[6]],
+                           line_format=DATA_FORMAT)
+        write_data_columns(o_acc_file, [data[0], data[7], data[8],
+                                        -1 * data[9]],
+                           line_format=DATA_FORMAT)
 
     # All done, close everything
-    ifile.close()
     o_dis_file.close()
     o_vel_file.close()
     o_acc_file.close()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Ground motion intensity measures. All measures are computed for
+stacked arrays of stations and components at once: peak values from
+the stored timeseries, and Arias intensity, significant durations, CAV
+and RMS acceleration from a single cumulative integral of a^2 and |a|.
+Timeseries are expected in cm, cm/s, and cm/s/s. The calculate_ims
+program writes the table for a list of input files.
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import sys
+import numpy as np
+from scipy.integrate import cumtrapz
+
+# Import seismtools needed functions
+from ts_library import G2CMSS
+
+# Intensity measures, in table order
+IM_NAMES = ['pga', 'pgv', 'pgd', 'arias', 'd5_75', 'd5_95', 'cav', 'rms']
+IM_UNITS = {'pga': 'cm/s/s',
+            'pgv': 'cm/s',
+            'pgd': 'cm',
+            'arias': 'cm/s',
+            'd5_75': 's',
+            'd5_95': 's',
+            'cav': 'cm/s',
+            'rms': 'cm/s/s'}
+# Fractions of the Arias intensity delimiting the significant durations
+IM_DURATIONS = {'d5_75': (0.05, 0.75),
+                'd5_95': (0.05, 0.95)}
+# Max length of station names in the table
+IM_NAME_SIZE = 64
+IM_DTYPE = np.dtype([('station', 'U%d' % (IM_NAME_SIZE)),
+                     ('component', 'U16')] +
+                    [(name, np.float64) for name in IM_NAMES])
+
+def get_crossing_times(husid, fractions, dt):
+    """
+    Returns the time each normalized cumulative curve first reaches
+    each fraction, curves are non-decreasing so counting the samples
+    below the fraction gives the crossing index
+
+    Inputs:
+        husid - (..., samples) array with normalized cumulative curves
+        fractions - list of fractions between 0 and 1
+        dt - delta t of the curves
+    Outputs:
+        times - (len(fractions), ...) array with the crossing times
+    """
+    return np.array([np.sum(husid < fraction, axis=-1) * dt
+                     for fraction in fractions])
+
+def calculate_im_stack(acc, vel, dis, dt):
+    """
+    Computes the intensity measures for stacked timeseries, all
+    with the same dt and number of samples
+
+    Inputs:
+        acc - (..., samples) array with the acceleration timeseries
+        vel - (..., samples) array with the velocity timeseries
+        dis - (..., samples) array with the displacement timeseries
+        dt - delta t of the timeseries
+    Outputs:
+        ims - dictionary with a (...) array for each name in IM_NAMES
+    """
+    acc = np.asarray(acc, dtype=np.float64)
+    ims = {'pga': np.max(np.abs(acc), axis=-1),
+           'pgv': np.max(np.abs(vel), axis=-1),
+           'pgd': np.max(np.abs(dis), axis=-1)}
+
+    # Single cumulative integral of a^2 and |a|
+    cumulative = cumtrapz(np.array([acc**2, np.abs(acc)]),
+                          dx=dt, axis=-1, initial=0)
+    total_a2 = cumulative[0][..., -1]
+    ims['arias'] = np.pi / (2.0 * G2CMSS) * total_a2
+    ims['cav'] = cumulative[1][..., -1]
+    duration = (acc.shape[-1] - 1) * dt
+    ims['rms'] = np.sqrt(total_a2 / duration) if duration > 0 else \
+        np.zeros(total_a2.shape)
+
+    # Significant durations from the normalized Husid curves
+    with np.errstate(divide='ignore', invalid='ignore'):
+        husid = cumulative[0] / total_a2[..., np.newaxis]
+    for name, (start, end) in sorted(IM_DURATIONS.items()):
+        times = get_crossing_times(husid, [start, end], dt)
+        ims[name] = np.where(total_a2 > 0, times[1] - times[0], 0.0)
+
+    return ims
+
+def calculate_station_ims(stations, names=None):
+    """
+    Computes the intensity measures for all components of a list
+    of stations. Stations with the same dt and number of samples are
+    stacked and processed together
+
+    Inputs:
+        stations - list of stations, each with 3 TimeseriesComponent
+        names - list with the station names (default: station index),
+                up to IM_NAME_SIZE characters
+    Outputs:
+        table - structured array (IM_DTYPE) with one row for each
+                station component, in input order
+    """
+    if names is None:
+        names = ["%d" % (index) for index in range(len(stations))]
+    if len(names) != len(stations):
+        print("[ERROR]: Need one name for each station!")
+        sys.exit(-1)
+    for name in names:
+        if len(name) > IM_NAME_SIZE:
+            print("[ERROR]: Station name longer than %d characters: %s" %
+                  (IM_NAME_SIZE, name))
+            sys.exit(-1)
+
+    components = len(stations[0]) if stations else 0
+    table = np.zeros(len(stations) * components, dtype=IM_DTYPE)
+
+    # Group stations that can be stacked together
+    groups = {}
+    for index, station in enumerate(stations):
+        if len(station) != components:
+            print("[ERROR]: All stations need %d components!" %
+                  (components))
+            sys.exit(-1)
+        key = (station[0].dt, station[0].samples)
+        groups.setdefault(key, []).append(index)
+
+    for (dt, samples), indexes in sorted(groups.items()):
+        data = {}
+        for quantity in ['acc', 'vel', 'dis']:
+            data[quantity] = np.empty((len(indexes), components, samples))
+            for row, index in enumerate(indexes):
+                for column, component in enumerate(stations[index]):
+                    data[quantity][row][column] = \
+                        component.get_quantity(quantity)
+        ims = calculate_im_stack(data['acc'], data['vel'], data['dis'], dt)
+
+        for row, index in enumerate(indexes):
+            for column, component in enumerate(stations[index]):
+                entry = table[index * components + column]
+                entry['station'] = names[index]
+                entry['component'] = str(component.orientation)
+                for name in IM_NAMES:
+                    entry[name] = ims[name][row][column]
+
+    return table
+
+def write_im_table(output_file, table):
+    """
+    Writes an intensity measure table to a text file, one line
+    per station component
+    """
+    try:
+        out_fp = open(output_file, 'w')
+    except IOError:
+        print("[ERROR]: Cannot write output file: %s" % (output_file))
+        sys.exit(-1)
+
+    out_fp.write("# station component %s\n" % (" ".join(IM_NAMES)))
+    out_fp.write("# - - %s\n" % (" ".join([IM_UNITS[name]
+                                           for name in IM_NAMES])))
+    for entry in table:
+        out_fp.write("%s %s %s\n" % (entry['station'], entry['component'],
+                                     " ".join(["%.6e" % (entry[name])
+                                               for name in IM_NAMES])))
+    out_fp.close()
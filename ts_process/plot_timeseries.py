@@ -44,6 +44,7 @@ if mpl.get_backend() != 'agg':
 
 # Import seismtools functions
 from file_utilities import read_files
+from station_index import StationIndex
 from ts_library import calculate_distance
 from ts_plot_library import plot_overlay_timeseries
 
@@ -68,10 +69,15 @@ def parse_arguments():
                         help="station name")
     parser.add_argument("--station-list", dest="station_list",
                         help="station list with latitude and longitude")
+    parser.add_argument("--station-index", dest="station_index",
+                        help="station index created by station_index.py")
     parser.add_argument("--xmin", dest="xmin", type=float,
                         help="xmin to plot")
     parser.add_argument("--xmax", dest="xmax", type=float,
                         help="xmax to plot")
+    parser.add_argument("--cache", dest="cache", action="store_true",
+                        help="keep binary copies of the bbp input files "
+                        "to speed up subsequent runs")
     parser.add_argument('input_files', nargs='*')
     args = parser.parse_args()
 
@@ -104,32 +110,23 @@ def plot_timeseries_main():
     plot_title = None
     if args.station is not None:
         plot_title = "%s" % (args.station)
+    # Load station index, if provided
+    st_index = None
+    if args.station_index is not None:
+        st_index = StationIndex(args.station_index)
+        # Check plot window before reading any data
+        st_index.check_xmax(filenames, args.xmax)
+
     # Set title if station name provided and epicenter are provided
     if args.station is not None and args.epicenter is not None:
         # Calculate distance if locations are provided
+        if args.st_loc is None and st_index is not None:
+            args.st_loc = st_index.get_location(args.station)
         if args.st_loc is None and args.station_list is not None:
             # Find station coordinates from station list
-            st_file = open(args.station_list, 'r')
-            for line in st_file:
-                line = line.strip()
-                if not line:
-                    # skip blank lines
-                    continue
-                if line.startswith("#") or line.startswith("%"):
-                    # Skip comments
-                    continue
-                pieces = line.split()
-                if len(pieces) < 3:
-                    # Skip line with insufficient tokens
-                    continue
-                if pieces[2].lower() != args.station.lower():
-                    # Not a match
-                    continue
-                # Match!
-                args.st_loc = [float(pieces[1]), float(pieces[0])]
-                break
-            # All done processing station file
-            st_file.close()
+            st_list = StationIndex()
+            st_list.add_station_list(args.station_list)
+            args.st_loc = st_list.get_location(args.station)
 
         if args.st_loc is not None:
             # Calculate distance here
@@ -139,7 +136,7 @@ def plot_timeseries_main():
                                               distance)
 
     # Read data
-    _, stations = read_files(None, filenames)
+    _, stations = read_files(None, filenames, use_cache=args.cache)
     filenames = [os.path.basename(filename) for filename in filenames]
 
     # Create plot
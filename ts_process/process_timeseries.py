@@ -39,13 +39,18 @@ import os
 import sys
 import argparse
 
-from file_utilities import write_bbp, read_stamp, read_files
+from file_utilities import write_bbp, read_stamp, read_files, \
+    read_header_bbp
+from ts_archive import ArchiveWriter, is_archive_file, \
+    resolve_archive_station, read_archive_metadata
 from ts_library import rotate_timeseries, process_station_dt, \
-    check_station_data, filter_timeseries, seism_cutting, seism_appendzeros
+    check_station_data, filter_stations, seism_cutting, seism_appendzeros, \
+    FILTER_ENGINES, RESAMPLE_METHODS
+from ts_cache import enable_cache
 
-def filter_data(timeseries, frequencies, debug):
+def filter_data(stations, frequencies, debug, engine='iir'):
     """
-    Filter timeseries using the frequencies specified by the user
+    Filter all stations using the frequencies specified by the user
     """
     if len(frequencies) == 1:
         fmin = 0.0
@@ -59,11 +64,11 @@ def filter_data(timeseries, frequencies, debug):
         print("[ERROR]: Must specify one or two frequencies for filtering!")
         sys.exit(-1)
 
-    filter_timeseries(timeseries, family='butter', btype=btype,
-                      fmin=fmin, fmax=fmax,
-                      N=4, rp=0.2, rs=100, debug=debug)
+    filter_stations(stations, family='butter', btype=btype,
+                    fmin=fmin, fmax=fmax,
+                    N=4, rp=0.2, rs=100, engine=engine, debug=debug)
 
-    return timeseries
+    return stations
 #end filter_data
 
 def synchronize_all_stations(obs_data, stations, stamp, eqtimestamp, leading):
@@ -188,7 +193,8 @@ def process(obs_file, obs_data, input_files, stations, params):
                                       params['targetdt'],
                                       params['decifmax'],
                                       params['debug'],
-                                      debug_plots_base)
+                                      debug_plots_base,
+                                      params['resample_method'])
     new_stations = []
     for station, input_file in zip(stations, input_files):
         debug_plots_base = os.path.join(params['outdir'],
@@ -197,7 +203,8 @@ def process(obs_file, obs_data, input_files, stations, params):
                                          params['targetdt'],
                                          params['decifmax'],
                                          params['debug'],
-                                         debug_plots_base)
+                                         debug_plots_base,
+                                         params['resample_method'])
         new_stations.append(new_station)
     stations = new_stations
 
@@ -235,17 +242,17 @@ def process(obs_file, obs_data, input_files, stations, params):
             print("[ERROR]: processed simulated data contains errors!")
             sys.exit(-1)
 
-    # Final filtering step
+    # Final filtering step, all stations together
     if obs_data is not None:
-        for i in range(0, 3):
-            obs_data[i] = filter_data(obs_data[i],
-                                      params['frequencies'],
-                                      params['debug'])
-    for station in stations:
-        for i in range(0, 3):
-            station[i] = filter_data(station[i],
-                                     params['frequencies'],
-                                     params['debug'])
+        filter_data([obs_data] + stations,
+                    params['frequencies'],
+                    params['debug'],
+                    params['filter_engine'])
+    else:
+        filter_data(stations,
+                    params['frequencies'],
+                    params['debug'],
+                    params['filter_engine'])
 
     # All done
     return obs_data, stations
@@ -277,6 +284,30 @@ def parse_arguments():
                         help="output directory for the outputs")
     parser.add_argument("--debug", dest="debug", action="store_true",
                         help="produces debug plots and outputs steps in detail")
+    parser.add_argument("--archive", dest="archive",
+                        help="write all processed timeseries to this "
+                        "archive file in the output directory instead "
+                        "of bbp files")
+    parser.add_argument("--cache", dest="cache", action="store_true",
+                        help="keep binary copies of the bbp input files "
+                        "to speed up subsequent runs")
+    parser.add_argument("--results-cache", dest="results_cache",
+                        help="directory where results of expensive "
+                        "computations are cached across runs")
+    parser.add_argument("--derive-from", dest="derive_from",
+                        choices=['acc', 'vel'],
+                        help="only process this quantity, the other two "
+                        "are derived from it when writing the outputs")
+    parser.add_argument("--filter-engine", dest="filter_engine",
+                        choices=FILTER_ENGINES, default='iir',
+                        help="zero-phase filtering engine: forward-backward "
+                        "IIR filtering or the same response applied in "
+                        "the frequency domain")
+    parser.add_argument("--resample-method", dest="resample_method",
+                        choices=RESAMPLE_METHODS, default='interp',
+                        help="resampling method: Butterworth low-pass "
+                        "and sinc interpolation, or a single polyphase "
+                        "FIR pass for simple dt ratios")
     parser.add_argument('input_files', nargs='*')
     args = parser.parse_args()
 
@@ -344,9 +375,55 @@ def parse_arguments():
         params['leading'] = args.leading
 
     params['debug'] = args.debug is not None
+    params['cache'] = args.cache
+    params['results_cache'] = args.results_cache
+    params['derive_from'] = args.derive_from
+    params['filter_engine'] = args.filter_engine
+    params['resample_method'] = args.resample_method
+    params['archive'] = args.archive
 
     return obs_file, files, params
 
+def get_station_name(input_file):
+    """
+    Returns the station name to use in the archive, the
+    input filename without the .{dis,vel,acc}.bbp extensions
+    """
+    if is_archive_file(input_file):
+        return resolve_archive_station(input_file)[1]
+    return '.'.join(os.path.basename(input_file).split('.')[0:-2])
+
+def get_archive_metadata(input_file):
+    """
+    Returns the metadata to store in the archive for a processed
+    timeseries, units are always cm after processing
+    """
+    if is_archive_file(input_file):
+        metadata = read_archive_metadata(input_file)
+    else:
+        metadata = read_header_bbp(input_file)
+    # Header lines no longer match the processed data, tsa2bbp
+    # creates new ones from the metadata
+    metadata.pop('header', None)
+    metadata.pop('headers', None)
+    metadata['units'] = 'cm/s'
+
+    return metadata
+
+def write_archive(obs_file, obs_data, input_files, stations, params):
+    """
+    Writes all processed timeseries to a single archive file
+    """
+    archive = ArchiveWriter(os.path.join(params['outdir'],
+                                         params['archive']))
+    if obs_data is not None:
+        archive.add_station("p-%s" % (get_station_name(obs_file)),
+                            obs_data, get_archive_metadata(obs_file))
+    for input_file, station in zip(input_files, stations):
+        archive.add_station("p-%s" % (get_station_name(input_file)),
+                            station, get_archive_metadata(input_file))
+    archive.close()
+
 def process_main():
     """
     Main function for processing seismograms
@@ -354,8 +431,23 @@ def process_main():
     # First let's get all aruments that we need
     obs_file, input_files, params = parse_arguments()
 
-    # Read input files
-    obs_data, stations = read_files(obs_file, input_files)
+    # Cache filtered and resampled timeseries across runs, if requested
+    if params['results_cache'] is not None:
+        enable_cache(params['results_cache'])
+
+    # Read input files, other quantities are not needed when deriving
+    obs_data, stations = read_files(obs_file, input_files,
+                                    use_cache=params['cache'],
+                                    lazy=params['derive_from'] is not None)
+
+    # Process a single quantity, see TimeseriesComponent.derive_from
+    if params['derive_from'] is not None:
+        all_stations = list(stations)
+        if obs_data is not None:
+            all_stations.append(obs_data)
+        for station in all_stations:
+            for component in station:
+                component.derive_from(params['derive_from'])
 
     # Process signals
     obs_data, stations = process(obs_file, obs_data,
@@ -363,6 +455,10 @@ def process_main():
                                  params)
 
     # Write processed files
+    if params['archive'] is not None:
+        write_archive(obs_file, obs_data, input_files, stations, params)
+        return
+
     if obs_data is not None:
         obs_file_out = os.path.join(params['outdir'],
                                     "p-%s" % os.path.basename(obs_file))
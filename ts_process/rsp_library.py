@@ -0,0 +1,679 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Response spectrum library, an in-process version of the rotd50
+program in the rotd50 directory. Oscillator responses use the
+Nigam-Jennings recurrence (coeff and brs in rotd50/calcrsp.f), and
+inputs are oversampled with the same frequency domain interpolation
+(InterpFreq in rotd50/ft_th.f).
+
+The rotd50 program oversamples every record to dt <= 0.001s for all
+periods. By default, each period is only oversampled until it has
+RSP_POINTS_PER_CYCLE samples per cycle, which is much faster for long
+records, and periods that need no oversampling use the record as it
+is. PSA values are then close to, but not the same as, the rotd50
+program ones (the difference grows with the high frequency content of
+the record, typically below 1%); points_per_cycle=None reproduces it
+(except for records with dt <= 0.0005s, which it still pads and
+transforms without oversampling).
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import multiprocessing
+import numpy as np
+from scipy.signal import lfilter
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # No worker pool, batches run in a single process
+    ProcessPoolExecutor = None
+
+# Periods used by the rotd50 program
+RSP_PERIODS = np.array([0.010, 0.011, 0.012, 0.013, 0.015, 0.017, 0.020,
+                        0.022, 0.025, 0.029, 0.032, 0.035, 0.040, 0.045,
+                        0.050, 0.055, 0.060, 0.065, 0.075, 0.085, 0.100,
+                        0.110, 0.120, 0.130, 0.150, 0.170, 0.200, 0.220,
+                        0.240, 0.260, 0.280, 0.300, 0.350, 0.400, 0.450,
+                        0.500, 0.550, 0.600, 0.650, 0.750, 0.850, 1.000,
+                        1.100, 1.200, 1.300, 1.500, 1.700, 2.000, 2.200,
+                        2.400, 2.600, 2.800, 3.000, 3.500, 4.000, 4.400,
+                        5.000, 5.500, 6.000, 6.500, 7.500, 8.500, 10.000])
+RSP_DAMPING = 0.05
+# Inputs are oversampled until dt is below this value
+RSP_DT_MAX = 0.001
+# With adaptive oversampling, each period gets at least this many
+# samples per cycle (never more oversampling than RSP_DT_MAX requires)
+RSP_POINTS_PER_CYCLE = 64
+# Value of pi used by the rotd50 program
+RSP_PI = 3.14159
+# Number of rotation angles, 1 degree apart
+RSP_ANGLES = 90
+# Number of samples rotated at a time
+ROTATION_CHUNK_SIZE = 1024
+# Number of largest amplitude samples rotated first to bound the peaks
+ROTATION_SEED_SIZE = 256
+# Max number of pairs processed together in a batch, larger stacks use
+# more memory without running any faster
+RSP_STACK_SIZE = 2
+
+def get_interpolation_factor(dt):
+    """
+    Returns the oversampling factor used to bring dt below RSP_DT_MAX,
+    computed in single precision as in the rotd50 program
+
+    Inputs:
+        dt - delta t of the input timeseries
+    Outputs:
+        factor - power of 2 oversampling factor
+    """
+    ratio = np.float32(dt) / np.float32(RSP_DT_MAX)
+    power = int(np.log(ratio) / np.log(np.float32(2.0))) + 1
+    return 2**max(power, 0)
+
+def get_period_factors(dt, periods, points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Returns the oversampling factor to use for each period: the
+    smallest power of 2 giving points_per_cycle samples per cycle,
+    capped at the factor used by the rotd50 program. If
+    points_per_cycle is None, all periods use the rotd50 factor
+
+    Inputs:
+        dt - delta t of the input timeseries
+        periods - oscillator periods (s)
+        points_per_cycle - min number of samples per oscillator cycle
+    Outputs:
+        factors - array with the power of 2 factor for each period
+    """
+    periods = np.asarray(periods, dtype=np.float64)
+    max_factor = get_interpolation_factor(dt)
+    if points_per_cycle is None:
+        return np.full(periods.shape, max_factor, dtype=int)
+
+    needed = np.maximum(points_per_cycle * dt / periods, 1.0)
+    factors = 2**np.ceil(np.log2(needed)).astype(int)
+    return np.minimum(factors, max_factor)
+
+def get_padded_length(samples):
+    """
+    Returns the power of 2 length timeseries are padded to before
+    being oversampled, computed in single precision as in the rotd50
+    program (so it can be slightly shorter than samples)
+    """
+    power = int(np.log(np.float32(samples)) / np.log(np.float32(2.0)) +
+                np.float32(0.9999))
+    return 2**power
+
+def interpolate_fft(data, factor):
+    """
+    Oversamples data by factor in the frequency domain. Data is padded
+    to a power of 2, its spectrum is zero padded (with the Nyquist
+    value split between positive and negative frequencies) and
+    transformed back
+
+    Inputs:
+        data - input timeseries, or array with one timeseries per row
+        factor - oversampling factor
+    Outputs:
+        data - oversampled timeseries, factor times the padded length,
+               or the input data unchanged when factor is 1
+    """
+    if factor == 1:
+        return data
+
+    padded = get_padded_length(data.shape[-1])
+
+    spectrum = np.fft.rfft(data[..., :padded], n=padded, axis=-1)
+    new_spectrum = np.zeros(spectrum.shape[:-1] +
+                            (factor * (padded // 2) + 1,), dtype=complex)
+    new_spectrum[..., :spectrum.shape[-1]] = spectrum
+    new_spectrum[..., spectrum.shape[-1] - 1] /= 2.0
+
+    return np.fft.irfft(new_spectrum, n=factor * padded, axis=-1) * factor
+
+def get_nj_coefficients(w, damping, dt):
+    """
+    Computes the Nigam-Jennings coefficients that advance the
+    oscillator displacement and velocity by one time step
+
+    Inputs:
+        w - oscillator frequency (rad/s), or array of frequencies
+        damping - fraction of critical damping, or array of dampings
+                  (broadcast against w)
+        dt - delta t of the input timeseries
+    Outputs:
+        a11, a12, a21, a22, b11, b12, b21, b22 - coefficients
+    """
+    t1 = np.sqrt(1.0 - damping**2)
+    t2 = np.sin(w * t1 * dt)
+    t3 = np.cos(w * t1 * dt)
+    t4 = np.exp(-damping * w * dt)
+    s1 = (2.0 * damping**2 - 1.0) / (w**2 * dt)
+    s2 = 2.0 * damping / (w**3 * dt)
+
+    a11 = t4 * (damping * t2 / t1 + t3)
+    a12 = t4 * t2 / (w * t1)
+    a21 = -t4 * w * t2 / t1
+    a22 = t4 * (t3 - damping * t2 / t1)
+
+    b11 = t4 * ((s1 + damping / w) * t2 / (w * t1) +
+                (s2 + 1.0 / w**2) * t3) - s2
+    b12 = -t4 * (s1 * t2 / (w * t1) + s2 * t3) - 1.0 / w**2 + s2
+    b21 = (s1 + damping / w) * (t3 - damping * t2 / t1)
+    b21 = (t4 * (b21 - (s2 + 1.0 / w**2) *
+                 (w * t1 * t2 + damping * w * t3)) + 1.0 / (w**2 * dt))
+    b22 = s1 * (t3 - damping * t2 / t1)
+    b22 = (-t4 * (b22 - s2 * (w * t1 * t2 + damping * w * t3)) -
+           1.0 / (w**2 * dt))
+
+    return a11, a12, a21, a22, b11, b12, b21, b22
+
+def get_nj_filter(w, damping, dt):
+    """
+    Returns the recurrence as an IIR filter from ground acceleration
+    to oscillator displacement, with the oscillator at rest
+
+    Inputs:
+        w - oscillator frequency (rad/s), or array of frequencies
+        damping - fraction of critical damping, or array of dampings
+                  (broadcast against w)
+        dt - delta t of the input timeseries
+    Outputs:
+        num, den - filter coefficients for lfilter, with shape (3,)
+                   followed by the broadcast shape of w and damping
+    """
+    a11, a12, a21, a22, b11, b12, b21, b22 = get_nj_coefficients(w,
+                                                                 damping,
+                                                                 dt)
+    num = np.array([b12,
+                    b11 - a22 * b12 + a12 * b22,
+                    -a22 * b11 + a12 * b21])
+    den = np.array([np.ones_like(a11),
+                    -(a11 + a22),
+                    a11 * a22 - a12 * a21])
+
+    return num, den
+
+def response_time_history(acc, dt, w, damping=RSP_DAMPING):
+    """
+    Computes the pseudo-acceleration time history of an oscillator
+
+    Inputs:
+        acc - acceleration timeseries, or array with one timeseries
+              per row
+        dt - delta t of the timeseries
+        w - oscillator frequency (rad/s)
+        damping - fraction of critical damping
+    Outputs:
+        rsp - pseudo-acceleration response, same units and shape as acc
+    """
+    num, den = get_nj_filter(w, damping, dt)
+    return lfilter(num, den, acc, axis=-1) * w**2
+
+def get_rotation_matrix():
+    """
+    Returns the matrix that rotates a pair of orthogonal time histories
+    every degree from 0 to 89 degrees, as in the rotd50 program. The
+    first RSP_ANGLES rows give the first rotated component and the
+    last RSP_ANGLES rows the second one (the first component rotated
+    by 90 more degrees), so all rows together cover 0-179 degrees
+
+    Outputs:
+        matrix - (2 * RSP_ANGLES, 2) rotation matrix
+    """
+    angles = np.arange(RSP_ANGLES) * RSP_PI / 180.0
+    cos1 = np.cos(angles)
+    sin1 = np.sin(angles)
+    return np.vstack([np.column_stack([cos1, -sin1]),
+                      np.column_stack([sin1, cos1])])
+
+def rotate_chunks(matrix, rsp1, rsp2, peaks, chunk_size):
+    """
+    Updates peaks with the largest absolute values of matrix applied
+    to the (rsp1, rsp2) pairs, chunk_size samples at a time
+    """
+    for start in range(0, len(rsp1), chunk_size):
+        pair = np.vstack([rsp1[start:start + chunk_size],
+                          rsp2[start:start + chunk_size]])
+        rotated = np.abs(matrix.dot(pair))
+        np.maximum(peaks, rotated.max(axis=1), out=peaks)
+    return peaks
+
+def rotate_responses(rsp1, rsp2, prune=True,
+                     chunk_size=ROTATION_CHUNK_SIZE):
+    """
+    Computes the peak responses of two orthogonal oscillator time
+    histories rotated every degree from 0 to 179 degrees. All angles
+    are applied as a single matrix product, chunk_size samples at a
+    time to bound memory use. With prune set, samples where neither
+    response reaches 1/1.5 of the smaller peak are skipped, as done
+    by the rotd50 program
+
+    Samples are first rotated for the ROTATION_SEED_SIZE largest
+    amplitudes only. No sample with an amplitude below the smallest
+    peak found can set a peak at any angle, so only the samples above
+    it need to be rotated. This does not change the results.
+
+    Inputs:
+        rsp1 - first response time history
+        rsp2 - second (orthogonal) response time history
+        prune - skip samples that are unlikely to set a peak
+        chunk_size - number of samples rotated at a time
+    Outputs:
+        peaks - array with the 2 * RSP_ANGLES peak values, see
+                get_rotation_matrix for the order
+    """
+    if prune:
+        amp1 = np.abs(rsp1)
+        amp2 = np.abs(rsp2)
+        test = min(amp1.max(), amp2.max()) / 1.5
+        keep = np.maximum(amp1, amp2) > test
+        rsp1 = rsp1[keep]
+        rsp2 = rsp2[keep]
+
+    matrix = get_rotation_matrix()
+    peaks = np.zeros(2 * RSP_ANGLES)
+
+    # Peaks for the largest amplitudes are a lower bound for all peaks
+    amplitude = np.hypot(rsp1, rsp2)
+    if amplitude.size > ROTATION_SEED_SIZE:
+        seeds = np.argpartition(amplitude,
+                                -ROTATION_SEED_SIZE)[-ROTATION_SEED_SIZE:]
+        rotate_chunks(matrix, rsp1[seeds], rsp2[seeds], peaks, chunk_size)
+        keep = amplitude > peaks.min()
+        rsp1 = rsp1[keep]
+        rsp2 = rsp2[keep]
+
+    return rotate_chunks(matrix, rsp1, rsp2, peaks, chunk_size)
+
+def get_rotd_percentiles(peaks, percentiles):
+    """
+    Returns the RotDnn values of the rotated peaks, RotD00 being the
+    smallest peak, RotD50 the median and RotD100 the largest one
+
+    Inputs:
+        peaks - peak values for all rotation angles
+        percentiles - list of percentiles (0-100)
+    Outputs:
+        rotd - array with one value for each percentile
+    """
+    # np.percentile uses a partial sort (np.partition)
+    return np.percentile(peaks, percentiles)
+
+def calculate_rotd_stack(accs, dt, periods=RSP_PERIODS,
+                         damping=RSP_DAMPING, percentiles=(0, 50, 100),
+                         prune=True, points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the PSA and RotDnn values for a stack of pairs of
+    orthogonal components sharing the same dt and number of samples.
+    The timeseries are oversampled once for each factor needed by the
+    periods, and the oscillator filters for all damping and period
+    values are set up together
+
+    Inputs:
+        accs - (pairs, 2, samples) array with the acceleration pairs
+        dt - delta t of all timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        percentiles - list of RotD percentiles (0-100) to compute
+        prune - use the rotd50 program shortcut, see rotate_responses
+        points_per_cycle - oversample each period only up to this many
+                           samples per cycle, None oversamples all
+                           periods as the rotd50 program does
+    Outputs:
+        psa1 - (pairs, periods) array with the PSA of the first components
+        psa2 - (pairs, periods) array with the PSA of the second components
+        rotd - (pairs, percentiles, periods) array with the RotDnn
+
+        With a list of damping values, outputs have an extra axis
+        for damping after the pairs axis
+    """
+    accs = np.asarray(accs, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)
+    dampings = np.atleast_1d(np.asarray(damping, dtype=np.float64))
+    pairs = accs.shape[0]
+    psa1 = np.empty((pairs, dampings.size, periods.size))
+    psa2 = np.empty((pairs, dampings.size, periods.size))
+    rotd = np.empty((pairs, dampings.size, len(percentiles), periods.size))
+
+    ws = 2.0 * RSP_PI / periods
+    factors = get_period_factors(dt, periods, points_per_cycle)
+    for factor in np.unique(factors):
+        # Oversample to get accurate peaks at short periods
+        data = interpolate_fft(accs, factor)
+        indexes = np.nonzero(factors == factor)[0]
+
+        # Filters for the whole (damping, period) table
+        nums, dens = get_nj_filter(ws[np.newaxis, indexes],
+                                   dampings[:, np.newaxis], dt / factor)
+
+        for k in range(dampings.size):
+            for n, i in enumerate(indexes):
+                rsps = lfilter(nums[:, k, n], dens[:, k, n],
+                               data, axis=-1) * ws[i]**2
+                for j in range(pairs):
+                    peaks = rotate_responses(rsps[j][0], rsps[j][1],
+                                             prune=prune)
+                    psa1[j][k][i] = peaks[0]
+                    psa2[j][k][i] = peaks[RSP_ANGLES]
+                    rotd[j, k, :, i] = get_rotd_percentiles(peaks,
+                                                            percentiles)
+
+    if np.ndim(damping) == 0:
+        return psa1[:, 0], psa2[:, 0], rotd[:, 0]
+    return psa1, psa2, rotd
+
+def calculate_rotd(acc1, acc2, dt, periods=RSP_PERIODS, damping=RSP_DAMPING,
+                   percentiles=(0, 50, 100), prune=True,
+                   points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the pseudo-spectral acceleration of two orthogonal
+    components and their RotDnn values for the percentiles given,
+    all computed from a single rotation of the oscillator responses
+
+    Inputs:
+        acc1 - first horizontal acceleration timeseries
+        acc2 - second horizontal acceleration timeseries
+        dt - delta t of both timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        percentiles - list of RotD percentiles (0-100) to compute
+        prune - use the rotd50 program shortcut, see rotate_responses
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        periods - array with the periods
+        psa1 - PSA for acc1, same units as the input
+        psa2 - PSA for acc2
+        rotd - (len(percentiles), len(periods)) array with the RotDnn
+
+        With a list of damping values, outputs (other than periods)
+        have an extra first axis for damping
+    """
+    # Use the same number of points for both components
+    samples = min(len(acc1), len(acc2))
+    accs = np.array([[acc1[:samples], acc2[:samples]]], dtype=np.float64)
+
+    psa1, psa2, rotd = calculate_rotd_stack(accs, dt, periods=periods,
+                                            damping=damping,
+                                            percentiles=percentiles,
+                                            prune=prune,
+                                            points_per_cycle=points_per_cycle)
+
+    return np.asarray(periods, dtype=np.float64), psa1[0], psa2[0], rotd[0]
+
+def get_stacks(lengths, dts, stack_size):
+    """
+    Groups timeseries that can be stacked together: same dt and
+    same padded length
+
+    Inputs:
+        lengths - list with the number of samples of each timeseries
+        dts - list with the delta t of each timeseries
+        stack_size - max number of timeseries in each stack
+    Outputs:
+        stacks - list of (dt, padded length, indexes) tuples
+    """
+    groups = {}
+    for index, (samples, dt) in enumerate(zip(lengths, dts)):
+        key = (dt, get_padded_length(samples))
+        groups.setdefault(key, []).append(index)
+
+    stacks = []
+    for (dt, padded), indices in sorted(groups.items()):
+        for start in range(0, len(indices), stack_size):
+            stacks.append((dt, padded, indices[start:start + stack_size]))
+
+    return stacks
+
+def run_tasks(function, tasks, workers=None):
+    """
+    Runs function for the arguments of each task, spread over a pool
+    of worker processes when there are several tasks
+
+    Inputs:
+        function - module level function to call
+        tasks - list with the arguments for each call
+        workers - number of worker processes, defaults to the number
+                  of cpus, 1 runs everything in this process
+    Outputs:
+        outputs - list with the output of each call
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers > 1 and len(tasks) > 1 and ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(max_workers=min(workers,
+                                                 len(tasks))) as executor:
+            return list(executor.map(function, *zip(*tasks)))
+    return [function(*args) for args in tasks]
+
+def _rotd_task(accs, dt, periods, damping, percentiles, prune,
+               points_per_cycle):
+    """
+    Worker function for calculate_rotd_batch
+    """
+    return calculate_rotd_stack(accs, dt, periods=periods, damping=damping,
+                                percentiles=percentiles, prune=prune,
+                                points_per_cycle=points_per_cycle)
+
+def calculate_rotd_batch(pairs, dts, periods=RSP_PERIODS,
+                         damping=RSP_DAMPING, percentiles=(0, 50, 100),
+                         prune=True, workers=None,
+                         points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the PSA and RotDnn values for many pairs of orthogonal
+    components. Pairs with the same dt and padded length are stacked
+    (up to RSP_STACK_SIZE pairs) and processed together, and the
+    stacks are spread over a pool of worker processes
+
+    Inputs:
+        pairs - list of (acc1, acc2) acceleration pairs
+        dts - list with the delta t of each pair
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        percentiles - list of RotD percentiles (0-100) to compute
+        prune - use the rotd50 program shortcut, see rotate_responses
+        workers - number of worker processes, defaults to the number
+                  of cpus, 1 runs everything in this process
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        results - list with a (periods, psa1, psa2, rotd) tuple for
+                  each pair, as returned by calculate_rotd
+    """
+    periods = np.asarray(periods, dtype=np.float64)
+
+    tasks = []
+    for dt, padded, task_indices in get_stacks([min(len(acc1), len(acc2))
+                                                for acc1, acc2 in pairs],
+                                               dts, RSP_STACK_SIZE):
+        accs = np.zeros((len(task_indices), 2, padded))
+        for row, index in enumerate(task_indices):
+            acc1, acc2 = pairs[index]
+            samples = min(len(acc1), len(acc2), padded)
+            accs[row][0][:samples] = acc1[:samples]
+            accs[row][1][:samples] = acc2[:samples]
+        tasks.append((task_indices, (accs, dt, periods, damping,
+                                     percentiles, prune,
+                                     points_per_cycle)))
+
+    outputs = run_tasks(_rotd_task, [args for _, args in tasks], workers)
+
+    results = [None] * len(pairs)
+    for (task_indices, _), (psa1, psa2, rotd) in zip(tasks, outputs):
+        for row, index in enumerate(task_indices):
+            results[index] = (periods, psa1[row], psa2[row], rotd[row])
+
+    return results
+
+def calculate_rotd50(acc1, acc2, dt,
+                     periods=RSP_PERIODS, damping=RSP_DAMPING,
+                     points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the pseudo-spectral acceleration of two orthogonal
+    components and their RotD50, same as the rotd50 program when
+    points_per_cycle is None
+
+    Inputs:
+        acc1 - first horizontal acceleration timeseries
+        acc2 - second horizontal acceleration timeseries
+        dt - delta t of both timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        periods - array with the periods
+        psa1 - PSA for acc1, same units as the input
+        psa2 - PSA for acc2
+        rotd50 - RotD50 of the two components
+
+        With a list of damping values, outputs (other than periods)
+        are (dampings, periods) arrays
+    """
+    periods, psa1, psa2, rotd = calculate_rotd(
+        acc1, acc2, dt, periods=periods, damping=damping, percentiles=[50],
+        points_per_cycle=points_per_cycle)
+    return periods, psa1, psa2, rotd[..., 0, :]
+
+def calculate_psa_stack(accs, dt, periods=RSP_PERIODS, damping=RSP_DAMPING,
+                        points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the PSA of a stack of single components sharing the
+    same dt and number of samples. Gives the same values as the
+    psa1 output of calculate_rotd_stack, without any rotation
+
+    Inputs:
+        accs - (components, samples) array with the accelerations
+        dt - delta t of all timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        psa - (components, periods) array with the PSA
+
+        With a list of damping values, psa has an extra axis
+        for damping after the components axis
+    """
+    accs = np.asarray(accs, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)
+    dampings = np.atleast_1d(np.asarray(damping, dtype=np.float64))
+    psa = np.empty((accs.shape[0], dampings.size, periods.size))
+
+    ws = 2.0 * RSP_PI / periods
+    factors = get_period_factors(dt, periods, points_per_cycle)
+    for factor in np.unique(factors):
+        # Oversample to get accurate peaks at short periods
+        data = interpolate_fft(accs, factor)
+        indexes = np.nonzero(factors == factor)[0]
+
+        # Filters for the whole (damping, period) table
+        nums, dens = get_nj_filter(ws[np.newaxis, indexes],
+                                   dampings[:, np.newaxis], dt / factor)
+
+        for k in range(dampings.size):
+            for n, i in enumerate(indexes):
+                rsps = lfilter(nums[:, k, n], dens[:, k, n], data, axis=-1)
+                psa[:, k, i] = np.max(np.abs(rsps), axis=-1) * ws[i]**2
+
+    if np.ndim(damping) == 0:
+        return psa[:, 0]
+    return psa
+
+def calculate_psa(acc, dt, periods=RSP_PERIODS, damping=RSP_DAMPING,
+                  points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the pseudo-spectral acceleration of a single component,
+    as recorded
+
+    Inputs:
+        acc - acceleration timeseries
+        dt - delta t of the timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        periods - array with the periods
+        psa - PSA for acc, same units as the input, with an extra
+              first axis for damping if a list of damping values is used
+    """
+    psa = calculate_psa_stack(np.array([acc], dtype=np.float64), dt,
+                              periods=periods, damping=damping,
+                              points_per_cycle=points_per_cycle)
+
+    return np.asarray(periods, dtype=np.float64), psa[0]
+
+def _psa_task(accs, dt, periods, damping, points_per_cycle):
+    """
+    Worker function for calculate_psa_batch
+    """
+    return calculate_psa_stack(accs, dt, periods=periods, damping=damping,
+                               points_per_cycle=points_per_cycle)
+
+def calculate_psa_batch(accs, dts, periods=RSP_PERIODS, damping=RSP_DAMPING,
+                        workers=None, points_per_cycle=RSP_POINTS_PER_CYCLE):
+    """
+    Computes the PSA of many single components. Components with the
+    same dt and padded length are stacked (up to 2 * RSP_STACK_SIZE
+    components) and processed together, and the stacks are spread over
+    a pool of worker processes
+
+    Inputs:
+        accs - list of acceleration timeseries
+        dts - list with the delta t of each timeseries
+        periods - oscillator periods (s)
+        damping - fraction of critical damping, or a list of them
+        workers - number of worker processes, defaults to the number
+                  of cpus, 1 runs everything in this process
+        points_per_cycle - see calculate_rotd_stack
+    Outputs:
+        results - list with a (periods, psa) tuple for each
+                  timeseries, as returned by calculate_psa
+    """
+    periods = np.asarray(periods, dtype=np.float64)
+
+    tasks = []
+    for dt, padded, task_indices in get_stacks([len(acc) for acc in accs],
+                                               dts, 2 * RSP_STACK_SIZE):
+        data = np.zeros((len(task_indices), padded))
+        for row, index in enumerate(task_indices):
+            samples = min(len(accs[index]), padded)
+            data[row][:samples] = accs[index][:samples]
+        tasks.append((task_indices, (data, dt, periods, damping,
+                                     points_per_cycle)))
+
+    outputs = run_tasks(_psa_task, [args for _, args in tasks], workers)
+
+    results = [None] * len(accs)
+    for (task_indices, _), psa in zip(tasks, outputs):
+        for row, index in enumerate(task_indices):
+            results[index] = (periods, psa[row])
+
+    return results
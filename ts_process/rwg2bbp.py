@@ -38,79 +38,68 @@ from __future__ import division, print_function
 import os
 import sys
 import argparse
+import itertools
 import numpy as np
-from ts_library import integrate, derivative
+from file_utilities import read_data_chunks, write_velocity_chunks, \
+    READ_CHUNK_SIZE
 
-def get_dt(input_file):
+# Format of each data line in the output files
+DATA_FORMAT = "%1.9E %1.9E %1.9E %1.9E\n"
+
+def read_rwg_header(input_fp):
     """
-    Read RWG file and return DT
+    Reads the header lines at the top of the open rwg file, returns
+    the original header and an iterator over the remaining lines
     """
-    val1 = None
-    val2 = None
-    file_dt = None
-
-    # Figure out dt first, we need it later
-    ifile = open(input_file)
-    for line in ifile:
-        # Skip comments
-        if line.startswith("#") or line.startswith("%"):
+    original_header = []
+
+    for line in input_fp:
+        stripped = line.strip()
+        if stripped.startswith("#") or stripped.startswith("%"):
+            # keep original header
+            original_header.append(stripped)
             continue
-        pieces = line.split()
-        pieces = [float(piece) for piece in pieces]
+        # Put the first data line back
+        return original_header, itertools.chain([line], input_fp)
+
+    return original_header, iter([])
+
+def read_rwg_chunks(lines, chunk_size=READ_CHUNK_SIZE):
+    """
+    Reads data lines in rwg format one block at a time, yields delta_t
+    and arrays containing the time, vel_ns, vel_ew, vel_ud components
+    for each block
+    """
+    delta_t = None
+    pending = []
+
+    for rows in read_data_chunks(lines, chunk_size):
         # Skip negative data points
-        if pieces[0] < 0.0:
-            continue
-        if val1 is None:
-            val1 = pieces[0]
-            continue
-        if val2 is None:
-            val2 = pieces[0]
-            break
-    ifile.close()
+        rows = rows[rows[:, 0] >= 0.0]
+        if delta_t is None:
+            # Figure out dt first, we need at least two data points
+            pending.append(rows)
+            rows = np.concatenate(pending)
+            if rows.shape[0] < 2:
+                continue
+            delta_t = rows[1][0] - rows[0][0]
+        if rows.shape[0]:
+            yield delta_t, rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]
 
     # Quit if cannot figure out dt
-    if val1 is None or val2 is None:
+    if delta_t is None:
         print("Cannot determine dt from RWG file! Exiting...")
         sys.exit(1)
 
-    # Calculate dt
-    file_dt = val2 - val1
-
-    return file_dt
-# end get_dt
-
 def read_rwg(input_file):
     """
     Reads the input file in rwg format and returns arrays containing
     vel_ns, vel_ew, vel_ud components
     """
-    original_header = []
-    time = np.array([])
-    vel_ns = np.array([])
-    vel_ew = np.array([])
-    vel_ud = np.array([])
-
-    # Get RWG file dt
-    delta_t = get_dt(input_file)
-
     try:
         input_fp = open(input_file, 'r')
-        for line in input_fp:
-            line = line.strip()
-            if line.startswith("#") or line.startswith("%"):
-                # keep original header
-                original_header.append(line)
-                continue
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            # Skip negative data points
-            if pieces[0] < 0.0:
-                continue
-            # Add values to out arrays
-            time = np.append(time, pieces[0])
-            vel_ns = np.append(vel_ns, pieces[1])
-            vel_ew = np.append(vel_ew, pieces[2])
-            vel_ud = np.append(vel_ud, pieces[3])
+        original_header, lines = read_rwg_header(input_fp)
+        chunks = list(read_rwg_chunks(lines))
     except IOError as e:
         print(e)
         sys.exit(1)
@@ -118,6 +107,11 @@ def read_rwg(input_file):
     # All done
     input_fp.close()
 
+    delta_t = chunks[0][0]
+    time, vel_ns, vel_ew, vel_ud = [np.concatenate([chunk[i] for
+                                                    chunk in chunks])
+                                    for i in range(1, 5)]
+
     return original_header, delta_t, time, vel_ns, vel_ew, vel_ud
 
 def parse_rwg_header(header):
@@ -212,8 +206,13 @@ def rwg2bbp_main():
     output_file_acc = "%s.acc.bbp" % (os.path.join(args.output_dir,
                                                    args.output_stem))
 
-    # Read RWG file
-    header, delta_t, times, vel_h1, vel_h2, vel_ver = read_rwg(input_file)
+    # Read RWG file header
+    try:
+        input_fp = open(input_file, 'r')
+    except IOError as e:
+        print(e)
+        sys.exit(1)
+    header, lines = read_rwg_header(input_fp)
     rwg_params = parse_rwg_header(header)
 
     # Figure out what unit to use
@@ -236,16 +235,6 @@ def rwg2bbp_main():
         if args.station_name == "NoName":
             args.station_name = rwg_params["station"]
 
-    # Calculate displacement
-    dis_h1 = integrate(vel_h1, delta_t)
-    dis_h2 = integrate(vel_h2, delta_t)
-    dis_ver = integrate(vel_ver, delta_t)
-
-    # Calculate acceleration
-    acc_h1 = derivative(vel_h1, delta_t)
-    acc_h2 = derivative(vel_h2, delta_t)
-    acc_ver = derivative(vel_ver, delta_t)
-
     # Write header
     o_dis_file = open(output_file_dis, 'w')
     o_vel_file = open(output_file_vel, 'w')
@@ -257,20 +246,13 @@ def rwg2bbp_main():
     write_bbp_header(o_acc_file, "acceleration",
                      units[unit][2], args, header)
 
-    # Write files
-    for (time, disp_h1, disp_h2, disp_ver,
-         velo_h1, velo_h2, velo_ver,
-         accel_h1, accel_h2, accel_ver) in zip(times, dis_h1, dis_h2, dis_ver,
-                                               vel_h1, vel_h2, vel_ver,
-                                               acc_h1, acc_h2, acc_ver):
-        o_dis_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, disp_h1, disp_h2, disp_ver))
-        o_vel_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, velo_h1, velo_h2, velo_ver))
-        o_acc_file.write("%1.9E %1.9E %1.9E %1.9E\n" %
-                         (time, accel_h1, accel_h2, accel_ver))
+    # Write files, calculating displacement and acceleration as we go
+    write_velocity_chunks(read_rwg_chunks(lines),
+                          o_dis_file, o_vel_file, o_acc_file,
+                          line_format=DATA_FORMAT)
 
     # All done
+    input_fp.close()
     o_dis_file.close()
     o_vel_file.close()
     o_acc_file.close()
@@ -36,13 +36,18 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import re
 import sys
 import argparse
 import numpy as np
 
 # Import seismtools needed classes
 from ts_library import TimeseriesComponent, baseline_function, \
-    rotate_timeseries, check_station_data, integrate, G2CMSS
+    rotate_timeseries, check_station_data, G2CMSS
+from file_utilities import get_time_axis, write_data_columns
+
+# Fortran format descriptor of the data blocks, e.g. "(8F10.4)"
+SMC_FORMAT_RE = re.compile(r"\(\s*(\d+)\s*[FfEeGg]\s*(\d+)\s*\.\s*\d+\s*\)")
 
 def parse_arguments():
     """
@@ -82,12 +87,70 @@ def read_data(signal):
     data = np.array(data)
     return data
 
-def read_smc_v1(input_file):
+def get_data_format(line):
     """
-    Reads and processes a V1 file
+    Returns the (values per line, field width) tuple from the Fortran
+    format descriptor (e.g. "(8F10.4)") found in a data block
+    separator line, or None if no descriptor is present
     """
-    record_list = []
+    match = SMC_FORMAT_RE.search(line)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def read_fixed_width(lines, count, width, per_line, dtype=np.float64):
+    """
+    Decodes count fixed-width numeric fields laid out per_line fields
+    to a line into a numpy array in a single pass. Blank fields are
+    decoded as zeros. Raises ValueError if the block cannot be decoded
+    """
+    line_size = width * per_line
+    block = "".join([line.rstrip('\r\n')[:line_size].ljust(line_size)
+                     for line in lines])
+    fields = np.frombuffer(block.encode('ascii'),
+                           dtype='S%d' % (width))[:count]
+    if fields.size != count:
+        raise ValueError("expected %d values, found %d" %
+                         (count, fields.size))
+    try:
+        return fields.astype(dtype)
+    except ValueError:
+        # Only blank fields need special handling
+        fields = np.char.strip(fields)
+        fields[fields == b''] = b'0'
+        return fields.astype(dtype)
+
+def read_fixed_width_field(lines, index, width, per_line,
+                           dtype=np.float64):
+    """
+    Decodes only field index of a block of fixed-width numeric fields
+    laid out per_line fields to a line. A blank field is decoded as
+    zero. Raises ValueError if the field cannot be decoded
+    """
+    if index // per_line >= len(lines):
+        raise ValueError("field %d not found" % (index))
+    start = (index % per_line) * width
+    field = lines[index // per_line].rstrip('\r\n')[start:start + width]
+    return dtype(field.strip() or 0)
 
+def read_data_block(lines, count, data_format):
+    """
+    Decodes a data block using its fixed-width format, falling back
+    to the free-format parser for blocks that do not follow it
+    """
+    if data_format is not None and count > 0:
+        per_line, width = data_format
+        nlines = (count + per_line - 1) // per_line
+        try:
+            return read_fixed_width(lines[:nlines], count, width, per_line)
+        except (ValueError, UnicodeEncodeError):
+            pass
+    return read_data(" ".join(lines))
+
+def split_channels(input_file):
+    """
+    Reads an SMC file and returns a list with the lines of each channel
+    """
     # Loads station into a string
     try:
         fp = open(input_file, 'r')
@@ -114,6 +177,18 @@ def read_smc_v1(input_file):
     for i in range(1, len(channels)):
         del channels[i][0]
 
+    return channels
+
+def read_smc_v1(input_file):
+    """
+    Reads and processes a V1 file
+    """
+    record_list = []
+
+    channels = split_channels(input_file)
+    if not channels:
+        return False
+
     for i in range(len(channels)):
         # Check this is the uncorrected acceleration data
         ctype = channels[i][0][0:24].lower()
@@ -162,20 +237,16 @@ def read_smc_v1(input_file):
         delta_t = 1.0 / int(tmp[4])
 
         # Get signals' data
-        tmp = channels[i][28:]
-        signal = str()
-        for s in tmp:
-            signal += s
-        acc_data_g = read_data(signal)
+        acc_data_g = read_data_block(channels[i][28:], samples,
+                                     get_data_format(channels[i][27]))
         # Convert from g to cm/s/s
         acc_data = acc_data_g * G2CMSS
-        # Now integrate to get velocity and displacement
-        vel_data = integrate(acc_data, delta_t)
-        dis_data = integrate(vel_data, delta_t)
+        # Velocity and displacement are integrated only if needed
 
         print("[PROCESSING]: Found component: %s" % (orientation))
         record_list.append(TimeseriesComponent(samples, delta_t, orientation,
-                                               acc_data, vel_data, dis_data))
+                                               acc_data, None, None,
+                                               primary='acc'))
 
     station_metadata = {}
     station_metadata['network'] = network
@@ -196,32 +267,10 @@ def read_smc_v2(input_file):
     """
     record_list = []
 
-    # Loads station into a string
-    try:
-        fp = open(input_file, 'r')
-    except IOError as e:
-        print("[ERROR]: opening input file %s" % (input_file))
+    channels = split_channels(input_file)
+    if not channels:
         return False
 
-    # Print status message
-    print("[READING]: %s..." % (input_file))
-
-    # Read data
-    channels = fp.read()
-    fp.close()
-
-    # Splits the string by channels
-    channels = channels.split('/&')
-    del(channels[len(channels)-1])
-
-    # Splits the channels
-    for i in range(len(channels)):
-        channels[i] = channels[i].split('\n')
-
-    # Clean the first row in all but the first channel
-    for i in range(1, len(channels)):
-        del channels[i][0]
-
     for i in range(len(channels)):
         tmp = channels[i][0].split()
         # Check this is the corrected acceleration data
@@ -251,8 +300,15 @@ def read_smc_v2(input_file):
                          (float(tmp[8][:-1]) / 3600.0))
             longitude = "%s%s" % (str(longitude), tmp[8][-1])
 
-        # Get orientation from integer header
-        orientation = float(int(channels[i][26][50:55]))
+        # Get orientation from field 26 of the integer header
+        try:
+            orientation = float(read_fixed_width_field(channels[i][25:32],
+                                                       26, 5, 16,
+                                                       dtype=np.int64))
+        except ValueError:
+            print("[ERROR]: Cannot read orientation in file: %s" %
+                  (input_file))
+            return False
         if orientation == 360:
             orientation = 0.0
         elif orientation == 500:
@@ -294,37 +350,29 @@ def read_smc_v2(input_file):
         samples = int(tmp[0])
         delta_t = float(tmp[8])
 
-        # Get signals' data
-        tmp = channels[i][45:]
-        a_signal = str()
-        v_signal = str()
-        d_signal = str()
-
-        for s in tmp:
-            # Detecting separate line and get data type
-            if "points" in s.lower():
-                line = s.split()
-                if line[3].lower() == "accel" or line[3].lower() == "acc":
-                    dtype = 'a'
-                elif line[3].lower() == "veloc" or line[3].lower() == "vel":
-                    dtype = 'v'
-                elif line[3].lower() == "displ" or line[3].lower() == "dis":
-                    dtype = 'd'
-                else:
-                    dtype = "unknown"
-
-            # Processing data
+        # Get signals' data, each block starts with a separator line
+        blocks = {}
+        lines = channels[i][45:]
+        separators = [idx for idx, line in enumerate(lines)
+                      if "points" in line.lower()]
+        separators.append(len(lines))
+        for start, end in zip(separators[:-1], separators[1:]):
+            line = lines[start].split()
+            if line[3].lower() == "accel" or line[3].lower() == "acc":
+                dtype = 'a'
+            elif line[3].lower() == "veloc" or line[3].lower() == "vel":
+                dtype = 'v'
+            elif line[3].lower() == "displ" or line[3].lower() == "dis":
+                dtype = 'd'
             else:
-                if dtype == 'a':
-                    a_signal += s
-                elif dtype == 'v':
-                    v_signal += s
-                elif dtype == 'd':
-                    d_signal += s
+                continue
+            blocks[dtype] = read_data_block(lines[start+1:end],
+                                            int(line[0]),
+                                            get_data_format(lines[start]))
 
-        acc_data = read_data(a_signal)
-        vel_data = read_data(v_signal)
-        dis_data = read_data(d_signal)
+        acc_data = blocks.get('a', np.array([]))
+        vel_data = blocks.get('v', np.array([]))
+        dis_data = blocks.get('d', np.array([]))
 
         print("[PROCESSING]: Found component: %s" % (orientation))
         record_list.append(TimeseriesComponent(samples, delta_t, orientation,
@@ -373,9 +421,8 @@ def process_observation_data(station):
         _, new_acc, new_vel, new_dis = baseline_function(component.acc,
                                                          component.dt,
                                                          gscale, order)
-        component.acc = new_acc
-        component.vel = new_vel
-        component.dis = new_dis
+        # Replaces all three, nothing gets derived from the raw acc
+        component.set_quantities(new_acc, new_vel, new_dis)
 
     # Now rotate if needed, so that components are 0 and 90 degrees
     # Always pick the smaller angle for rotation
@@ -396,18 +443,18 @@ def write_bbp(station, station_metadata, destination):
     # round data to 7 decimals in order to print properly
     for component in station:
         if component.orientation in [0, 360, 180, -180]:
-            dis_ns = component.dis.tolist()
-            vel_ns = component.vel.tolist()
-            acc_ns = component.acc.tolist()
+            dis_ns = component.dis
+            vel_ns = component.vel
+            acc_ns = component.acc
         elif component.orientation in [90, -270, -90, 270]:
-            dis_ew = component.dis.tolist()
-            vel_ew = component.vel.tolist()
-            acc_ew = component.acc.tolist()
+            dis_ew = component.dis
+            vel_ew = component.vel
+            acc_ew = component.acc
         elif (component.orientation.upper() == "UP" or
               component.orientation.upper() == "DOWN"):
-            dis_up = component.dis.tolist()
-            vel_up = component.vel.tolist()
-            acc_up = component.acc.tolist()
+            dis_up = component.dis
+            vel_up = component.vel
+            acc_up = component.acc
         else:
             pass
 
@@ -425,11 +472,7 @@ def write_bbp(station, station_metadata, destination):
             return False
 
         # Start with time = 0.0
-        time = [0.000]
-        samples = component.samples
-        while samples > 1:
-            time.append(time[len(time)-1] + component.dt)
-            samples -= 1
+        time = get_time_axis(component.samples, component.dt)
 
         # Write header
         out_fp.write("#     Station= %s_%s\n" %
@@ -461,10 +504,7 @@ def write_bbp(station, station_metadata, destination):
         out_fp.write("#\n")
 
         # Write timeseries
-        for val_time, val_ns, val_ew, val_ud in zip(time, data[1],
-                                                    data[2], data[3]):
-            out_fp.write("%5.7f   %5.9e   %5.9e    %5.9e\n" %
-                         (val_time, val_ns, val_ew, val_ud))
+        write_data_columns(out_fp, [time, data[1], data[2], data[3]])
 
         # All done, close file
         out_fp.close()
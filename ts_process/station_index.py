@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Persistent index of the bbp files found in one or more directory
+trees. For each file only the header and the first two data lines
+are parsed, the number of samples comes from a count of the data
+lines (blank and comment lines are skipped). The
+index keeps station name, location, dt, number of samples, units,
+orientation and start time, so station lookups, duration checks,
+and distance calculations do not need to read the timeseries.
+
+Files are rescanned only when their size or modification time
+changes, files that disappeared are dropped from the index.
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import re
+import sys
+import json
+import argparse
+
+# Import seismtools needed functions
+from file_utilities import parse_bbp_header
+from ts_library import calculate_distance
+
+STATION_INDEX_VERSION = 2
+BBP_EXTENSION = ".bbp"
+# Bytes read at a time when counting data lines
+COUNT_BLOCK_SIZE = 1 << 20
+# Start of a line that is not blank or a comment
+DATA_LINE = re.compile(br"^[ \t\r\f\v]*[^\s#%]", re.M)
+
+def get_quantity_bbp(filename):
+    """
+    Returns dis, vel, or acc based on the bbp filename, or None
+    """
+    pieces = os.path.basename(filename).lower().split('.')
+    for quantity in ['dis', 'vel', 'acc']:
+        if quantity in pieces[1:]:
+            return quantity
+    return None
+
+def scan_bbp_file(filename):
+    """
+    Reads the header, the first two data lines, and the number of
+    data lines of a bbp file. Returns the index record for the file,
+    or None if the file cannot be parsed
+    """
+    header = []
+    times = []
+    samples = 0
+
+    try:
+        input_file = open(filename, 'rb')
+    except IOError:
+        print("[WARNING]: Cannot open file: %s" % (filename))
+        return None
+
+    # Header, and time of the first two samples
+    while len(times) < 2:
+        line = input_file.readline()
+        if not line:
+            break
+        line = line.decode('ascii', 'replace').strip()
+        if not line:
+            continue
+        if line.startswith('#') or line.startswith('%'):
+            header.append(line)
+            continue
+        try:
+            times.append(float(line.split()[0]))
+        except (IndexError, ValueError):
+            break
+        samples = samples + 1
+
+    # Count the remaining data lines without parsing them
+    rest = b""
+    while len(times) == 2:
+        block = input_file.read(COUNT_BLOCK_SIZE)
+        if not block:
+            break
+        # Lines cut at the end of the block are counted with the next one
+        block = rest + block
+        end = block.rfind(b"\n") + 1
+        samples = samples + len(DATA_LINE.findall(block, 0, end))
+        rest = block[end:]
+    # Last line without a line break
+    samples = samples + len(DATA_LINE.findall(rest))
+    input_file.close()
+
+    if len(times) < 2:
+        print("[WARNING]: Cannot find data in file: %s" % (filename))
+        return None
+
+    metadata = parse_bbp_header(header)
+    stat = os.stat(filename)
+    station = metadata['station']
+    if station is None:
+        station = os.path.basename(filename).split('.')[0]
+
+    return {'station': station,
+            'quantity': get_quantity_bbp(filename),
+            'lat': metadata['lat'],
+            'lon': metadata['lon'],
+            'dt': times[1] - times[0],
+            'samples': samples,
+            'start': times[0],
+            'units': metadata['units'],
+            'orientation': metadata['orientation'],
+            'time': metadata['time'],
+            'stamp': metadata['stamp'],
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+def find_bbp_files(directories):
+    """
+    Returns the absolute path of all bbp files found in the
+    directory trees
+    """
+    bbp_files = []
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if filename.lower().endswith(BBP_EXTENSION):
+                    bbp_files.append(os.path.abspath(os.path.join(root,
+                                                                  filename)))
+    return sorted(bbp_files)
+
+def read_station_list(filename):
+    """
+    Reads a station list with longitude, latitude, station name on
+    each line, returns a dictionary with [lat, lon] for each station
+    """
+    locations = {}
+    try:
+        st_file = open(filename, 'r')
+    except IOError:
+        print("[ERROR]: Cannot open station list: %s" % (filename))
+        sys.exit(-1)
+    for line in st_file:
+        line = line.strip()
+        if not line:
+            # skip blank lines
+            continue
+        if line.startswith("#") or line.startswith("%"):
+            # Skip comments
+            continue
+        pieces = line.split()
+        if len(pieces) < 3:
+            # Skip line with insufficient tokens
+            continue
+        if pieces[2].lower() in locations:
+            # Keep the first match, like the sequential scan
+            continue
+        locations[pieces[2].lower()] = [float(pieces[1]), float(pieces[0])]
+    st_file.close()
+
+    return locations
+
+class StationIndex(object):
+    """
+    This class keeps the metadata of a set of bbp files, and
+    the station locations read from station lists
+
+    Variables:
+
+        filename - json file where the index is stored
+        records - dictionary with the record for each bbp file
+        locations - dictionary with [lat, lon] from station lists
+        stations - dictionary with the bbp files for each station
+    """
+    def __init__(self, filename=None):
+        """
+        Loads the index from filename if it exists
+        """
+        self.filename = filename
+        self.records = {}
+        self.locations = {}
+        self.stations = {}
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        """
+        Reads the index from its json file
+        """
+        try:
+            index_file = open(self.filename, 'r')
+            index = json.load(index_file)
+            index_file.close()
+        except (IOError, ValueError):
+            print("[ERROR]: Cannot read station index: %s" % (self.filename))
+            sys.exit(-1)
+        if index.get('version') != STATION_INDEX_VERSION:
+            # Old format, start over
+            print("[WARNING]: Rebuilding station index: %s" % (self.filename))
+            return
+        self.records = index['files']
+        self.locations = index['locations']
+        self.update_stations()
+
+    def save(self):
+        """
+        Writes the index to its json file
+        """
+        index = {'version': STATION_INDEX_VERSION,
+                 'files': self.records,
+                 'locations': self.locations}
+        tmp_file = "%s.tmp%d" % (self.filename, os.getpid())
+        try:
+            index_file = open(tmp_file, 'w')
+            json.dump(index, index_file, indent=1, sort_keys=True)
+            index_file.close()
+            os.rename(tmp_file, self.filename)
+        except (IOError, OSError):
+            print("[ERROR]: Cannot write station index: %s" % (self.filename))
+            sys.exit(-1)
+
+    def update_stations(self):
+        """
+        Rebuilds the station name to bbp files mapping
+        """
+        self.stations = {}
+        for filename in sorted(self.records):
+            station = self.records[filename]['station'].lower()
+            self.stations.setdefault(station, []).append(filename)
+
+    def update(self, directories):
+        """
+        Scans the directory trees, rescanning only new or modified
+        files and dropping files no longer there.
+        Returns the number of files scanned and removed
+        """
+        directories = [os.path.abspath(directory) for
+                       directory in directories]
+        bbp_files = find_bbp_files(directories)
+        scanned = 0
+
+        for filename in bbp_files:
+            record = self.records.get(filename, None)
+            stat = os.stat(filename)
+            if (record is not None and
+                    record['size'] == stat.st_size and
+                    record['mtime'] == stat.st_mtime):
+                # File did not change
+                continue
+            record = scan_bbp_file(filename)
+            scanned = scanned + 1
+            if record is None:
+                self.records.pop(filename, None)
+            else:
+                self.records[filename] = record
+
+        # Remove files under these directories that are gone
+        found = set(bbp_files)
+        removed = [filename for filename in self.records
+                   if filename not in found and
+                   any([filename.startswith(directory + os.sep)
+                        for directory in directories])]
+        for filename in removed:
+            del self.records[filename]
+
+        self.update_stations()
+        return scanned, len(removed)
+
+    def add_station_list(self, filename):
+        """
+        Adds the station locations found in a station list
+        """
+        self.locations.update(read_station_list(filename))
+
+    def get_record(self, filename):
+        """
+        Returns the index record for a bbp file, or None if the
+        file is not in the index or changed since it was scanned
+        """
+        filename = os.path.abspath(filename)
+        record = self.records.get(filename, None)
+        if record is None:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+            return None
+        return record
+
+    def lookup(self, station):
+        """
+        Returns the records of all bbp files for station
+        """
+        return [self.records[filename] for filename in
+                self.stations.get(station.lower(), [])]
+
+    def get_location(self, station):
+        """
+        Returns the [lat, lon] of station, or None if not known
+        """
+        if station.lower() in self.locations:
+            return self.locations[station.lower()]
+        for record in self.lookup(station):
+            if record['lat'] is not None and record['lon'] is not None:
+                return [record['lat'], record['lon']]
+        return None
+
+    def get_distance(self, station, epicenter):
+        """
+        Returns the distance in km between station and the
+        [lat, lon] epicenter, or None if the location is not known
+        """
+        location = self.get_location(station)
+        if location is None:
+            return None
+        return calculate_distance(epicenter, location)
+
+    def get_duration(self, filename):
+        """
+        Returns the time of the last sample in filename, or None if
+        the file is not indexed
+        """
+        record = self.get_record(filename)
+        if record is None:
+            return None
+        return record['start'] + (record['samples'] - 1) * record['dt']
+
+    def get_common_duration(self, filenames):
+        """
+        Returns the time of the last sample that all files have, or
+        None if any of them is not indexed
+        """
+        durations = [self.get_duration(filename) for filename in filenames]
+        if not durations or None in durations:
+            return None
+        return min(durations)
+
+    def check_xmax(self, filenames, xmax):
+        """
+        Exits if the plot window goes past the end of any of the
+        files, so the check is done before reading any data
+        """
+        duration = self.get_common_duration(filenames)
+        if duration is not None and duration < xmax:
+            print("[ERROR]: t_max has to be under %f" % (duration))
+            sys.exit(1)
+# end of StationIndex
+
+def parse_arguments():
+    """
+    This function takes care of parsing the command-line arguments and
+    asking the user for any missing parameters that we need
+    """
+    parser = argparse.ArgumentParser(description="Creates or updates an "
+                                     "index of the bbp files in one or "
+                                     "more directories.")
+    parser.add_argument("-o", "--output", dest="outfile", required=True,
+                        help="station index file")
+    parser.add_argument("--station-list", dest="station_list",
+                        help="station list with latitude and longitude")
+    parser.add_argument('directories', nargs='*')
+    args = parser.parse_args()
+
+    if not args.directories and args.station_list is None:
+        print("[ERROR]: Please provide directories or a station list!")
+        sys.exit(-1)
+
+    return args
+
+def station_index_main():
+    """
+    Main function for station_index
+    """
+    # Parse command-line options
+    args = parse_arguments()
+
+    index = StationIndex(args.outfile)
+    if args.station_list is not None:
+        index.add_station_list(args.station_list)
+    scanned, removed = index.update(args.directories)
+    print("[INFO]: Scanned %d files, removed %d, %d files indexed" %
+          (scanned, removed, len(index.records)))
+    print("[WRITING]: %s" % (args.outfile))
+    index.save()
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    station_index_main()
+# end of main program
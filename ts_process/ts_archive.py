@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Single-file archive holding many stations. Each station keeps its
+displacement, velocity, and acceleration timeseries for the 3
+components together with dt, orientation and header metadata.
+
+File layout:
+
+    magic (8 bytes), index offset (8 bytes), index size (8 bytes)
+    station data blocks, one (3, 3, samples) float64 array each
+    json index: station name -> offset, samples, dt, orientation, metadata
+
+The index is stored at the end of the file, so stations can be written
+one at a time and a single station can be loaded (memory-mapped)
+without reading the rest of the archive.
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import json
+import struct
+import numpy as np
+
+# Import seismtools needed functions
+from ts_library import station_to_array, array_to_station, \
+    STATION_QUANTITIES
+
+ARCHIVE_EXTENSION = ".tsa"
+ARCHIVE_MAGIC = b"TSARCH01"
+ARCHIVE_VERSION = 1
+# Station data blocks start at a multiple of this many bytes
+ARCHIVE_ALIGN = 64
+# Size of magic plus index offset and index size
+ARCHIVE_PREAMBLE = len(ARCHIVE_MAGIC) + 16
+
+# Keep indexes already loaded, keyed by path, size, and mtime
+_INDEX_CACHE = {}
+
+def is_archive_file(filename):
+    """
+    Returns True if filename refers to an archive, either
+    by itself or as archive.tsa:station
+    """
+    archive_file, _ = split_archive_filename(filename)
+    return archive_file.lower().endswith(ARCHIVE_EXTENSION)
+
+def split_archive_filename(filename):
+    """
+    Splits archive.tsa:station into the archive filename and
+    the station name (None if no station is given)
+    """
+    idx = filename.lower().rfind("%s:" % (ARCHIVE_EXTENSION))
+    if idx < 0:
+        return filename, None
+    idx = idx + len(ARCHIVE_EXTENSION)
+    return filename[:idx], filename[(idx + 1):]
+
+class ArchiveWriter(object):
+    """
+    This class writes stations to an archive file, one at a time.
+    The index is written when the archive is closed.
+
+    Variables:
+
+        filename - archive filename
+        index - dictionary with the stations written so far
+    """
+    def __init__(self, filename):
+        """
+        Create the archive file and write its preamble
+        """
+        self.filename = filename
+        self.index = {}
+        try:
+            self.out_fp = open(filename, 'wb')
+        except IOError:
+            print("[ERROR]: Cannot create archive file: %s" % (filename))
+            sys.exit(-1)
+        # Index offset and size are filled in when closing the file
+        self.out_fp.write(ARCHIVE_MAGIC)
+        self.out_fp.write(struct.pack("<QQ", 0, 0))
+
+    def add_station(self, name, station, metadata=None):
+        """
+        Writes the dis/vel/acc arrays of station to the archive
+        """
+        if name in self.index:
+            print("[ERROR]: Duplicate station in archive: %s" % (name))
+            sys.exit(-1)
+
+        # Align the data block
+        offset = self.out_fp.tell()
+        padding = (-offset) % ARCHIVE_ALIGN
+        self.out_fp.write(b"\0" * padding)
+        offset = offset + padding
+
+        self.out_fp.write(station_to_array(station).astype('<f8').tobytes())
+        self.index[name] = {'offset': offset,
+                            'samples': station[0].samples,
+                            'dt': station[0].dt,
+                            'orientation': [component.orientation for
+                                            component in station],
+                            'metadata': metadata or {}}
+
+    def close(self):
+        """
+        Writes the index and closes the archive file
+        """
+        index = json.dumps({'version': ARCHIVE_VERSION,
+                            'quantities': STATION_QUANTITIES,
+                            'stations': self.index}).encode('utf-8')
+        index_offset = self.out_fp.tell()
+        self.out_fp.write(index)
+        self.out_fp.seek(len(ARCHIVE_MAGIC))
+        self.out_fp.write(struct.pack("<QQ", index_offset, len(index)))
+        self.out_fp.close()
+        print("[WRITING]: %s (%d stations)" % (self.filename,
+                                               len(self.index)))
+
+def read_archive_index(filename):
+    """
+    Reads the index of an archive file, returns a dictionary
+    with the stations in the archive
+    """
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        print("[ERROR]: No such file: %s" % (filename))
+        sys.exit(-1)
+    key = (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime)
+    if key in _INDEX_CACHE:
+        return _INDEX_CACHE[key]
+
+    try:
+        input_file = open(filename, 'rb')
+        magic = input_file.read(len(ARCHIVE_MAGIC))
+        if magic != ARCHIVE_MAGIC:
+            print("[ERROR]: Not an archive file: %s" % (filename))
+            sys.exit(-1)
+        index_offset, index_size = struct.unpack("<QQ", input_file.read(16))
+        if index_offset == 0:
+            print("[ERROR]: Incomplete archive file: %s" % (filename))
+            sys.exit(-1)
+        input_file.seek(index_offset)
+        index = json.loads(input_file.read(index_size).decode('utf-8'))
+        input_file.close()
+    except (IOError, ValueError, struct.error):
+        print("[ERROR]: Reading archive file: %s" % (filename))
+        sys.exit(-1)
+
+    if index['version'] != ARCHIVE_VERSION:
+        print("[ERROR]: Unsupported archive version: %s" % (filename))
+        sys.exit(-1)
+
+    _INDEX_CACHE[key] = index['stations']
+    return index['stations']
+
+def list_archive(filename):
+    """
+    Returns the names of the stations in an archive file
+    """
+    return sorted(read_archive_index(filename))
+
+def read_archive_station(filename, name, metadata=None):
+    """
+    Loads a station from an archive file, the timeseries are
+    memory-mapped copy-on-write so changes never reach the archive.
+    If a metadata dictionary is provided, it is updated with the
+    station's metadata.
+    """
+    index = read_archive_index(filename)
+    if name not in index:
+        print("[ERROR]: Station %s not found in archive: %s" % (name,
+                                                                filename))
+        sys.exit(-1)
+    entry = index[name]
+
+    data = np.memmap(filename, dtype='<f8', mode='c',
+                     offset=entry['offset'],
+                     shape=(3, 3, entry['samples']))
+
+    if metadata is not None:
+        metadata.update(entry['metadata'])
+    return array_to_station(data, entry['dt'], entry['orientation'])
+
+def resolve_archive_station(filename):
+    """
+    Returns the archive filename and station name for a station given
+    as archive.tsa:station, the station name can be omitted if the
+    archive contains a single station
+    """
+    archive_file, name = split_archive_filename(filename)
+    if not name:
+        names = list_archive(archive_file)
+        if len(names) != 1:
+            print("[ERROR]: Please specify station as %s:station!" %
+                  (archive_file))
+            sys.exit(-1)
+        name = names[0]
+
+    return archive_file, name
+
+def read_archive_metadata(filename):
+    """
+    Returns a copy of the metadata of a station given
+    as archive.tsa:station
+    """
+    archive_file, name = resolve_archive_station(filename)
+    index = read_archive_index(archive_file)
+    if name not in index:
+        print("[ERROR]: Station %s not found in archive: %s" % (name,
+                                                                archive_file))
+        sys.exit(-1)
+
+    return dict(index[name]['metadata'])
+
+def read_file_archive(filename, metadata=None):
+    """
+    Reads a station given as archive.tsa:station
+    """
+    archive_file, name = resolve_archive_station(filename)
+
+    return read_archive_station(archive_file, name, metadata=metadata)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Content-addressed cache for expensive computations. Results are keyed
+by a hash of the input arrays (their bytes, dtype and shape) and of the
+other parameters, so repeated analyses of the same records with the same
+settings return immediately.
+
+There are two tiers: an in-memory LRU tier limited by the size of the
+arrays it holds, and an optional on-disk tier (one pickle file per
+result) where the least recently used files are removed once the
+directory grows over its limit. The cache is disabled until
+enable_cache is called.
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import copy
+import pickle
+import hashlib
+import inspect
+import functools
+import collections
+import numpy as np
+
+# Bump when cached functions change their results
+CACHE_VERSION = 6
+CACHE_EXTENSION = ".pkl"
+# Default size limits in bytes
+CACHE_MEMORY_SIZE = 256 * 1024 * 1024
+CACHE_DISK_SIZE = 2 * 1024 * 1024 * 1024
+# Digest size in bytes
+CACHE_DIGEST_SIZE = 20
+
+# Cache state, the cache is off until enable_cache is called
+_CACHE = {'enabled': False,
+          'memory_size': CACHE_MEMORY_SIZE,
+          'directory': None,
+          'disk_size': CACHE_DISK_SIZE}
+# Memory tier: key -> (size, value), in least recently used order
+_MEMORY = collections.OrderedDict()
+_MEMORY_USED = [0]
+
+class UnhashableInput(Exception):
+    """
+    Raised when a parameter cannot be used to build a cache key
+    """
+    pass
+
+def enable_cache(directory=None, memory_size=CACHE_MEMORY_SIZE,
+                 disk_size=CACHE_DISK_SIZE):
+    """
+    Enables the cache, results are kept in memory (up to memory_size
+    bytes) and, if directory is given, also on disk (up to disk_size
+    bytes)
+    """
+    if directory is not None and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            print("[ERROR]: Cannot create cache directory: %s" % (directory))
+            sys.exit(-1)
+
+    _CACHE['enabled'] = True
+    _CACHE['memory_size'] = memory_size
+    _CACHE['directory'] = directory
+    _CACHE['disk_size'] = disk_size
+
+def disable_cache():
+    """
+    Disables the cache and drops the memory tier
+    """
+    _CACHE['enabled'] = False
+    clear_memory_cache()
+
+def is_cache_enabled():
+    """
+    Returns True if the cache is enabled
+    """
+    return _CACHE['enabled']
+
+def clear_memory_cache():
+    """
+    Drops all results kept in memory
+    """
+    _MEMORY.clear()
+    _MEMORY_USED[0] = 0
+
+def new_hash():
+    """
+    Returns a new hash object, blake2b if available
+    """
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(digest_size=CACHE_DIGEST_SIZE)
+    return hashlib.sha1()
+
+def update_hash(digest, value):
+    """
+    Adds value to the hash, each type is tagged so different
+    values never produce the same byte stream
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise UnhashableInput(value.dtype.str)
+        value = np.ascontiguousarray(value)
+        digest.update(("a%s%s" % (value.dtype.str,
+                                  value.shape)).encode('utf-8'))
+        digest.update(value.view(np.uint8).reshape(-1))
+    elif isinstance(value, (list, tuple)):
+        digest.update(("l%d" % (len(value))).encode('utf-8'))
+        for item in value:
+            update_hash(digest, item)
+    elif isinstance(value, dict):
+        digest.update(("d%d" % (len(value))).encode('utf-8'))
+        for key in sorted(value):
+            update_hash(digest, key)
+            update_hash(digest, value[key])
+    elif value is None or isinstance(value, (bool, int, float, str,
+                                             np.generic)):
+        # repr keeps all the digits of floats
+        digest.update(("s%s:%r" % (type(value).__name__,
+                                   value)).encode('utf-8'))
+    else:
+        raise UnhashableInput(type(value).__name__)
+
+def get_cache_key(name, *values):
+    """
+    Returns the cache key for function name applied to values,
+    None if some of the values cannot be hashed
+    """
+    digest = new_hash()
+    update_hash(digest, "%s:%d" % (name, CACHE_VERSION))
+    try:
+        update_hash(digest, values)
+    except UnhashableInput:
+        return None
+
+    return digest.hexdigest()
+
+def get_size(value):
+    """
+    Returns the approximate size in bytes of a result
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum([get_size(item) for item in value]) + 64
+    return 64
+
+def get_disk_filename(key):
+    """
+    Returns the on-disk cache filename for key
+    """
+    return os.path.join(_CACHE['directory'], "%s%s" % (key,
+                                                       CACHE_EXTENSION))
+
+def read_disk_cache(key):
+    """
+    Returns (True, value) if key is in the on-disk tier,
+    (False, None) otherwise
+    """
+    cache_file = get_disk_filename(key)
+    try:
+        input_file = open(cache_file, 'rb')
+    except IOError:
+        return False, None
+    try:
+        value = pickle.load(input_file)
+    except Exception:
+        # Damaged file, remove it
+        input_file.close()
+        print("[WARNING]: Removing bad cache file: %s" % (cache_file))
+        try:
+            os.unlink(cache_file)
+        except OSError:
+            pass
+        return False, None
+    input_file.close()
+
+    # Mark it as recently used
+    try:
+        os.utime(cache_file, None)
+    except OSError:
+        pass
+    return True, value
+
+def evict_disk_cache():
+    """
+    Removes the least recently used files from the on-disk tier
+    until it fits within its size limit
+    """
+    entries = []
+    total = 0
+    for filename in os.listdir(_CACHE['directory']):
+        if not filename.endswith(CACHE_EXTENSION):
+            continue
+        cache_file = os.path.join(_CACHE['directory'], filename)
+        try:
+            file_stat = os.stat(cache_file)
+        except OSError:
+            continue
+        entries.append((file_stat.st_mtime, file_stat.st_size, cache_file))
+        total = total + file_stat.st_size
+
+    for _, size, cache_file in sorted(entries):
+        if total <= _CACHE['disk_size']:
+            break
+        try:
+            os.unlink(cache_file)
+        except OSError:
+            pass
+        total = total - size
+
+def write_disk_cache(key, value):
+    """
+    Writes value to the on-disk tier
+    """
+    cache_file = get_disk_filename(key)
+    # Write to a temporary file, then move it in place
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    try:
+        out_fp = open(tmp_file, 'wb')
+        pickle.dump(value, out_fp, protocol=pickle.HIGHEST_PROTOCOL)
+        out_fp.close()
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError, pickle.PicklingError):
+        print("[WARNING]: Cannot write cache file: %s" % (cache_file))
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+        return
+    evict_disk_cache()
+
+def store_memory_cache(key, value):
+    """
+    Adds value to the memory tier, dropping the least recently
+    used results to stay within its size limit
+    """
+    size = get_size(value)
+    if size > _CACHE['memory_size']:
+        return
+    if key in _MEMORY:
+        _MEMORY_USED[0] = _MEMORY_USED[0] - _MEMORY.pop(key)[0]
+    _MEMORY[key] = (size, value)
+    _MEMORY_USED[0] = _MEMORY_USED[0] + size
+    while _MEMORY_USED[0] > _CACHE['memory_size']:
+        _, (old_size, _) = _MEMORY.popitem(last=False)
+        _MEMORY_USED[0] = _MEMORY_USED[0] - old_size
+
+def cache_get(key):
+    """
+    Looks up key in the memory tier, then in the on-disk tier.
+    Returns (True, copy of the value) on a hit, (False, None) otherwise
+    """
+    if not _CACHE['enabled'] or key is None:
+        return False, None
+
+    if key in _MEMORY:
+        # Move it to the most recently used end
+        size, value = _MEMORY.pop(key)
+        _MEMORY[key] = (size, value)
+        return True, copy.deepcopy(value)
+
+    if _CACHE['directory'] is not None:
+        found, value = read_disk_cache(key)
+        if found:
+            store_memory_cache(key, value)
+            return True, copy.deepcopy(value)
+
+    return False, None
+
+def cache_put(key, value):
+    """
+    Stores a copy of value under key in all tiers
+    """
+    if not _CACHE['enabled'] or key is None:
+        return
+
+    value = copy.deepcopy(value)
+    store_memory_cache(key, value)
+    if _CACHE['directory'] is not None:
+        write_disk_cache(key, value)
+
+def memoize(name, key=None):
+    """
+    Decorator caching the results of a function. The cache key is made
+    from all the arguments (defaults included), or is whatever the key
+    function returns when called with the same arguments. Callers
+    always get their own copy of the results.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _CACHE['enabled']:
+                return function(*args, **kwargs)
+
+            if key is None:
+                call_args = inspect.getcallargs(function, *args, **kwargs)
+                cache_key = get_cache_key(name, call_args)
+            else:
+                cache_key = key(*args, **kwargs)
+
+            found, value = cache_get(cache_key)
+            if found:
+                return value
+            value = function(*args, **kwargs)
+            cache_put(cache_key, value)
+            return value
+        return wrapper
+    return decorator
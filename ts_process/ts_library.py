@@ -43,18 +43,74 @@ import shutil
 import tempfile
 import numpy as np
 import subprocess
+import multiprocessing
+from fractions import Fraction
+from functools import partial, lru_cache
 from scipy import interpolate
-from scipy.signal import sosfiltfilt, filtfilt, ellip, butter, kaiser
+from scipy.signal import sosfilt, sosfiltfilt, ellip, butter, kaiser, \
+    firwin, resample_poly, sosfreqz, sos2zpk, sosfilt_zi
+try:
+    from scipy.fft import rfft, irfft, next_fast_len
+except ImportError:
+    # Older scipy
+    from numpy.fft import rfft, irfft
+    from scipy.fftpack import next_fast_len
 from scipy.integrate import cumtrapz
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # No thread pool, rows are filtered in a single call
+    ThreadPoolExecutor = None
 import matplotlib as mpl
 if mpl.get_backend() != 'agg':
     mpl.use('Agg') # Disables use of Tk/X11
 import matplotlib.pyplot as plt
 import pylab
 
+# Import seismtools needed functions
+from rsp_library import calculate_rotd50, calculate_rotd_batch, \
+    calculate_psa, calculate_psa_batch, RSP_PERIODS, RSP_DAMPING
+from ts_cache import memoize, get_cache_key, cache_get, cache_put, \
+    is_cache_enabled
+
 # This is used to convert from accel in g to accel in cm/s/s
 G2CMSS = 980.665 # Convert g to cm/s/s
 
+# Order of the quantities when a station is stacked into a single array
+STATION_QUANTITIES = ['dis', 'vel', 'acc']
+# Each quantity is integrated to get the next one in this list
+DERIVATION_ORDER = ['acc', 'vel', 'dis']
+# Resampling kernel: samples on each side of the output point,
+# Kaiser window shape, and number of output samples computed at a time
+INTERP_HALF_WIDTH = 64
+INTERP_KAISER_BETA = 8.0
+INTERP_CHUNK_SIZE = 4096
+# Largest up/down factors handled by the rational resampling path,
+# and anti-alias filter taps on each side, per unit of the larger factor
+RESAMPLE_MAX_FACTOR = 64
+RESAMPLE_HALF_WIDTH = 32
+# Resampling methods: 4th order Butterworth low-pass then sinc interp,
+# or a single polyphase FIR pass when the dt ratio allows it
+RESAMPLE_METHODS = ['interp', 'polyphase']
+# Number of filter designs kept by get_filter_sos
+FILTER_CACHE_SIZE = 128
+# Min number of rows given to each thread by filter_rows
+FILTER_BLOCK_ROWS = 64
+# Filtering engines: forward-backward IIR filtering of the second-order
+# sections, or the same zero-phase response applied in the rfft domain
+FILTER_ENGINES = ['iir', 'fft']
+# The fft engine extends records until the impulse response of the
+# filter has decayed below this fraction of its initial amplitude,
+# results match the iir engine within this tolerance
+FILTER_FFT_TOLERANCE = 1e-8
+# Streaming filter modes: causal filtering carrying the filter state
+# across chunks, or approximate zero-phase filtering of overlapping blocks
+STREAM_MODES = ['causal', 'zero-phase']
+# Min number of samples output at a time in zero-phase mode, and
+# tolerance used to choose the overlap between blocks
+STREAM_BLOCK_SIZE = 65536
+STREAM_TOLERANCE = 1e-8
+
 def cleanup(dir_name):
     """
     This function removes the temporary directory
@@ -75,10 +131,24 @@ class TimeseriesComponent(object):
         acc - acceleration timeseries
         vel - velocity timeseries
         dis - displacement timeseries
+
+    Any of acc, vel, dis can be given as None together with a loader,
+    a function without arguments that returns the array. The loader
+    is only called the first time the quantity is used.
+
+    If primary is set to one of acc, vel, dis, only that quantity is
+    stored and the other two are derived from it (using integrate and
+    derivative) the first time they are used. Derived quantities are
+    kept until the primary quantity or dt change. Setting a derived
+    quantity turns the component back into one storing all three.
+    In this mode all quantities are returned as read-only arrays, so
+    the primary quantity cannot be changed in place behind the derived
+    ones: changes must be made by setting the quantity.
     """
     def __init__(self, samples, dt,
                  orientation,
-                 acc, vel, dis):
+                 acc, vel, dis,
+                 loaders=None, primary=None):
         """
         Initialize the class attributes with the parameters
         provided by the user
@@ -86,9 +156,214 @@ class TimeseriesComponent(object):
         self.samples = samples
         self.dt = dt
         self.orientation = orientation
-        self.acc = acc
-        self.vel = vel
-        self.dis = dis
+        self.primary = primary
+        self._loaders = dict(loaders or {})
+        self._derived = {}
+        self._derived_dt = dt
+        self._acc = acc
+        self._vel = vel
+        self._dis = dis
+
+    def stored_quantities(self):
+        """
+        Returns the quantities stored (not derived) in this component,
+        processing functions only need to operate on these
+        """
+        if self.primary is not None:
+            return [self.primary]
+        return ['acc', 'vel', 'dis']
+
+    def get_quantity(self, quantity):
+        """
+        Returns acc, vel, or dis, calling its loader or deriving
+        it if needed. Arrays are read-only if primary is set
+        """
+        data = self._get_quantity(quantity)
+        if self.primary is not None and isinstance(data, np.ndarray):
+            data = data.view()
+            data.flags.writeable = False
+        return data
+
+    def _get_quantity(self, quantity):
+        """
+        Returns acc, vel, or dis as stored, see get_quantity
+        """
+        if self.primary is not None and quantity != self.primary:
+            return self.derive_quantity(quantity)
+        data = getattr(self, "_%s" % (quantity))
+        if data is None and quantity in self._loaders:
+            data = self._loaders.pop(quantity)()
+            setattr(self, "_%s" % (quantity), data)
+        return data
+
+    def derive_quantity(self, quantity):
+        """
+        Returns quantity derived from the primary quantity, stepping
+        through the quantities in between (e.g. dis from acc goes
+        through vel)
+        """
+        if self._derived_dt != self.dt:
+            # dt changed, derived quantities are no longer valid
+            self._derived = {}
+            self._derived_dt = self.dt
+        if quantity not in self._derived:
+            index = DERIVATION_ORDER.index(quantity)
+            if index > DERIVATION_ORDER.index(self.primary):
+                source = self._get_quantity(DERIVATION_ORDER[index - 1])
+                data = integrate(source, self.dt)
+            else:
+                source = self._get_quantity(DERIVATION_ORDER[index + 1])
+                data = derivative(source, self.dt)
+            self._derived[quantity] = data
+        return self._derived[quantity]
+
+    def store_all(self):
+        """
+        Derives and stores all quantities, leaving the primary mode
+        """
+        if self.primary is None:
+            return
+        for quantity in DERIVATION_ORDER:
+            if quantity != self.primary:
+                setattr(self, "_%s" % (quantity),
+                        self.derive_quantity(quantity))
+        self.primary = None
+        self._derived = {}
+
+    def derive_from(self, quantity):
+        """
+        Keeps only quantity, the other two are derived from it from
+        now on. Pending loaders for the other quantities are dropped,
+        so those are never read
+        """
+        if self.primary == quantity:
+            return
+        if self.primary is not None:
+            # Keep what is currently derived from the old primary
+            setattr(self, "_%s" % (quantity), self._get_quantity(quantity))
+        for other in DERIVATION_ORDER:
+            if other != quantity:
+                setattr(self, "_%s" % (other), None)
+                self._loaders.pop(other, None)
+        self.primary = quantity
+        self._derived = {}
+        self._derived_dt = self.dt
+
+    def set_quantity(self, quantity, data):
+        """
+        Sets acc, vel, or dis, replacing any pending loader
+        """
+        if self.primary is not None and quantity != self.primary:
+            # Stop deriving, the quantities are now set independently
+            self.store_all()
+        self._loaders.pop(quantity, None)
+        self._derived = {}
+        setattr(self, "_%s" % (quantity), data)
+
+    def set_quantities(self, acc, vel, dis):
+        """
+        Sets acc, vel, and dis at once, leaving the primary mode
+        without deriving the quantities that are replaced
+        """
+        self.primary = None
+        self._loaders = {}
+        self._derived = {}
+        self._acc = acc
+        self._vel = vel
+        self._dis = dis
+
+    def is_loaded(self, quantity):
+        """
+        Returns False if quantity is still waiting for its loader
+        """
+        return quantity not in self._loaders
+
+    def transform(self, quantity, function, *args, **kwargs):
+        """
+        Replaces quantity with function(quantity, *args, **kwargs).
+        A quantity that is not loaded yet is transformed when it
+        gets loaded
+        """
+        if self.is_loaded(quantity):
+            self.set_quantity(quantity, function(self.get_quantity(quantity),
+                                                 *args, **kwargs))
+        else:
+            self._loaders[quantity] = partial(_load_transformed,
+                                              self._loaders[quantity],
+                                              function, args, kwargs)
+
+    @property
+    def acc(self):
+        return self.get_quantity('acc')
+
+    @acc.setter
+    def acc(self, data):
+        self.set_quantity('acc', data)
+
+    @property
+    def vel(self):
+        return self.get_quantity('vel')
+
+    @vel.setter
+    def vel(self, data):
+        self.set_quantity('vel', data)
+
+    @property
+    def dis(self):
+        return self.get_quantity('dis')
+
+    @dis.setter
+    def dis(self, data):
+        self.set_quantity('dis', data)
+
+def _load_transformed(loader, function, args, kwargs):
+    """
+    Loader that applies a pending transform to the loaded data
+    """
+    return function(loader(), *args, **kwargs)
+
+def station_to_array(station):
+    """
+    Stacks the displacement, velocity, and acceleration arrays of a
+    station into a single array
+
+    Inputs:
+        station - array containing 3 TimeseriesComponent structures
+    Outputs:
+        data - (3, 3, samples) array, indexed by quantity (in
+               STATION_QUANTITIES order), component, and sample
+    """
+    data = np.empty((len(STATION_QUANTITIES), len(station),
+                     station[0].samples), dtype=np.float64)
+    for i, quantity in enumerate(STATION_QUANTITIES):
+        for j, component in enumerate(station):
+            data[i][j] = getattr(component, quantity)
+
+    return data
+
+def array_to_station(data, dt, orientation):
+    """
+    Creates a station from a stacked array, the TimeseriesComponent
+    arrays are views into the input array (no data is copied)
+
+    Inputs:
+        data - (3, 3, samples) array, as returned by station_to_array
+        dt - delta t for the timeseries
+        orientation - array with the orientation of the 3 components
+    Outputs:
+        station - array containing 3 TimeseriesComponent structures
+    """
+    station = []
+    for j in range(0, data.shape[1]):
+        arrays = dict(zip(STATION_QUANTITIES, [data[i][j] for i in
+                                               range(0, data.shape[0])]))
+        station.append(TimeseriesComponent(data.shape[2], dt,
+                                           orientation[j],
+                                           arrays['acc'],
+                                           arrays['vel'],
+                                           arrays['dis']))
+
+    return station
 
 def integrate(data, dt):
     """
@@ -120,6 +395,75 @@ def derivative(data, dt):
 
     return newdata
 
+class ChunkedIntegrator(object):
+    """
+    This class integrates a timeseries one chunk at a time, carrying
+    the state across chunks so results match the integrate function
+    applied to the whole timeseries.
+
+    Variables:
+
+        dt - delta t for the timeseries
+        last_input - last sample of the previous chunk
+        last_output - last integrated value of the previous chunk
+    """
+    def __init__(self, dt):
+        """
+        Initialize the class attributes with the parameters
+        provided by the user
+        """
+        self.dt = dt
+        self.last_input = None
+        self.last_output = None
+
+    def process(self, data):
+        """
+        Integrates the next chunk of data
+        """
+        if data.size == 0:
+            return np.array(data, dtype=float)
+        if self.last_input is None:
+            newdata = integrate(data, self.dt)
+        else:
+            data_ext = np.concatenate(([self.last_input], data))
+            newdata = (self.last_output +
+                       np.cumsum(self.dt * (data_ext[1:] +
+                                            data_ext[:-1]) / 2.0))
+        self.last_input = data[-1]
+        self.last_output = newdata[-1]
+
+        return newdata
+
+class ChunkedDerivative(object):
+    """
+    This class computes the derivative of a timeseries one chunk at a
+    time, carrying the state across chunks so results match the
+    derivative function applied to the whole timeseries.
+
+    Variables:
+
+        dt - delta t for the timeseries
+        last_input - last sample of the previous chunk
+    """
+    def __init__(self, dt):
+        """
+        Initialize the class attributes with the parameters
+        provided by the user
+        """
+        self.dt = dt
+        self.last_input = 0
+
+    def process(self, data):
+        """
+        Computes the derivative of the next chunk of data
+        """
+        if data.size == 0:
+            return np.array(data, dtype=float)
+        newdata = np.diff(np.concatenate(([self.last_input], data))) / self.dt
+        self.last_input = data[-1]
+
+        return newdata
+
 def calculate_distance(location1, location2):
     """
     Calculates the distance between two pairs of lat, long coordinates
@@ -218,44 +562,62 @@ def run_rotd50(workdir,
     Outputs:
         Output file is created
     """
+    run_rotd50_batch(workdir, [(peer_input_1_file,
+                                peer_input_2_file,
+                                output_rotd50_file)])
+
+def run_rotd50_batch(workdir, rotd50_pairs):
+    """
+    Runs the external RotD50 program once for a list of pairs of
+    PEER files. The RotD50 binary should be located inside the "rotd50"
+    subdirectory inside the ts_process library.
+
+    Inputs:
+        workdir - Work directory where intermediate files will be created.
+                  Creating the work directory, deleting these intermediate
+                  files and the work directory should be done by the caller.
+        rotd50_pairs - list of (peer_input_1_file, peer_input_2_file,
+                       output_rotd50_file) tuples, all inside workdir
+    Outputs:
+        Output files are created
+    """
     # Make sure we don't have absolute path names
-    peer_input_1_file = os.path.basename(peer_input_1_file)
-    peer_input_2_file = os.path.basename(peer_input_2_file)
-    output_rotd50_file = os.path.basename(output_rotd50_file)
+    rotd50_pairs = [[os.path.basename(filename) for filename in rotd50_pair]
+                    for rotd50_pair in rotd50_pairs]
     logfile = "rotd50.log"
 
     bin_dir = os.path.dirname(os.path.realpath(sys.argv[0]))
 
-    # Save cwd, change back to it at the end
-    old_cwd = os.getcwd()
-    os.chdir(workdir)
-
     # Make sure we remove the output files first or Fortran will
     # complain if they already exist
-    try:
-        os.unlink(output_rotd50_file)
-    except OSError:
-        pass
+    for _, _, output_rotd50_file in rotd50_pairs:
+        try:
+            os.unlink(os.path.join(workdir, output_rotd50_file))
+        except OSError:
+            pass
 
     #
     # write config file for rotd50 program
-    rd50_conf = open("rotd50_inp.cfg", 'w')
+    rd50_conf = open(os.path.join(workdir, "rotd50_inp.cfg"), 'w')
     # This flag indicates inputs acceleration
     rd50_conf.write("2 interp flag\n")
-    # This flag indicate we are processing two input files
-    rd50_conf.write("1 Npairs\n")
+    # Number of pairs of input files to process
+    rd50_conf.write("%d Npairs\n" % (len(rotd50_pairs)))
     # Number of headers in the file
     rd50_conf.write("6 Nhead\n")
-    rd50_conf.write("%s\n" % peer_input_1_file)
-    rd50_conf.write("%s\n" % peer_input_2_file)
-    rd50_conf.write("%s\n" % output_rotd50_file)
+    for peer_input_1_file, peer_input_2_file, output_rotd50_file in \
+            rotd50_pairs:
+        rd50_conf.write("%s\n" % peer_input_1_file)
+        rd50_conf.write("%s\n" % peer_input_2_file)
+        rd50_conf.write("%s\n" % output_rotd50_file)
     # Close file
     rd50_conf.close()
 
-    progstring = ("%s >> %s 2>&1" %
-                  (os.path.join(bin_dir, "rotd50", "rotd50"), logfile))
+    log_fp = open(os.path.join(workdir, logfile), 'a')
     try:
-        proc = subprocess.Popen(progstring, shell=True)
+        proc = subprocess.Popen([os.path.join(bin_dir, "rotd50", "rotd50")],
+                                cwd=workdir, stdout=log_fp,
+                                stderr=subprocess.STDOUT)
         proc.wait()
     except KeyboardInterrupt:
         print("Interrupted!")
@@ -263,9 +625,14 @@ def run_rotd50(workdir,
     except:
         print("Unexpected error returned from Subprocess call: ",
               sys.exc_info()[0])
+    log_fp.close()
 
-    # Restore working directory
-    os.chdir(old_cwd)
+    # The program stops at the first pair it cannot process
+    for _, _, output_rotd50_file in rotd50_pairs:
+        if not os.path.exists(os.path.join(workdir, output_rotd50_file)):
+            print("[ERROR]: RotD50 program did not create: %s" %
+                  (output_rotd50_file))
+            sys.exit(-1)
 
 def read_rd50(input_rd50_file):
     """
@@ -297,7 +664,55 @@ def read_rd50(input_rd50_file):
 
     return periods, comp1, comp2
 
-def calculate_rd50(station, min_i, max_i, tmin, tmax, cut_flag=False):
+def get_period_range(periods, tmin, tmax):
+    """
+    Returns the first and last + 1 indexes of the periods within
+    tmin and tmax
+    """
+    try:
+        idx_min = np.nonzero(periods-tmin >= 0)[0][0]
+    except:
+        idx_min = 0
+    try:
+        idx_max = np.nonzero(periods-tmax > 0)[0][0]
+    except:
+        idx_max = len(periods)
+
+    return idx_min, idx_max
+
+def check_rotd50_options(periods, damping):
+    """
+    Makes sure periods and damping can be used with the rotd50
+    program, which always uses its own settings
+    """
+    if (np.ndim(damping) or damping != RSP_DAMPING or
+            not np.array_equal(periods, RSP_PERIODS)):
+        print("[ERROR]: The rotd50 program only supports its "
+              "default periods and damping!")
+        sys.exit(-1)
+
+def get_rd50_cache_key(station, min_i, max_i, tmin, tmax, cut_flag=False,
+                       engine='native', periods=RSP_PERIODS,
+                       damping=RSP_DAMPING):
+    """
+    Returns the cache key for the calculate_rd50 outputs, made from
+    the acceleration timeseries of the station and the parameters
+    """
+    if not cut_flag:
+        # Indexes are not used
+        min_i = None
+        max_i = None
+
+    return get_cache_key('calculate_rd50',
+                         [component.acc for component in station],
+                         [component.dt for component in station],
+                         min_i, max_i, tmin, tmax, cut_flag, engine,
+                         np.asarray(periods, dtype=np.float64), damping)
+
+@memoize('calculate_rd50', key=get_rd50_cache_key)
+def calculate_rd50(station, min_i, max_i, tmin, tmax, cut_flag=False,
+                   engine='native', periods=RSP_PERIODS,
+                   damping=RSP_DAMPING):
     """
     Calculates the RotD50 for a given station, if cut_flag is TRUE,
     trims the acc timeseries using min_i and max_i, returns data
@@ -310,19 +725,25 @@ def calculate_rd50(station, min_i, max_i, tmin, tmax, cut_flag=False):
         tmin - min period for RotD50 data
         tmax - max period for RotD50 data
         cut_flag - flag to trim the timeseries using min_i/max_i (default FALSE)
+        engine - 'native' computes the spectra in-process (rsp_library),
+                 close to but not the same as the rotd50 program
+                 outputs (see rsp_library),
+                 'rotd50' runs the external rotd50 program
+        periods - oscillator periods (native engine only)
+        damping - fraction of critical damping, or a list of damping
+                  values computed in the same pass (native engine only)
     Outputs:
         periods - array containing periods where RotD50 was calculated
         comp1_rd50 - RotD50 for first horizonal component
         comp2_rd50 - RotD50 for second horizonal component
         compv_rd50 - RotD50 for vertical component
+
+        With a list of damping values, the component outputs are
+        (dampings, periods) arrays
     """
     comp_h1 = station[0].acc
     comp_h2 = station[1].acc
     comp_v = station[2].acc
-    delta_ts = [item.dt for item in station]
-    peer_fns = ["hor1.acc.peer", "hor2.acc.peer", "ver.acc.peer"]
-    rotd50_h_file = "station_h.rd50"
-    rotd50_v_file = "station_v.rd50"
 
     # Trim timeseries if needed
     if cut_flag:
@@ -330,44 +751,194 @@ def calculate_rd50(station, min_i, max_i, tmin, tmax, cut_flag=False):
         comp_h2 = comp_h2[min_i:max_i]
         comp_v = comp_v[min_i:max_i]
 
+    if engine == 'native':
+        # Same output layout and units (g) as the rotd50 program, with
+        # adaptive oversampling (see rsp_library)
+        periods, psa_h1, psa_h2, _ = calculate_rotd50(comp_h1 / G2CMSS,
+                                                      comp_h2 / G2CMSS,
+                                                      station[0].dt,
+                                                      periods=periods,
+                                                      damping=damping)
+        _, psa_v = calculate_psa(comp_v / G2CMSS, station[2].dt,
+                                 periods=periods, damping=damping)
+        # The rotd50 output lists the second component first
+        comp1_rd50 = psa_h2
+        comp2_rd50 = psa_h1
+        compv_rd50 = psa_v
+    elif engine == 'rotd50':
+        check_rotd50_options(periods, damping)
+        periods, comp1_rd50, comp2_rd50, compv_rd50 = run_rd50(station,
+                                                               comp_h1,
+                                                               comp_h2,
+                                                               comp_v)
+    else:
+        print("[ERROR]: Unknown response spectra engine: %s" % (engine))
+        sys.exit(-1)
+
+    # Find only periods we want
+    idx_min, idx_max = get_period_range(periods, tmin, tmax)
+
+    periods = periods[idx_min:idx_max]
+    comp1_rd50 = comp1_rd50[..., idx_min:idx_max]
+    comp2_rd50 = comp2_rd50[..., idx_min:idx_max]
+    compv_rd50 = compv_rd50[..., idx_min:idx_max]
+
+    return [periods, comp1_rd50, comp2_rd50, compv_rd50]
+
+def calculate_rd50_batch(stations, min_is, max_is, tmin, tmax,
+                         cut_flag=False, workers=None,
+                         periods=RSP_PERIODS, damping=RSP_DAMPING,
+                         engine='native'):
+    """
+    Calculates the RotD50 outputs for a list of stations together.
+    With the native engine, stations sharing dt and length are
+    processed as stacked arrays, spread over a pool of workers. With
+    the rotd50 engine, all stations go through a single run of the
+    external rotd50 program
+
+    Inputs:
+        stations - list of stations, each with 3 TimeseriesComponent
+        min_is - list with the min index of each station (cut_flag=True)
+        max_is - list with the max index of each station (cut_flag=True)
+        tmin - min period for RotD50 data
+        tmax - max period for RotD50 data
+        cut_flag - flag to trim the timeseries using min_i/max_i
+        workers - number of worker processes (None uses all cpus)
+        periods - oscillator periods (native engine only)
+        damping - fraction of critical damping, or a list of them
+                  (native engine only)
+        engine - 'native' or 'rotd50', see calculate_rd50
+    Outputs:
+        rd50s - list with the calculate_rd50 outputs for each station
+
+    Results are shared with the calculate_rd50 cache (see ts_cache)
+    """
+    if engine == 'rotd50':
+        check_rotd50_options(periods, damping)
+    elif engine != 'native':
+        print("[ERROR]: Unknown response spectra engine: %s" % (engine))
+        sys.exit(-1)
+
+    # Use cached results when available
+    rd50s = [None] * len(stations)
+    keys = []
+    for index, (station, min_i, max_i) in enumerate(zip(stations,
+                                                        min_is, max_is)):
+        keys.append(get_rd50_cache_key(station, min_i, max_i, tmin, tmax,
+                                       cut_flag, engine, periods,
+                                       damping))
+        _, rd50s[index] = cache_get(keys[-1])
+    pending = [index for index, rd50 in enumerate(rd50s) if rd50 is None]
+    if not pending:
+        return rd50s
+
+    components = []
+    for index in pending:
+        comps = [component.acc for component in stations[index]]
+        if cut_flag:
+            comps = [comp[min_is[index]:max_is[index]] for comp in comps]
+        components.append(comps)
+
+    if engine == 'rotd50':
+        results = run_rd50_batch([stations[index] for index in pending],
+                                 components)
+    else:
+        # Pairs of horizontals and single verticals, in g
+        pairs = [(comps[0] / G2CMSS, comps[1] / G2CMSS)
+                 for comps in components]
+        verticals = [comps[2] / G2CMSS for comps in components]
+        rotd_results = calculate_rotd_batch(pairs,
+                                            [stations[index][0].dt
+                                             for index in pending],
+                                            periods=periods,
+                                            damping=damping,
+                                            percentiles=[50],
+                                            workers=workers)
+        psa_results = calculate_psa_batch(verticals,
+                                          [stations[index][2].dt
+                                           for index in pending],
+                                          periods=periods,
+                                          damping=damping,
+                                          workers=workers)
+        results = []
+        for (rsp_periods, psa_h1, psa_h2, _), (_, psa_v) in \
+                zip(rotd_results, psa_results):
+            # The rotd50 output lists the second component first
+            results.append((rsp_periods, psa_h2, psa_h1, psa_v))
+
+    for index, (rsp_periods, comp1_rd50,
+                comp2_rd50, compv_rd50) in zip(pending, results):
+        # Find only periods we want
+        idx_min, idx_max = get_period_range(rsp_periods, tmin, tmax)
+
+        rd50s[index] = [rsp_periods[idx_min:idx_max],
+                        comp1_rd50[..., idx_min:idx_max],
+                        comp2_rd50[..., idx_min:idx_max],
+                        compv_rd50[..., idx_min:idx_max]]
+        cache_put(keys[index], rd50s[index])
+
+    return rd50s
+
+def run_rd50(station, comp_h1, comp_h2, comp_v):
+    """
+    Calculates the PSA for the 3 components of a station using
+    the external rotd50 program
+
+    Inputs:
+        station - Timetimeseries for the three components (H1, H2, Vertical)
+        comp_h1, comp_h2, comp_v - acceleration timeseries to use
+    Outputs:
+        periods - array containing periods
+        comp1_rd50, comp2_rd50, compv_rd50 - columns from rotd50 output
+    """
+    return run_rd50_batch([station], [(comp_h1, comp_h2, comp_v)])[0]
+
+def run_rd50_batch(stations, components):
+    """
+    Calculates the PSA for the 3 components of many stations with
+    a single run of the external rotd50 program
+
+    Inputs:
+        stations - list of stations, each with 3 TimeseriesComponent
+        components - list with the (comp_h1, comp_h2, comp_v)
+                     acceleration timeseries to use for each station
+    Outputs:
+        results - list with the run_rd50 outputs for each station
+    """
     # Create temp Directory
     temp_dir = tempfile.mkdtemp()
     # And clean up later
     atexit.register(cleanup, temp_dir)
 
-    # Write PEER tempfiles
-    for peer_fn, comp, delta_t in zip(peer_fns,
-                                      [comp_h1,
-                                       comp_h2,
-                                       comp_v],
-                                      delta_ts):
-        write_peer_acc_file(os.path.join(temp_dir, peer_fn),
-                            comp, delta_t)
+    rotd50_pairs = []
+    for index, (station, comps) in enumerate(zip(stations, components)):
+        peer_fns = ["st%d.%s.acc.peer" % (index, name) for
+                    name in ["hor1", "hor2", "ver"]]
 
-    # Calculate RotD50 outputs
-    run_rotd50(temp_dir, peer_fns[0], peer_fns[1], rotd50_h_file)
-    run_rotd50(temp_dir, peer_fns[2], peer_fns[2], rotd50_v_file)
+        # Write PEER tempfiles
+        for peer_fn, comp, component in zip(peer_fns, comps, station):
+            write_peer_acc_file(os.path.join(temp_dir, peer_fn),
+                                comp, component.dt)
 
-    periods, comp1_rd50, comp2_rd50 = read_rd50(os.path.join(temp_dir,
-                                                             rotd50_h_file))
-    _, compv_rd50, _ = read_rd50(os.path.join(temp_dir, rotd50_v_file))
+        # Horizontals, then the vertical paired with itself
+        rotd50_pairs.append((peer_fns[0], peer_fns[1],
+                             "st%d_h.rd50" % (index)))
+        rotd50_pairs.append((peer_fns[2], peer_fns[2],
+                             "st%d_v.rd50" % (index)))
 
-    # Find only periods we want
-    try:
-        idx_min = np.nonzero(periods-tmin >= 0)[0][0]
-    except:
-        idx_min = 0
-    try:
-        idx_max = np.nonzero(periods-tmax > 0)[0][0]
-    except:
-        idx_max = len(periods)
+    # Calculate RotD50 outputs
+    run_rotd50_batch(temp_dir, rotd50_pairs)
 
-    periods = periods[idx_min:idx_max]
-    comp1_rd50 = comp1_rd50[idx_min:idx_max]
-    comp2_rd50 = comp2_rd50[idx_min:idx_max]
-    compv_rd50 = compv_rd50[idx_min:idx_max]
+    results = []
+    for index in range(len(stations)):
+        rotd50_h_file = os.path.join(temp_dir, rotd50_pairs[2 * index][2])
+        rotd50_v_file = os.path.join(temp_dir,
+                                     rotd50_pairs[2 * index + 1][2])
+        periods, comp1_rd50, comp2_rd50 = read_rd50(rotd50_h_file)
+        _, compv_rd50, _ = read_rd50(rotd50_v_file)
+        results.append((periods, comp1_rd50, comp2_rd50, compv_rd50))
 
-    return [periods, comp1_rd50, comp2_rd50, compv_rd50]
+    return results
 
 def get_points(samples):
     """
@@ -400,6 +971,7 @@ def smooth(data, factor):
         data[i] = 0.5 * data[i] + c * data[i - 1] + c * data[i + 1]
     return data
 
+@memoize('FAS')
 def FAS(data, dt, points, fmin, fmax, s_factor):
     """
     Calculates the FAS of the input array using NumPy's fft Library
@@ -487,30 +1059,30 @@ def seism_appendzeros(flag, t_diff, m, timeseries):
     num = int(t_diff / timeseries.dt)
     zeros = np.zeros(num)
 
+    quantities = timeseries.stored_quantities()
+
     if flag == 'front':
         # applying taper in the front
         if m != 0:
             window = taper('front', m, timeseries.samples)
-            timeseries.acc = timeseries.acc * window
-            timeseries.vel = timeseries.vel * window
-            timeseries.dis = timeseries.dis * window
+            for quantity in quantities:
+                timeseries.transform(quantity, np.multiply, window)
 
         # adding zeros in front of data
-        timeseries.acc = np.append(zeros, timeseries.acc)
-        timeseries.vel = np.append(zeros, timeseries.vel)
-        timeseries.dis = np.append(zeros, timeseries.dis)
+        for quantity in quantities:
+            data = timeseries.get_quantity(quantity)
+            timeseries.set_quantity(quantity, np.append(zeros, data))
 
     elif flag == 'end':
         if m != 0:
             # applying taper in the front
             window = taper('end', m, timeseries.samples)
-            timeseries.acc = timeseries.acc * window
-            timeseries.vel = timeseries.vel * window
-            timeseries.dis = timeseries.dis * window
+            for quantity in quantities:
+                timeseries.transform(quantity, np.multiply, window)
 
-        timeseries.acc = np.append(timeseries.acc, zeros)
-        timeseries.vel = np.append(timeseries.vel, zeros)
-        timeseries.dis = np.append(timeseries.dis, zeros)
+        for quantity in quantities:
+            data = timeseries.get_quantity(quantity)
+            timeseries.set_quantity(quantity, np.append(data, zeros))
 
     timeseries.samples += num
 
@@ -534,32 +1106,32 @@ def seism_cutting(flag, t_diff, m, timeseries):
         print("[ERROR]: fail to cut timeseries.")
         return timeseries
 
+    quantities = timeseries.stored_quantities()
+
     if flag == 'front' and num != 0:
         # cutting timeseries
-        timeseries.acc = timeseries.acc[num:]
-        timeseries.vel = timeseries.vel[num:]
-        timeseries.dis = timeseries.dis[num:]
+        for quantity in quantities:
+            timeseries.set_quantity(quantity,
+                                    timeseries.get_quantity(quantity)[num:])
         timeseries.samples -= num
 
         # applying taper at the front
         window = taper('front', m, timeseries.samples)
-        timeseries.acc = timeseries.acc * window
-        timeseries.vel = timeseries.vel * window
-        timeseries.dis = timeseries.dis * window
+        for quantity in quantities:
+            timeseries.transform(quantity, np.multiply, window)
 
     elif flag == 'end' and num != 0:
         num *= -1
         # cutting timeseries
-        timeseries.acc = timeseries.acc[:num]
-        timeseries.vel = timeseries.vel[:num]
-        timeseries.dis = timeseries.dis[:num]
+        for quantity in quantities:
+            timeseries.set_quantity(quantity,
+                                    timeseries.get_quantity(quantity)[:num])
         timeseries.samples += num
 
         # applying taper at the end
         window = taper('end', m, timeseries.samples)
-        timeseries.acc = timeseries.acc * window
-        timeseries.vel = timeseries.vel * window
-        timeseries.dis = timeseries.dis * window
+        for quantity in quantities:
+            timeseries.transform(quantity, np.multiply, window)
 
     return timeseries
 # end of seism_cutting
@@ -608,6 +1180,7 @@ def polimod(x, y, n, m):
     # Polynomial coefficients are row vectors by convention
     return p
 
+@memoize('baseline_function')
 def baseline_function(acc, dt, gscale, ordern):
     """
     Integrates acceleration record and baseline corrects velocity and
@@ -731,31 +1304,24 @@ def rotate_timeseries(station, rotation_angle):
                            (math.sin(math.radians(rotation_angle)),
                             -math.cos(math.radians(rotation_angle)))])
 
-    # Make sure they all have the same number of points
-    if len(station[0].acc) != len(station[1].acc):
-        n_points = min(len(station[0].acc), len(station[1].acc))
-        station[0].acc = station[0].acc[0:n_points-1]
-        station[1].acc = station[1].acc[0:n_points-1]
-    if len(station[0].vel) != len(station[1].vel):
-        n_points = min(len(station[0].vel), len(station[1].vel))
-        station[0].vel = station[0].vel[0:n_points-1]
-        station[1].vel = station[1].vel[0:n_points-1]
-    if len(station[0].dis) != len(station[1].dis):
-        n_points = min(len(station[0].dis), len(station[1].dis))
-        station[0].dis = station[0].dis[0:n_points-1]
-        station[1].dis = station[1].dis[0:n_points-1]
-
-    # Rotate
-    [station[0].acc,
-     station[1].acc] = matrix.dot([station[0].acc,
-                                   station[1].acc])
-
-    [station[0].vel,
-     station[1].vel] = matrix.dot([station[0].vel,
-                                   station[1].vel])
-    [station[0].dis,
-     station[1].dis] = matrix.dot([station[0].dis,
-                                   station[1].dis])
+    # Only rotate stored quantities, derived ones follow from them
+    quantities = station[0].stored_quantities()
+    if quantities != station[1].stored_quantities():
+        quantities = ['acc', 'vel', 'dis']
+
+    for quantity in quantities:
+        data_1 = station[0].get_quantity(quantity)
+        data_2 = station[1].get_quantity(quantity)
+        # Make sure they all have the same number of points
+        if len(data_1) != len(data_2):
+            n_points = min(len(data_1), len(data_2))
+            data_1 = data_1[0:n_points-1]
+            data_2 = data_2[0:n_points-1]
+
+        # Rotate
+        data_1, data_2 = matrix.dot([data_1, data_2])
+        station[0].set_quantity(quantity, data_1)
+        station[1].set_quantity(quantity, data_2)
 
     # Adjust station orientation after rotation is completed
     station[0].orientation = station[0].orientation - rotation_angle
@@ -771,6 +1337,7 @@ def rotate_timeseries(station, rotation_angle):
 def filter_timeseries(timeseries, family, btype,
                       N=5, rp=0.1, rs=100,
                       fmin=0.0, fmax=0.0, Wn=None,
+                      engine='iir', taper_fraction=0.0,
                       debug=False):
     """
     Function that filters acc/vel/dis of a timeseries component by calling
@@ -786,6 +1353,7 @@ def filter_timeseries(timeseries, family, btype,
         fmin - min frequency
         fmax - max frequency
         Wn - array of critical frequencies, overriden by fmin/fmax
+        engine, taper_fraction - see filter_data
         debug - debug flag
     Outputs:
         timeseries - filtered TimeseriesComponent
@@ -794,24 +1362,242 @@ def filter_timeseries(timeseries, family, btype,
         print("[INFO]: Filtering timeseries: %s - %s - fmin=%.2f, fmax=%.2f" %
               (family, btype, fmin, fmax))
 
-    timeseries.acc = filter_data(timeseries.acc, timeseries.dt,
-                                 btype=btype, family=family,
-                                 fmin=fmin, fmax=fmax,
-                                 N=N, rp=rp, rs=rs, Wn=Wn)
-    timeseries.vel = filter_data(timeseries.vel, timeseries.dt,
-                                 btype=btype, family=family,
-                                 fmin=fmin, fmax=fmax,
-                                 N=N, rp=rp, rs=rs, Wn=Wn)
-    timeseries.dis = filter_data(timeseries.dis, timeseries.dt,
-                                 btype=btype, family=family,
-                                 fmin=fmin, fmax=fmax,
-                                 N=N, rp=rp, rs=rs, Wn=Wn)
+    # Quantities not loaded yet get filtered when they are loaded
+    for quantity in timeseries.stored_quantities():
+        timeseries.transform(quantity, filter_data, timeseries.dt,
+                             btype=btype, family=family,
+                             fmin=fmin, fmax=fmax,
+                             N=N, rp=rp, rs=rs, Wn=Wn,
+                             engine=engine, taper_fraction=taper_fraction)
 
     return timeseries
 
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def get_filter_sos(dt, family, btype, N, rp, rs, fmin, fmax, Wn):
+    """
+    Designs the filter used by filter_data, as second-order sections.
+    Designs are cached, so the returned array must not be modified
+
+    Inputs:
+        dt - delta t for the timeseries to filter
+        family, btype, N, rp, rs, fmin, fmax - see filter_data
+        Wn - critical frequencies (a float or a tuple), or None
+    Outputs:
+        sos - array of second-order filter coefficients
+    """
+    # Set up some values
+    if Wn is None:
+        Wn = 0.05/((1.0/dt)/2.0)
+    w_min = fmin/((1.0/dt)/2.0)
+    w_max = fmax/((1.0/dt)/2.0)
+
+    if fmin and fmax and btype == 'bandpass':
+        Wn = [w_min, w_max]
+    elif fmax and btype == 'lowpass':
+        Wn = w_max
+    elif fmin and btype == 'highpass':
+        Wn = w_min
+
+    if family == 'ellip':
+        sos = ellip(N=N, rp=rp, rs=rs, Wn=Wn, btype=btype,
+                    analog=False, output='sos')
+    elif family == 'butter':
+        sos = butter(N=N, Wn=Wn, btype=btype, analog=False, output='sos')
+    else:
+        print("[ERROR]: Unknown filter family: %s" % (family))
+        sys.exit(-1)
+
+    return sos
+
+def get_filter_length(sos, tolerance):
+    """
+    Returns the number of samples it takes for the impulse response
+    of the filter to decay below tolerance times its initial amplitude,
+    estimated from the slowest pole
+    """
+    _, poles, _ = sos2zpk(sos)
+    radius = np.max(np.abs(poles)) if poles.size else 0.0
+    if not 0.0 < radius < 1.0:
+        return 0
+
+    return int(np.ceil(np.log(tolerance) / np.log(radius)))
+
+def get_filter_padlen(sos):
+    """
+    Returns the number of samples sosfiltfilt adds by default at each
+    end of the record (odd extension)
+    """
+    zeros = min(np.sum(sos[:, 2] == 0), np.sum(sos[:, 5] == 0))
+
+    return 3 * (2 * len(sos) + 1 - zeros)
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def get_filter_response(dt, family, btype, N, rp, rs, fmin, fmax, Wn,
+                        samples):
+    """
+    Computes the zero-phase response |H(f)|^2 of the filter designed by
+    get_filter_sos, the response of a forward-backward pass, on the
+    rfft grid used by fft_filtfilt for records with this number of
+    samples. Responses are cached, so the returned array must not be
+    modified
+
+    Inputs:
+        dt, family, btype, N, rp, rs, fmin, fmax, Wn - see get_filter_sos
+        samples - number of samples in the records to filter
+    Outputs:
+        size - padded length of the records
+        response - array with size // 2 + 1 real response values
+    """
+    sos = get_filter_sos(dt, family, btype, N, rp, rs, fmin, fmax, Wn)
+
+    # Room for the odd extension and the constant extension in front,
+    # then zeros until the impulse response has decayed, so the
+    # circular convolution does not wrap the ends of the record
+    padlen = min(get_filter_padlen(sos), max(samples - 1, 0))
+    length = get_filter_length(sos, FILTER_FFT_TOLERANCE)
+    size = next_fast_len(samples + 2 * padlen + 2 * length)
+
+    _, response = sosfreqz(sos, worN=(2.0 * np.pi *
+                                      np.arange(size // 2 + 1) / size))
+
+    return size, np.abs(response)**2
+
+def get_cosine_taper(samples, taper_fraction):
+    """
+    Returns a window that goes from 0 to 1 following half a cosine
+    over taper_fraction of the samples at each end
+    """
+    window = np.ones(samples)
+    m = int(round(taper_fraction * samples))
+    if m > 0:
+        ramp = 0.5 * (1.0 - np.cos(np.pi * np.arange(m) / m))
+        window[:m] = ramp
+        window[samples-m:] = ramp[::-1]
+
+    return window
+
+def apply_zero_phase_response(data, size, response, taper_fraction=0.0):
+    """
+    Multiplies the spectra of the timeseries by a real response in the
+    rfft domain. Records are zero padded to size samples, the response
+    can be any real function of frequency on that rfft grid
+
+    Inputs:
+        data - (..., samples) array of timeseries
+        size - padded length, at least the number of samples
+        response - array with size // 2 + 1 real response values
+        taper_fraction - fraction of the samples tapered at each end
+                         with a cosine window before filtering
+    Outputs:
+        data - (..., samples) array with the filtered timeseries
+    """
+    samples = data.shape[-1]
+    if taper_fraction:
+        data = data * get_cosine_taper(samples, taper_fraction)
+    spectrum = rfft(data, n=size, axis=-1)
+    spectrum *= response
+
+    return irfft(spectrum, n=size, axis=-1)[..., :samples]
+
+def fft_filtfilt(data, sos, size, response):
+    """
+    Forward-backward filtering in the rfft domain, same results as
+    sosfiltfilt (default odd extension and initial conditions) within
+    FILTER_FFT_TOLERANCE over the whole record
+
+    sosfiltfilt starts each pass in the steady state of a constant
+    input. For the forward pass this is the same as extending the
+    record with its first value, so that extension is included in the
+    spectrum. The backward pass starts from the last forward output,
+    which is not an extension of the input: the end of the record is
+    computed again with the two IIR passes over its last samples. When
+    that covers the whole extended record, sosfiltfilt is used instead.
+
+    Inputs:
+        data - (..., samples) array of timeseries
+        sos - second-order sections of the filter
+        size, response - rfft length and |H(f)|^2 values from
+                         get_filter_response
+    Outputs:
+        data - (..., samples) array with the filtered timeseries
+    """
+    samples = data.shape[-1]
+    padlen = min(get_filter_padlen(sos), max(samples - 1, 0))
+    length = get_filter_length(sos, FILTER_FFT_TOLERANCE)
+    if samples + 2 * padlen <= 2 * length:
+        # Too short, the IIR passes would redo the whole record
+        return sosfiltfilt(sos, data, axis=-1, padlen=padlen)
+
+    # Odd extension, as in sosfiltfilt
+    data = np.concatenate([2 * data[..., :1] - data[..., padlen:0:-1],
+                           data,
+                           2 * data[..., -1:] -
+                           data[..., -2:-padlen-2:-1]], axis=-1)
+    extended = data.shape[-1]
+
+    spectrum = rfft(np.concatenate([np.repeat(data[..., :1], length,
+                                              axis=-1), data], axis=-1),
+                    n=size, axis=-1)
+    spectrum *= response
+    output = irfft(spectrum, n=size, axis=-1)[..., length:length + extended]
+
+    # Redo the end of the record, the forward pass starts at rest
+    # length samples before the part that is kept
+    start = extended - 2 * length
+    zi = sosfilt_zi(sos).reshape((len(sos),) + (1,) * (data.ndim - 1) +
+                                 (2,))
+    forward, _ = sosfilt(sos, data[..., start:], axis=-1,
+                         zi=np.zeros((len(sos),) + data.shape[:-1] + (2,)))
+    backward, _ = sosfilt(sos, forward[..., ::-1], axis=-1,
+                          zi=zi * forward[np.newaxis, ..., -1:])
+    if length:
+        output[..., extended - length:] = backward[..., length-1::-1]
+
+    return output[..., padlen:padlen + samples]
+
+def zero_phase_filter(data, dt, family, btype, N, rp, rs, fmin, fmax, Wn,
+                      engine='iir', taper_fraction=0.0):
+    """
+    Applies the zero-phase filter along the last axis of data using
+    the selected engine, see filter_data
+    """
+    if Wn is not None and np.ndim(Wn):
+        # Lists cannot be used as cache keys
+        Wn = tuple(Wn)
+
+    if engine not in FILTER_ENGINES:
+        print("[ERROR]: Unknown filtering engine: %s" % (engine))
+        sys.exit(-1)
+
+    sos = get_filter_sos(dt, family, btype, N, rp, rs, fmin, fmax, Wn)
+    if taper_fraction:
+        data = data * get_cosine_taper(data.shape[-1], taper_fraction)
+    if engine == 'fft':
+        size, response = get_filter_response(dt, family, btype, N, rp, rs,
+                                             fmin, fmax, Wn, data.shape[-1])
+        return fft_filtfilt(data, sos, size, response)
+
+    # sosfiltfilt: A forward-backward digital filter using
+    # cascaded second-order sections. The combined filter has
+    # linear phase.
+    return sosfiltfilt(sos, data, axis=-1)
+
+def get_filter_cache_key(data, dt, family, btype,
+                         N=5, rp=0.1, rs=100,
+                         fmin=0.0, fmax=0.0, Wn=None,
+                         engine='iir', taper_fraction=0.0):
+    """
+    Returns the cache key for the filter_data output, also used by
+    filter_stations for each of the timeseries it filters
+    """
+    return get_cache_key('filter_data', data, dt, family, btype, N, rp, rs,
+                         fmin, fmax, Wn, engine, taper_fraction)
+
+@memoize('filter_data', key=get_filter_cache_key)
 def filter_data(data, dt, family, btype,
                 N=5, rp=0.1, rs=100,
-                fmin=0.0, fmax=0.0, Wn=None):
+                fmin=0.0, fmax=0.0, Wn=None,
+                engine='iir', taper_fraction=0.0):
     """
     Function that filters a timeseries
 
@@ -826,6 +1612,14 @@ def filter_data(data, dt, family, btype,
         fmin - min frequency
         fmax - max frequency
         Wn - array of critical frequencies, overriden by fmin/fmax
+        engine - 'iir' filters forward and backward with the second-order
+                 sections (sosfiltfilt), 'fft' multiplies the spectrum of
+                 the extended record by the same zero-phase response
+                 |H(f)|^2, at a cost that does not depend on the filter
+                 order (see fft_filtfilt). Results of both engines agree
+                 within FILTER_FFT_TOLERANCE, ends of the record included
+        taper_fraction - fraction of the samples tapered at each end
+                         with a cosine window before filtering
     Outputs:
         data - filtered timeseries
     """
@@ -834,45 +1628,326 @@ def filter_data(data, dt, family, btype,
         print("[ERROR]: data input for filter is not an numpy array.")
         return data
 
-    # Set up some values
-    if Wn is None:
-        Wn = 0.05/((1.0/dt)/2.0)
-    a = np.array([], float)
-    b = np.array([], float)
-    w_min = fmin/((1.0/dt)/2.0)
-    w_max = fmax/((1.0/dt)/2.0)
+    data = zero_phase_filter(data, dt, family, btype, N, rp, rs,
+                             fmin, fmax, Wn, engine=engine,
+                             taper_fraction=taper_fraction)
 
-    if fmin and fmax and btype == 'bandpass':
-        Wn = [w_min, w_max]
-    elif fmax and btype == 'lowpass':
-        Wn = w_max
-    elif fmin and btype == 'highpass':
-        Wn = w_min
+    return data
 
-    # Calling filter
+def _filter_block(filter_function, data, output, block):
+    """
+    Worker function for filter_rows
+    """
+    output[block] = filter_function(data[block])
 
-    # filtfilt A forward-backward filter. This function applies a linear filter
-    # twice, once forward and once backwards. The combined filter has linear phase.
+def filter_rows(data, dt, family, btype,
+                N=5, rp=0.1, rs=100,
+                fmin=0.0, fmax=0.0, Wn=None,
+                engine='iir', taper_fraction=0.0, workers=1):
+    """
+    Filters each row of a 2-D array of timeseries sharing the same dt,
+    same results as calling filter_data on each row
 
-    # sosfiltfilt: A forward-backward digital filter using
-    # cascaded second-order sections.
+    Inputs:
+        data - (rows, samples) array of timeseries
+        dt - delta t for all timeseries
+        family, btype, N, rp, rs, fmin, fmax, Wn - see filter_data
+        engine, taper_fraction - see filter_data
+        workers - number of threads, each one filtering a block of rows
+    Outputs:
+        data - (rows, samples) array with the filtered timeseries
+    """
+    filter_function = partial(zero_phase_filter, dt=dt, family=family,
+                              btype=btype, N=N, rp=rp, rs=rs, fmin=fmin,
+                              fmax=fmax, Wn=Wn, engine=engine,
+                              taper_fraction=taper_fraction)
+
+    rows = data.shape[0]
+    if (workers is None or workers <= 1 or ThreadPoolExecutor is None or
+            rows <= FILTER_BLOCK_ROWS):
+        return filter_function(data)
+
+    block_size = max(FILTER_BLOCK_ROWS, -(-rows // workers))
+    blocks = [slice(start, start + block_size) for
+              start in range(0, rows, block_size)]
+    output = np.empty(data.shape)
+    with ThreadPoolExecutor(max_workers=min(workers,
+                                            len(blocks))) as executor:
+        list(executor.map(partial(_filter_block, filter_function, data,
+                                  output), blocks))
+
+    return output
+
+def filter_stations(stations, family, btype,
+                    N=5, rp=0.1, rs=100,
+                    fmin=0.0, fmax=0.0, Wn=None,
+                    engine='iir', taper_fraction=0.0,
+                    workers=None, debug=False):
+    """
+    Filters acc/vel/dis of all components of a list of stations.
+    Timeseries sharing dt and number of samples are stacked and
+    filtered together by filter_rows. Results are shared with the
+    filter_data cache (see ts_cache)
 
-    if family == 'ellip':
-        b, a = ellip(N=N, rp=rp, rs=rs, Wn=Wn, btype=btype, analog=False)
-        data = filtfilt(b, a, data)
-    elif family == 'butter':
-        b, a = butter(N=N, Wn=Wn, btype=btype, analog=False)
-        data = filtfilt(b, a, data)
-    else:
-        print("[ERROR]: Unknown filter family: %s" % (family))
-        sys.exit(-1)
+    Inputs:
+        stations - list of stations, each with 3 TimeseriesComponent
+        family, btype, N, rp, rs, fmin, fmax, Wn - see filter_data
+        engine, taper_fraction - see filter_data
+        workers - number of threads (None uses all cpus)
+        debug - debug flag
+    Outputs:
+        stations - list of stations with filtered timeseries
+    """
+    if debug:
+        print("[INFO]: Filtering stations: %s - %s - fmin=%.2f, fmax=%.2f" %
+              (family, btype, fmin, fmax))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    groups = {}
+    for station in stations:
+        for component in station:
+            for quantity in component.stored_quantities():
+                if not component.is_loaded(quantity):
+                    # Filtered when it gets loaded
+                    component.transform(quantity, filter_data,
+                                        component.dt, btype=btype,
+                                        family=family, fmin=fmin,
+                                        fmax=fmax, N=N, rp=rp, rs=rs,
+                                        Wn=Wn, engine=engine,
+                                        taper_fraction=taper_fraction)
+                    continue
+                data = component.get_quantity(quantity)
+                cache_key = None
+                if is_cache_enabled():
+                    cache_key = get_filter_cache_key(data, component.dt,
+                                                     family, btype, N, rp,
+                                                     rs, fmin, fmax, Wn,
+                                                     engine,
+                                                     taper_fraction)
+                    found, value = cache_get(cache_key)
+                    if found:
+                        component.set_quantity(quantity, value)
+                        continue
+                key = (component.dt, data.size)
+                groups.setdefault(key, []).append((component, quantity,
+                                                   data, cache_key))
+
+    for (dt, _), entries in groups.items():
+        data = filter_rows(np.array([entry[2] for entry in entries]),
+                           dt, family, btype, N=N, rp=rp, rs=rs,
+                           fmin=fmin, fmax=fmax, Wn=Wn, engine=engine,
+                           taper_fraction=taper_fraction, workers=workers)
+        for row, (component, quantity, _, cache_key) in enumerate(entries):
+            component.set_quantity(quantity, data[row])
+            cache_put(cache_key, data[row])
+
+    return stations
+
+class StreamingFilter(object):
+    """
+    This class filters a timeseries one chunk at a time, using the same
+    filter designs as filter_data, so records that do not fit in
+    memory can be processed as they are read. Chunks are arrays of
+    shape (..., samples), so several traces can be filtered together.
+
+    In 'causal' mode the second-order sections are applied forward
+    only and the filter state is carried across chunks, so results
+    match sosfilt applied to the whole timeseries (starting at rest).
+    Each chunk is returned immediately.
+
+    In 'zero-phase' mode the stream is cut into blocks of block_size
+    samples. Each block is filtered forward and backward together with
+    overlap samples on each side and only the block is kept, so results
+    match filter_data on the whole timeseries within the tolerance used
+    to choose the overlap. A block is returned once the overlap samples
+    after it have arrived: the latency is at most block_size + overlap
+    samples, and the remaining samples are returned by flush. At the
+    start and end of the stream the data is extended as in filter_data.
 
-    return data
+    Variables:
+
+        dt - delta t for the timeseries
+        mode - 'causal' or 'zero-phase'
+        sos - second-order sections of the filter
+        block_size - samples output at a time in zero-phase mode
+        overlap - samples on each side of a block in zero-phase mode
+        latency - max samples between input and output
+    """
+    def __init__(self, dt, family, btype,
+                 N=5, rp=0.1, rs=100,
+                 fmin=0.0, fmax=0.0, Wn=None,
+                 mode='causal', block_size=None,
+                 tolerance=STREAM_TOLERANCE):
+        """
+        Initialize the class attributes with the parameters
+        provided by the user, see filter_data for the filter ones
+        """
+        if mode not in STREAM_MODES:
+            print("[ERROR]: Unknown streaming filter mode: %s" % (mode))
+            sys.exit(-1)
+        if Wn is not None and np.ndim(Wn):
+            Wn = tuple(Wn)
+
+        self.dt = dt
+        self.mode = mode
+        self.sos = get_filter_sos(dt, family, btype, N, rp, rs,
+                                  fmin, fmax, Wn)
+        self.overlap = 0
+        self.block_size = 0
+        if mode == 'zero-phase':
+            self.overlap = get_filter_length(self.sos, tolerance)
+            if block_size is None:
+                block_size = max(STREAM_BLOCK_SIZE, 4 * self.overlap)
+            self.block_size = block_size
+        self.latency = self.block_size + self.overlap
+
+        self.padlen = get_filter_padlen(self.sos)
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the state, the next chunk starts a new stream
+        """
+        self.state = None
+        self.buffer = None
+        # Samples at the start of the buffer already returned
+        self.context = 0
 
+    def process(self, data):
+        """
+        Filters the next chunk of data, returns the filtered samples
+        that are ready
+        """
+        data = np.asarray(data, dtype=float)
+        if self.mode == 'causal':
+            if self.state is None:
+                self.state = np.zeros((len(self.sos),) + data.shape[:-1] +
+                                      (2,))
+            elif self.state.shape[1:-1] != data.shape[:-1]:
+                print("[ERROR]: Chunk shape does not match the stream!")
+                sys.exit(-1)
+            newdata, self.state = sosfilt(self.sos, data, axis=-1,
+                                          zi=self.state)
+            return newdata
+
+        if self.buffer is None:
+            self.buffer = data
+        elif self.buffer.shape[:-1] != data.shape[:-1]:
+            print("[ERROR]: Chunk shape does not match the stream!")
+            sys.exit(-1)
+        else:
+            self.buffer = np.concatenate((self.buffer, data), axis=-1)
+
+        blocks = []
+        end = self.context + self.block_size + self.overlap
+        while self.buffer.shape[-1] >= end:
+            segment = self.filter_segment(self.buffer[..., :end])
+            blocks.append(segment[..., self.context:
+                                  self.context + self.block_size])
+            # Keep overlap samples before the next block
+            start = max(self.context + self.block_size - self.overlap, 0)
+            self.buffer = self.buffer[..., start:]
+            self.context = self.context + self.block_size - start
+            end = self.context + self.block_size + self.overlap
+
+        if not blocks:
+            return np.empty(data.shape[:-1] + (0,))
+        return np.concatenate(blocks, axis=-1)
+
+    def flush(self):
+        """
+        Ends the stream, returns the filtered samples not returned yet
+        and resets the filter
+        """
+        newdata = np.empty((0,))
+        if self.mode == 'causal':
+            if self.state is not None:
+                newdata = np.empty(self.state.shape[1:-1] + (0,))
+        elif self.buffer is not None:
+            newdata = self.filter_segment(self.buffer)[..., self.context:]
+        self.reset()
+
+        return newdata
+
+    def filter_segment(self, data):
+        """
+        Filters a segment forward and backward
+        """
+        samples = data.shape[-1]
+        if samples == 0:
+            return data
+        return sosfiltfilt(self.sos, data, axis=-1,
+                           padlen=min(self.padlen, samples - 1))
+
+    def filter_chunks(self, chunks):
+        """
+        Generator filtering an iterable of chunks, yields the filtered
+        samples as they are ready, ending with the flushed ones
+        """
+        for chunk in chunks:
+            newdata = self.process(chunk)
+            if newdata.shape[-1]:
+                yield newdata
+        newdata = self.flush()
+        if newdata.shape[-1]:
+            yield newdata
+
+def sinc_resample(data, old_dt, new_times, half_width=INTERP_HALF_WIDTH,
+                  beta=INTERP_KAISER_BETA, chunk_size=INTERP_CHUNK_SIZE):
+    """
+    Band-limited interpolation of data at new_times using a sinc
+    kernel tapered by a Kaiser window to half_width samples on each
+    side. Output samples are computed chunk_size at a time, so memory
+    use is linear in the record length
+
+    Inputs:
+        data - input timeseries
+        old_dt - delta t for the input timeseries
+        new_times - array with the times of the output samples
+        half_width - kernel support, in input samples on each side
+        beta - shape of the Kaiser window
+        chunk_size - number of output samples computed at a time
+    Outputs:
+        new_data - interpolated timeseries
+    """
+    # Zeros around the data, kernel taps can fall outside the record
+    padded = np.concatenate([np.zeros(half_width),
+                             np.asarray(data, dtype=np.float64),
+                             np.zeros(half_width)])
+    offsets = np.arange(1 - half_width, half_width + 1)
+    positions = np.asarray(new_times) / old_dt
+    new_data = np.empty(positions.size)
+
+    for start in range(0, positions.size, chunk_size):
+        chunk = positions[start:start + chunk_size]
+        indexes = np.floor(chunk).astype(int)[:, np.newaxis] + offsets
+        distances = chunk[:, np.newaxis] - indexes
+        window = np.i0(beta * np.sqrt(np.clip(1.0 - (distances /
+                                                     half_width)**2,
+                                              0.0, None))) / np.i0(beta)
+        weights = np.sinc(distances) * window
+        new_data[start:start + chunk_size] = np.sum(padded[indexes +
+                                                           half_width] *
+                                                    weights, axis=1)
+
+    return new_data
+
+def get_interp_cache_key(data, samples, old_dt, new_dt,
+                         debug=False, debug_plot=None):
+    """
+    Returns the cache key for the interp output, None in debug
+    mode so the debug plot is always created
+    """
+    if debug:
+        return None
+    return get_cache_key('interp', data, samples, old_dt, new_dt)
+
+@memoize('interp', key=get_interp_cache_key)
 def interp(data, samples, old_dt, new_dt,
            debug=False, debug_plot=None):
     """
-    Calls the sinc interp method
+    Calls the sinc interp method, see sinc_resample
 
     Inputs:
         data - input timeseries
@@ -898,39 +1973,87 @@ def interp(data, samples, old_dt, new_dt,
 
     new_times = np.arange(0, samples * old_dt, new_dt)
 
-    sinc_matrix = (np.tile(new_times, (len(old_times), 1)) -
-                   np.tile(old_times[:, np.newaxis], (1, len(new_times))))
-    new_data = np.dot(data, np.sinc(sinc_matrix / old_dt))
+    new_data = sinc_resample(data, old_dt, new_times)
 
     if debug:
-        # Find data to plot, from t=10s until t=10s+50pts
-        old_start_idx = int(10.0 // old_dt) + 1
-        old_end_idx = old_start_idx + 50
-        if len(old_times) < old_end_idx:
-            print("[INFO]: Not enough data to create debug plot!")
-            return new_data
-        new_start_idx = int(10.0 // new_dt) + 1
-        new_end_idx = int(old_times[old_end_idx] // new_dt) + 1
-
-        # Initialize plot
-        fig, _ = plt.subplots()
-        fig.clf()
-
-        plt.plot(old_times[old_start_idx:old_end_idx],
-                 data[old_start_idx:old_end_idx], 'o',
-                 new_times[new_start_idx:new_end_idx],
-                 new_data[new_start_idx:new_end_idx], 'x')
-        plt.grid(True)
-        plt.xlabel('Seconds')
-        plt.title(os.path.splitext(os.path.basename(debug_plot))[0])
-        plt.savefig(debug_plot, format='png',
-                    transparent=False, dpi=300)
-        pylab.close()
+        plot_resampling(data, old_times, new_data, new_times, debug_plot)
 
     return new_data
 
+def plot_resampling(data, old_times, new_data, new_times, debug_plot):
+    """
+    Creates the resampling debug plot, with input and output samples
+    from t=10s until t=10s+50pts
+    """
+    old_dt = old_times[1] - old_times[0]
+    new_dt = new_times[1] - new_times[0]
+
+    # Find data to plot, from t=10s until t=10s+50pts
+    old_start_idx = int(10.0 // old_dt) + 1
+    old_end_idx = old_start_idx + 50
+    if len(old_times) < old_end_idx:
+        print("[INFO]: Not enough data to create debug plot!")
+        return
+    new_start_idx = int(10.0 // new_dt) + 1
+    new_end_idx = int(old_times[old_end_idx] // new_dt) + 1
+
+    # Initialize plot
+    fig, _ = plt.subplots()
+    fig.clf()
+
+    plt.plot(old_times[old_start_idx:old_end_idx],
+             data[old_start_idx:old_end_idx], 'o',
+             new_times[new_start_idx:new_end_idx],
+             new_data[new_start_idx:new_end_idx], 'x')
+    plt.grid(True)
+    plt.xlabel('Seconds')
+    plt.title(os.path.splitext(os.path.basename(debug_plot))[0])
+    plt.savefig(debug_plot, format='png',
+                transparent=False, dpi=300)
+    pylab.close()
+
+def get_rational_ratio(old_dt, new_dt, max_factor=RESAMPLE_MAX_FACTOR):
+    """
+    Returns the (up, down) factors such that new_dt = old_dt * down / up,
+    or None if there are no such factors up to max_factor
+    """
+    ratio = new_dt / old_dt
+    fraction = Fraction(ratio).limit_denominator(max_factor)
+    if fraction.numerator > max_factor:
+        return None
+    if abs(float(fraction) - ratio) > 1e-9 * ratio:
+        return None
+
+    return fraction.denominator, fraction.numerator
+
+@memoize('resample_rational')
+def resample_rational(data, up, down, old_dt, fmax):
+    """
+    Resamples data by up/down with a polyphase filter, the FIR
+    anti-alias filter (low-pass at fmax) is applied in the same
+    pass and only the output samples kept are computed. The line
+    through the first and last samples is removed before filtering
+    and added back after, so records that do not end at zero get no
+    step at their ends
+
+    Inputs:
+        data - input timeseries
+        up - upsampling factor
+        down - downsampling factor
+        old_dt - delta t for the input timeseries
+        fmax - frequency (Hz) for the low-pass filter
+    Outputs:
+        new_data - output timeseries, with delta t old_dt * down / up
+    """
+    half_len = RESAMPLE_HALF_WIDTH * max(up, down)
+    taps = firwin(2 * half_len + 1, fmax, window=('kaiser', 8.0),
+                  fs=up / old_dt)
+
+    return resample_poly(data, up, down, window=taps, padtype='line')
+
 def process_station_dt(station, new_dt, fmax,
-                       debug=False, debug_plots_base=None):
+                       debug=False, debug_plots_base=None,
+                       method='interp'):
     """
     Process the station to set a common dt
 
@@ -940,6 +2063,7 @@ def process_station_dt(station, new_dt, fmax,
         fmax - frequency (Hz) to be used in low-pass filter
         debug - flag to output extra information and debug plot
         debug_plots_base - basename for the debug plots
+        method - resampling method, see process_timeseries_dt
     Outputs:
         station - station array structure with 3 TimeseriesComponent with
                   acc/vel/dis components resampled to new_dt
@@ -953,14 +2077,22 @@ def process_station_dt(station, new_dt, fmax,
                                            fmax, debug=debug,
                                            debug_plots_base="%s.%s" %
                                            (debug_plots_base,
-                                            debug_orientation))
+                                            debug_orientation),
+                                           method=method)
     return station
 
 def process_timeseries_dt(timeseries, new_dt, fmax,
-                          debug=False, debug_plots_base=None):
+                          debug=False, debug_plots_base=None,
+                          method='interp'):
     """
     Processes a timeseries by first filtering the data using a lowpass
     filter using fmax, and then adjusting the dt to the specified new_dt.
+    With the 'polyphase' method, when new_dt / dt is a simple ratio and
+    fmax is below both Nyquist frequencies, both steps are done together
+    by a polyphase filter, see resample_rational. Its anti-alias filter
+    is a Kaiser FIR instead of the 4th order Butterworth, with a much
+    sharper cutoff, so outputs differ from the 'interp' method around
+    fmax.
 
     Inputs:
         timeseries - input TimeseriesComponent structure
@@ -968,33 +2100,52 @@ def process_timeseries_dt(timeseries, new_dt, fmax,
         fmax - frequency (Hz) to be used in low-pass filter
         debug - flag to output extra information and debug plot
         debug_plots_base - basename for the debug plots
+        method - 'interp' or 'polyphase'
     Outputs:
         timeseries - output TimeseriesComponent structure after
                      filtering and resampling
     """
-    # call low_pass filter at fmax
-    timeseries = filter_timeseries(timeseries, family='butter',
-                                   btype='lowpass', fmax=fmax,
-                                   N=4, debug=debug)
-
-    # interpolate
-    timeseries.acc = interp(timeseries.acc,
-                            timeseries.samples,
-                            timeseries.dt,
-                            new_dt, debug=debug,
-                            debug_plot="%s.acc.png" % (debug_plots_base))
-    timeseries.vel = interp(timeseries.vel,
-                            timeseries.samples,
-                            timeseries.dt,
-                            new_dt, debug=debug,
-                            debug_plot="%s.vel.png" % (debug_plots_base))
-    timeseries.dis = interp(timeseries.dis,
-                            timeseries.samples,
-                            timeseries.dt,
-                            new_dt, debug=debug,
-                            debug_plot="%s.dis.png" % (debug_plots_base))
-
-    timeseries.samples = timeseries.acc.size
+    if method not in RESAMPLE_METHODS:
+        print("[ERROR]: Unknown resampling method: %s" % (method))
+        sys.exit(-1)
+
+    quantities = timeseries.stored_quantities()
+    ratio = None
+    if method == 'polyphase' and fmax < 0.5 / max(timeseries.dt, new_dt):
+        ratio = get_rational_ratio(timeseries.dt, new_dt)
+    if ratio is not None and ratio != (1, 1):
+        # resample_poly does not filter when up and down are both 1
+        up, down = ratio
+        if debug:
+            print("[INFO]: Resampling timeseries: old_dt: %.3f - "
+                  "new_dt: %.3f - up=%d, down=%d, fmax=%.2f" %
+                  (timeseries.dt, new_dt, up, down, fmax))
+        for quantity in quantities:
+            data = timeseries.get_quantity(quantity)
+            new_data = resample_rational(data, up, down,
+                                         timeseries.dt, fmax)
+            if debug:
+                plot_resampling(data, np.arange(data.size) * timeseries.dt,
+                                new_data, np.arange(new_data.size) * new_dt,
+                                "%s.%s.png" % (debug_plots_base, quantity))
+            timeseries.set_quantity(quantity, new_data)
+    else:
+        # call low_pass filter at fmax
+        timeseries = filter_timeseries(timeseries, family='butter',
+                                       btype='lowpass', fmax=fmax,
+                                       N=4, debug=debug)
+
+        # interpolate
+        for quantity in quantities:
+            timeseries.set_quantity(quantity,
+                                    interp(timeseries.get_quantity(quantity),
+                                           timeseries.samples,
+                                           timeseries.dt,
+                                           new_dt, debug=debug,
+                                           debug_plot="%s.%s.png" %
+                                           (debug_plots_base, quantity)))
+
+    timeseries.samples = timeseries.get_quantity(quantities[0]).size
     timeseries.dt = new_dt
 
     return timeseries
@@ -1009,25 +2160,14 @@ def check_station_data(station):
     Outputs:
         station - same as input, or False if any problems found
     """
-    for i in range(0, len(station)):
-        timeseries = station[i]
-
-        if timeseries.acc.size == 0:
-            print("[ERROR]: Empty array after processing timeseries.")
-            return False
-        if timeseries.vel.size == 0:
-            print("[ERROR]: Empty array after processing timeseries.")
-            return False
-        if timeseries.dis.size == 0:
-            print("[ERROR]: Empty array after processing timeseries.")
-            return False
-        if np.isnan(np.sum(timeseries.acc)):
-            print("[ERROR]: NaN data after processing timeseries.")
-            return False
-        if np.isnan(np.sum(timeseries.vel)):
-            print("[ERROR]: NaN data after processing timeseries.")
-            return False
-        if np.isnan(np.sum(timeseries.dis)):
-            print("[ERROR]: NaN data after processing timeseries.")
-            return False
+    for timeseries in station:
+        # Derived quantities come from the stored ones
+        for quantity in timeseries.stored_quantities():
+            data = timeseries.get_quantity(quantity)
+            if data.size == 0:
+                print("[ERROR]: Empty array after processing timeseries.")
+                return False
+            if np.isnan(np.sum(data)):
+                print("[ERROR]: NaN data after processing timeseries.")
+                return False
     return station
@@ -39,7 +39,7 @@ import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from ts_library import get_points, FAS, calculate_rd50
+from ts_library import get_points, FAS, calculate_rd50_batch
 
 def plot_overlay_timeseries(args, filenames, stations,
                             output_file, plot_title=None):
@@ -203,14 +203,7 @@ def comparison_plot(args, filenames, stations,
     min_is = [int(xtmin/delta_t) for delta_t in delta_ts]
     max_is = [int(xtmax/delta_t) for delta_t in delta_ts]
 
-    rd50s = [calculate_rd50(station,
-                            min_i,
-                            max_i,
-                            tmin,
-                            tmax,
-                            False) for station, min_i, max_i in zip(stations,
-                                                                    min_is,
-                                                                    max_is)]
+    rd50s = calculate_rd50_batch(stations, min_is, max_is, tmin, tmax, False)
 
     f, axarr = plt.subplots(nrows=3, ncols=3, figsize=(14, 9))
     for i in range(0, 3):
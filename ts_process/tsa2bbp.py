@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+BSD 3-Clause License
+
+Copyright (c) 2018, Southern California Earthquake Center
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* Neither the name of the copyright holder nor the names of its
+  contributors may be used to endorse or promote products derived from
+  this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Utility to convert stations in an archive file back to BBP format
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import argparse
+
+# Import seismtools needed functions
+from file_utilities import get_time_axis, write_data_columns
+from ts_archive import list_archive, read_archive_station
+
+def parse_arguments():
+    """
+    This function takes care of parsing the command-line arguments and
+    asking the user for any missing parameters that we need
+    """
+    parser = argparse.ArgumentParser(description="Converts stations in "
+                                     "an archive file to BBP format, "
+                                     "generating displacement, velocity "
+                                     "and acceleration BBP files.")
+    parser.add_argument("-o", "--output", dest="outdir", required=True,
+                        help="output directory name")
+    parser.add_argument("-s", "--station", dest="stations",
+                        action="append",
+                        help="station to convert (default: all stations)")
+    parser.add_argument("input_file", help="input archive file")
+    args = parser.parse_args()
+
+    return args
+
+def format_orientation(orientation):
+    """
+    Returns the text for a horizontal orientation, without decimals
+    when it is a whole number of degrees
+    """
+    orientation = float(orientation)
+    if orientation.is_integer():
+        return "%d" % (orientation)
+    return "%s" % (orientation)
+
+def get_bbp_header(quantity, metadata, station):
+    """
+    Returns the header lines for one of the BBP files, using the
+    original header if the archive has one
+    """
+    if quantity in metadata.get('headers', {}):
+        return metadata['headers'][quantity]
+
+    file_types = {'dis': ['displacement', 'cm'],
+                  'vel': ['velocity', 'cm/s'],
+                  'acc': ['acceleration', 'cm/s^2']}
+    file_type = file_types[quantity][0]
+    file_unit = file_types[quantity][1]
+    units = metadata.get('units')
+    if units is not None and units.startswith("m"):
+        file_unit = "m%s" % (file_unit[2:])
+    orientations = []
+    for component in station:
+        if isinstance(component.orientation, str):
+            orientations.append(component.orientation)
+        else:
+            orientations.append(format_orientation(component.orientation))
+
+    header = ["#     Station= %s" % (metadata.get('station') or "NoName"),
+              "#        time= %s" % (metadata.get('time') or
+                                     "00/00/00,00:00:00.00 UTC"),
+              "#         lon= %s" % (metadata.get('lon') or "0.00"),
+              "#         lat= %s" % (metadata.get('lat') or "0.00"),
+              "#       units= %s" % (file_unit),
+              "# orientation= %s" % (",".join(orientations)),
+              "#",
+              "# Data fields are TAB-separated",
+              "# Column 1: Time (s)",
+              "# Column 2: H1 component ground "
+              "%s (+ is %s)" % (file_type, orientations[0]),
+              "# Column 3: H2 component ground "
+              "%s (+ is %s)" % (file_type, orientations[1]),
+              "# Column 4: V component ground "
+              "%s (+ is %s)" % (file_type, orientations[2]),
+              "#"]
+
+    return header
+
+def write_station_bbp(station, name, metadata, output_dir):
+    """
+    Writes the dis/vel/acc BBP files for a station
+    """
+    time = get_time_axis(station[0].samples, station[0].dt)
+
+    for quantity in ['dis', 'vel', 'acc']:
+        filename = os.path.join(output_dir, "%s.%s.bbp" % (name, quantity))
+        try:
+            out_fp = open(filename, 'w')
+        except IOError as e:
+            print(e)
+            continue
+
+        # Write header
+        for item in get_bbp_header(quantity, metadata, station):
+            out_fp.write("%s\n" % (item))
+
+        # Write timeseries
+        write_data_columns(out_fp, [time] + [getattr(component, quantity)
+                                             for component in station])
+        out_fp.close()
+        print("[WRITING]: %s" % (filename))
+
+def tsa2bbp_main():
+    """
+    Main function for the tsa2bbp conversion utility
+    """
+    args = parse_arguments()
+
+    if not os.path.isdir(args.outdir):
+        print("[ERROR]: Output directory does not exist: %s" % (args.outdir))
+        sys.exit(-1)
+
+    names = args.stations
+    if names is None:
+        names = list_archive(args.input_file)
+
+    for name in names:
+        metadata = {}
+        station = read_archive_station(args.input_file, name,
+                                       metadata=metadata)
+        write_station_bbp(station, name, metadata, args.outdir)
+
+# ============================ MAIN ==============================
+if __name__ == "__main__":
+    tsa2bbp_main()
+# end of main program